@@ -0,0 +1,22 @@
+import os
+import streamlit as st
+
+ENV_PREFIX = "FAHRTEN_"
+
+def get_setting(name, default=None, cast=str):
+    """
+    Reads a deployment setting, in this order:
+    the FAHRTEN_<NAME> environment variable, then `name` in .streamlit/secrets.toml, then default.
+    Args:
+        name: Setting name, e.g. "ROUTING_BACKEND".
+        default: Value returned when the setting is not configured anywhere.
+        cast: Callable applied to configured values (e.g. int, float).
+    """
+    value = os.environ.get(ENV_PREFIX + name)
+    if value is None:
+        try:
+            value = st.secrets[name]
+        except Exception:
+            # Not in secrets, or no secrets file at all (scripts, benchmarks)
+            return default
+    return cast(value)
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
+from Config_Fahrten import get_setting
+from QueryCache_Fahrten import query_cache, change_log
+
+# Single configuration point for the database location (env FAHRTEN_DB_FILE or DB_FILE in secrets.toml)
+DB_FILE = get_setting("DB_FILE", "priminsberg_rides.db")
+
+POOL_SIZE = get_setting("DB_POOL_SIZE", 8, int)  # Idle connections kept open per process
+BUSY_TIMEOUT_MS = 5000                            # Wait for the write lock instead of failing at once
+CACHE_SIZE_KIB = 20000                            # Page cache per connection (~20 MB)
+
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",        # Readers no longer block on the writer (persisted in the file)
+    "PRAGMA synchronous=NORMAL",      # Safe with WAL; fsync at checkpoints instead of every commit
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA foreign_keys=ON",
+    f"PRAGMA cache_size=-{CACHE_SIZE_KIB}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)  # LIFO: reuse the warmest connection first
+_pool_lock = threading.Lock()
+_pool_db_file = DB_FILE
+
+def _open_connection(db_file):
+    # Connections move between Streamlit script threads, but only one thread uses a connection at a time
+    conn = sqlite3.connect(db_file, check_same_thread=False)
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+@contextmanager
+def db_connection():
+    """
+    Borrows a tuned connection from the process-wide pool.
+    Behaves like `with sqlite3.connect(DB_FILE) as conn:` (commit on success, rollback on
+    error), but the connection is handed back to the pool instead of being reopened next time.
+    """
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(_pool_db_file)
+    conn.set_trace_callback(_trace_statement if _query_counters else None)
+    try:
+        with conn:
+            yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def open_connection():
+    """A tuned connection to the current database file outside the pool, for a caller that keeps it open."""
+    with _pool_lock:
+        db_file = _pool_db_file
+    return _open_connection(db_file)
+
+def close_all_connections():
+    """Closes every pooled connection (e.g. before deleting or replacing the database file)."""
+    with _pool_lock:
+        while True:
+            try:
+                _pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+def use_database(db_file):
+    """
+    Points the pool at another database file (scripts, benchmarks); pooled connections are closed
+    first and cached query results, which belong to the previous file, are dropped.
+    """
+    global _pool_db_file
+    with _pool_lock:
+        _pool_db_file = db_file
+    close_all_connections()
+    change_log.reset()
+    query_cache.clear()
+
+# --- Query counting (benchmarks and self-checks) ---
+
+_query_counters = []
+_query_counters_lock = threading.Lock()
+
+def _trace_statement(statement):
+    with _query_counters_lock:
+        for counter in _query_counters:
+            counter.append(statement)
+
+@contextmanager
+def count_queries():
+    """
+    Records every SQL statement run through db_connection() inside the block, in any thread.
+    Yields the list the statements are appended to:
+        with count_queries() as statements:
+            show_display_rides()
+        print(len(statements))
+    """
+    statements = []
+    with _query_counters_lock:
+        _query_counters.append(statements)
+    try:
+        yield statements
+    finally:
+        with _query_counters_lock:
+            _query_counters.remove(statements)
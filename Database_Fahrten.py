@@ -13,8 +13,27 @@ from datetime import date, datetime
 from PIL import Image
 import os
 import base64 
+import threading
+import time
+import random
+import re
+import json
+import numpy as np
 from Utils_Fahrten import get_user_by_username_db
-DB_FILE = 'priminsberg_rides.db'
+from Connection_Fahrten import DB_FILE, db_connection, close_all_connections
+from Geo_Fahrten import haversine_km, bounding_box
+from Routing_Fahrten import prefetch_geodata
+from Migrations_Fahrten import ensure_schema
+from Locations_Fahrten import resolve_location, find_location, count_ride_places
+from Matching_Fahrten import refresh_ride_route, forget_ride_route
+from Ranking_Fahrten import RANKING_MAX_CANDIDATES
+from Config_Fahrten import get_setting
+from QueryCache_Fahrten import cached_query, invalidate_queries
+RIDE_EXPIRY_INTERVAL_SECONDS = get_setting("RIDE_EXPIRY_INTERVAL_SECONDS", 3600, int)
+RIDE_EXPIRY_BATCH_SIZE = 200
+RIDES_PAGE_SIZE = get_setting("RIDES_PAGE_SIZE", 20, int)
+BOOKING_MAX_ATTEMPTS = 3            # BEGIN IMMEDIATE attempts when the write lock stays busy
+BOOKING_RETRY_PAUSE_SECONDS = 0.05
 UPLOAD_DIR = "uploads" # Base directory for all uploaded files
 PROFILE_PICTURES_DIR = os.path.join(UPLOAD_DIR, "profile_pictures")
 VEHICLE_PICTURES_DIR = os.path.join(UPLOAD_DIR, "vehicle_pictures")
@@ -128,90 +147,37 @@ def save_image(uploaded_file, directory, prefix):
 
 def setup_db():
     """
-    Configures the SQLite database, creating tables and adding columns if they don't exist.
-    Handles tables for users, rides, bookings, and vehicles, including image paths.
+    Brings the SQLite schema up to date (users, rides, bookings, vehicles and the geo caches).
+    The schema itself lives in Migrations_Fahrten.MIGRATIONS; the migrations run once per
+    process, so calling this on every Streamlit rerun is cheap.
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-
-        # Table users with profile_picture
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            first_name TEXT,
-            last_name TEXT,
-            station TEXT,
-            email TEXT,
-            phone TEXT,
-            driving_license_date TEXT,
-            profile_picture TEXT -- Path to the profile picture
-        )''')
-
-        # Add columns if they don't exist (for backward compatibility)
-        # This loop is generally good for adding new columns to existing databases
-        for column in ['driving_license_date', 'profile_picture']:
-            try:
-                c.execute(f'ALTER TABLE users ADD COLUMN {column} TEXT')
-            except sqlite3.OperationalError as e:
-                # Ignore "duplicate column name" errors
-                if "duplicate column name" not in str(e):
-                    print(f"Error adding column {column} to users table: {e}")
-
-        # Table rides
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS rides (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            provider_id INTEGER,
-            start_location TEXT,
-            destination TEXT,
-            date TEXT,
-            time TEXT,
-            available_seats INTEGER,
-            FOREIGN KEY(provider_id) REFERENCES users(id)
-        )''')
-
-        # Table bookings
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            ride_id INTEGER,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(ride_id) REFERENCES rides(id)
-        )''')
-
-        # Table vehicul with image paths
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS vehicul (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            marque TEXT,
-            model TEXT,
-            date_mise_en_circulation TEXT,
-            picture_inter1 TEXT, -- Path to interior picture 1
-            picture_inter2 TEXT, -- Path to interior picture 2
-            picture_exter1 TEXT, -- Path to exterior picture 1
-            picture_exter2 TEXT, -- Path to exterior picture 2
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )''')
-        conn.commit()
+    ensure_schema()
 
 # --- User Management Functions ---
 
+def _station_place(station):
+    """
+    Returns the (station_location_id, station_lat, station_lon) values stored on a user row.
+    The station is resolved like a ride's places (see _ride_places), once, when the profile is saved.
+    """
+    location_id, coords = resolve_location(station)
+    return (location_id,) + tuple(coords or (None, None))
+
 def register_user_db(username, password_hash, first_name, last_name, station, email, phone, driving_license_date=None, profile_picture=None):
     """
     Registers a new user with an optional profile picture.
     Returns the new user's ID or None if the username already exists.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    place = _station_place(station)
+    with db_connection() as conn:
         c = conn.cursor()
         try:
             c.execute('''
-                INSERT INTO users (username, password, first_name, last_name, station, email, phone, driving_license_date, profile_picture) 
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (username, password_hash, first_name, last_name, station, email, phone, driving_license_date, profile_picture))
+                INSERT INTO users (username, password, first_name, last_name, station, email, phone, driving_license_date, profile_picture,
+                                   station_location_id, station_lat, station_lon)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (username, password_hash, first_name, last_name, station, email, phone, driving_license_date, profile_picture) + place)
+            invalidate_queries(conn, "users") # Also drops a cached "unknown username"
             conn.commit()
             return c.lastrowid
         except sqlite3.IntegrityError:
@@ -225,14 +191,32 @@ def update_user_profile_db(user_id, first_name, last_name, station, email, phone
     Updates a user's profile information (excluding profile picture).
     Returns True on success.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    place = _station_place(station)
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute('''
-            UPDATE users SET first_name=?, last_name=?, station=?, email=?, phone=?, driving_license_date=? 
+            UPDATE users SET first_name=?, last_name=?, station=?, email=?, phone=?, driving_license_date=?,
+                             station_location_id=?, station_lat=?, station_lon=?
             WHERE id=?
-        ''', (first_name, last_name, station, email, phone, driving_license_date, user_id))
+        ''', (first_name, last_name, station, email, phone, driving_license_date) + place + (user_id,))
+        invalidate_queries(conn, "users")
+        conn.commit()
+    return True
+
+def update_user_station_place(user_id, station):
+    """
+    Resolves and stores the location of a station saved before it was stored with the profile.
+    Returns the station's (lat, lon), or None while it cannot be geocoded (nothing is stored then).
+    """
+    place = _station_place(station)
+    if place[1] is None:
+        return None
+    with db_connection() as conn:
+        conn.execute("UPDATE users SET station_location_id=?, station_lat=?, station_lon=? WHERE id=? AND station=?",
+                     place + (user_id, station))
+        invalidate_queries(conn, "users")
         conn.commit()
-        return True
+    return place[1], place[2]
 
 def update_user_profile_picture(user_id, image_path):
     """
@@ -240,7 +224,7 @@ def update_user_profile_picture(user_id, image_path):
     Deletes the old picture file if it exists.
     Returns True on success.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         # Retrieve the old image path to delete the file
         c.execute("SELECT profile_picture FROM users WHERE id=?", (user_id,))
@@ -251,83 +235,455 @@ def update_user_profile_picture(user_id, image_path):
         
         # Update with the new image path
         c.execute("UPDATE users SET profile_picture=? WHERE id=?", (image_path, user_id))
+        invalidate_queries(conn, "users")
         conn.commit()
-        return True
+    return True
 
 # --- Ride Management Functions ---
 
-def add_ride_db(provider_id, start_location, destination, date, time, available_seats):
-    """Adds a new ride to the database."""
-    with sqlite3.connect(DB_FILE) as conn:
+def _coords(lat, lon):
+    return (lat, lon) if lat is not None and lon is not None else None
+
+def _ride_places(start_location, destination, start_coords=None, dest_coords=None):
+    """
+    Returns the (start_location_id, destination_id, start_lat, start_lon, dest_lat, dest_lon)
+    values stored on a ride row.
+    Both addresses are resolved to their canonical location (see Locations_Fahrten), which is
+    only geocoded the first time a place is seen; coordinates passed in take precedence.
+    Unresolved coordinates are stored as NULL and picked up by the backfill.
+    """
+    start_id, start_place = resolve_location(start_location, start_coords)
+    dest_id, dest_place = resolve_location(destination, dest_coords)
+    start_lat, start_lon = start_coords or start_place or (None, None)
+    dest_lat, dest_lon = dest_coords or dest_place or (None, None)
+    return start_id, dest_id, start_lat, start_lon, dest_lat, dest_lon
+
+def departure_at(date, time):
+    """
+    Returns the sortable departure timestamp stored in rides.departure_at.
+    Args:
+        date: Ride date as stored in rides.date (DD.MM.YYYY).
+        time: Ride time as stored in rides.time (HH:MM).
+    Returns:
+        'YYYY-MM-DD HH:MM', or None if date/time are not in the expected format.
+    """
+    try:
+        return datetime.strptime(f"{date} {time}", "%d.%m.%Y %H:%M").strftime("%Y-%m-%d %H:%M")
+    except (TypeError, ValueError):
+        return None
+
+def add_ride_db(provider_id, start_location, destination, date, time, available_seats, start_coords=None, dest_coords=None):
+    """Adds a new ride to the database, referencing the canonical locations of its start and destination."""
+    places = _ride_places(start_location, destination, start_coords, dest_coords)
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute('''
-            INSERT INTO rides (provider_id, start_location, destination, date, time, available_seats) 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (provider_id, start_location, destination, date, time, available_seats))
+            INSERT INTO rides (provider_id, start_location, destination, date, time, departure_at, available_seats,
+                               start_location_id, destination_id, start_lat, start_lon, dest_lat, dest_lon)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (provider_id, start_location, destination, date, time, departure_at(date, time), available_seats) + places)
+        invalidate_queries(conn, "rides")
         conn.commit()
-        return c.lastrowid
+    count_ride_places(places[0], places[1])
+    refresh_ride_route(c.lastrowid, _coords(places[2], places[3]), _coords(places[4], places[5]))
+    return c.lastrowid
 
+@cached_query(("rides", "users"))
 def get_rides_db():
     """Retrieves all available rides, joining with user information."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute('''
             SELECT r.id, u.username, r.start_location, r.destination, r.date, r.time, r.available_seats 
             FROM rides r JOIN users u ON r.provider_id = u.id
-            ORDER BY r.date, r.time
+            ORDER BY r.departure_at
         ''')
         return c.fetchall()
 
+RIDE_POINT_INDEXES = {  # R*Tree of each ride end point -> matching columns of rides
+    "start": ("rides_start_geo", "start_lat", "start_lon"),
+    "destination": ("rides_dest_geo", "dest_lat", "dest_lon"),
+}
+
+def find_rides_near_db(center, radius_km, point="start"):
+    """
+    Finds the rides whose start (or destination) lies within radius_km of center.
+    The R*Tree returns the candidates inside the bounding box in logarithmic time;
+    the exact haversine distance then drops the box corners.
+    Args:
+        center: (lat, lon) of the reference point, e.g. the user's geocoded station.
+        radius_km: Search radius in kilometres.
+        point: "start" or "destination".
+    Returns:
+        A list of (ride_id, distance_km), nearest first.
+    """
+    table, lat, lon = RIDE_POINT_INDEXES[point]
+    min_lat, max_lat, min_lon, max_lon = bounding_box(center, radius_km)
+    with db_connection() as conn:
+        # Overlap test: R*Tree stores 32-bit floats, rounded outwards
+        candidates = conn.execute(f'''
+            SELECT r.id, r.{lat}, r.{lon} FROM {table} g JOIN rides r ON r.id = g.id
+            WHERE g.max_lat >= ? AND g.min_lat <= ? AND g.max_lon >= ? AND g.min_lon <= ?
+        ''', (min_lat, max_lat, min_lon, max_lon)).fetchall()
+    nearby = []
+    for ride_id, ride_lat, ride_lon in candidates:
+        distance = haversine_km(center, (ride_lat, ride_lon))
+        if distance <= radius_km:
+            nearby.append((ride_id, distance))
+    nearby.sort(key=lambda item: item[1])
+    return nearby
+
+def fts_prefix_query(column, text):
+    """
+    Builds an FTS5 query matching every word of `text` as a prefix in one rides_fts column,
+    e.g. ("start_location", "Bad Zur") -> 'start_location : ("bad"* "zur"*)'.
+    Returns None when `text` has no words.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return None
+    # Quoting each word keeps FTS5 operators typed by the user (AND, NEAR, ^, ...) literal
+    return f"{column} : (" + " ".join(f'"{word.lower()}"*' for word in words) + ")"
+
+def _ride_search_conditions(user_id, origin=None, destination=None, date_from=None, date_to=None,
+                            min_seats=1, driver=None, ride_ids=None, along_ride_ids=None):
+    """WHERE conditions and parameters shared by search_rides_db and get_ride_candidates_db."""
+    conditions = [
+        "r.available_seats >= ?",
+        "r.departure_at >= DATE('now')",
+        "r.provider_id != ?",
+        "r.id NOT IN (SELECT ride_id FROM bookings WHERE user_id=?)",
+    ]
+    params = [max(1, min_seats or 1), user_id, user_id]
+    match = " AND ".join(q for q in (fts_prefix_query("start_location", origin),
+                                      fts_prefix_query("destination", destination)) if q)
+    if match and along_ride_ids is not None:
+        # Text matches plus the rides passing along the way
+        conditions.append("(r.id IN (SELECT rowid FROM rides_fts WHERE rides_fts MATCH ?)"
+                          " OR r.id IN (SELECT value FROM json_each(?)))")
+        params.extend([match, json.dumps(list(along_ride_ids))])
+    elif match:
+        conditions.append("r.id IN (SELECT rowid FROM rides_fts WHERE rides_fts MATCH ?)")
+        params.append(match)
+    if date_from:
+        conditions.append("r.departure_at >= ?")
+        params.append(date_from.strftime("%Y-%m-%d"))
+    if date_to:
+        # 'YYYY-MM-DD ~' sorts after every time of that day
+        conditions.append("r.departure_at < ?")
+        params.append(date_to.strftime("%Y-%m-%d") + " ~")
+    if driver:
+        conditions.append("u.username = ?")
+        params.append(driver.strip())
+    if ride_ids is not None:
+        conditions.append("r.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(ride_ids)))
+    return conditions, params
+
+@cached_query(("rides", "users"))
+def search_rides_db(user_id, origin=None, destination=None, date_from=None, date_to=None,
+                    min_seats=1, driver=None, ride_ids=None, along_ride_ids=None,
+                    after=None, limit=RIDES_PAGE_SIZE):
+    """
+    Searches the rides a user can still book; every filter runs in SQL.
+    Keyset pagination: the page starts right after the `after` cursor, so the query walks
+    idx_rides_departure for `limit` rows instead of the whole future catalog.
+    Args:
+        user_id: The viewing user; their own rides and rides they already booked are excluded.
+        origin, destination: Free text matched word by word (prefixes, accents ignored)
+            against start_location/destination through the rides_fts index.
+        date_from, date_to: Optional datetime.date bounds on the departure day (inclusive).
+        min_seats: Minimum number of free seats.
+        driver: Optional username of the driver.
+        ride_ids: Optional iterable restricting the search to these rides, e.g. the rides starting
+            near the user's station (find_rides_near_db), looked up once rather than for every page.
+        along_ride_ids: Optional iterable of rides found some other way (e.g. corridor matches),
+            included alongside the origin/destination text matches.
+        after: Cursor returned with the previous page, or None for the first page.
+        limit: Page size.
+    Returns:
+        (rows, next_cursor): rows are (id, provider username, start_location, destination, date, time,
+        available_seats, provider first_name, last_name, email, phone); next_cursor is None on the last page.
+    Results are cached (QueryCache_Fahrten) until the next ride, booking or user write.
+    """
+    conditions, params = _ride_search_conditions(user_id, origin, destination, date_from, date_to,
+                                                 min_seats, driver, ride_ids, along_ride_ids)
+    conditions.append("(r.departure_at, r.id) > (?, ?)")
+    params.extend(after if after else ("", 0))
+    with db_connection() as conn:
+        rows = conn.execute(f'''
+            SELECT r.id, u.username, r.start_location, r.destination, r.date, r.time, r.available_seats,
+                   u.first_name, u.last_name, u.email, u.phone, r.departure_at
+            FROM rides r
+            JOIN users u ON r.provider_id = u.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY r.departure_at, r.id
+            LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+    # One extra row tells whether another page exists without a COUNT(*)
+    next_cursor = (rows[limit - 1][11], rows[limit - 1][0]) if len(rows) > limit else None
+    return [row[:11] for row in rows[:limit]], next_cursor
+
+@cached_query(("rides",))
+def get_ride_columns_db(limit=RANKING_MAX_CANDIDATES):
+    """
+    Retrieves the future rides with free seats as NumPy columns, the same for every user.
+    Returns:
+        A read-only dict of arrays in departure order, at most `limit` rides: id, seats,
+        start_lat, start_lon, dest_lat, dest_lon (NaN where not geocoded), departure (datetime64[m]).
+    Cached once for all users (QueryCache_Fahrten) until the next ride or booking write.
+    """
+    with db_connection() as conn:
+        rows = conn.execute('''
+            SELECT id, available_seats, start_lat, start_lon, dest_lat, dest_lon, departure_at
+            FROM rides
+            WHERE available_seats >= 1 AND departure_at >= DATE('now')
+            ORDER BY departure_at, id
+            LIMIT ?
+        ''', (limit,)).fetchall()
+    ids, seats, start_lat, start_lon, dest_lat, dest_lon, departure_at = zip(*rows) if rows else ((),) * 7
+    columns = {
+        "id": np.array(ids, dtype=np.int64),
+        "seats": np.array(seats, dtype=np.int64),
+        "start_lat": np.array(start_lat, dtype=float),  # None -> NaN
+        "start_lon": np.array(start_lon, dtype=float),
+        "dest_lat": np.array(dest_lat, dtype=float),
+        "dest_lon": np.array(dest_lon, dtype=float),
+        "departure": np.array(departure_at, dtype="datetime64[m]"),
+    }
+    for column in columns.values():
+        column.setflags(write=False)  # Shared by every session
+    return columns
+
+def get_ride_candidates_db(user_id, origin=None, destination=None, date_from=None, date_to=None,
+                           min_seats=1, driver=None, ride_ids=None, along_ride_ids=None):
+    """
+    Selects the rides a user can book (same filters as search_rides_db) out of get_ride_columns_db.
+    Only the user's own rides and bookings, and the text or driver filters, are read from the
+    database (ids only); the other filters are masks over the shared columns.
+    Returns:
+        A dict of arrays shaped like get_ride_columns_db, restricted to the candidates.
+    """
+    columns = get_ride_columns_db()
+    keep = columns["seats"] >= max(1, min_seats or 1)
+    with db_connection() as conn:
+        excluded = conn.execute(
+            "SELECT id FROM rides WHERE provider_id=? UNION SELECT ride_id FROM bookings WHERE user_id=?",
+            (user_id, user_id)).fetchall()
+        if origin or destination or driver:
+            conditions, params = _ride_search_conditions(user_id, origin, destination, driver=driver,
+                                                         along_ride_ids=along_ride_ids)
+            matched = conn.execute(f'''
+                SELECT r.id FROM rides r JOIN users u ON r.provider_id = u.id
+                WHERE {" AND ".join(conditions)}
+            ''', params).fetchall()
+            keep &= np.isin(columns["id"], [row[0] for row in matched])
+    keep &= ~np.isin(columns["id"], [row[0] for row in excluded])
+    if date_from:
+        keep &= columns["departure"] >= np.datetime64(date_from, "D")
+    if date_to:
+        keep &= columns["departure"] < np.datetime64(date_to, "D") + 1
+    if ride_ids is not None:
+        keep &= np.isin(columns["id"], list(ride_ids))
+    return {name: column[keep] for name, column in columns.items()}
+
+def get_bookable_rides_db(user_id, after=None, limit=RIDES_PAGE_SIZE):
+    """One page of every ride a user can book: search_rides_db without filters."""
+    return search_rides_db(user_id, after=after, limit=limit)
+
 def delete_ride_db(ride_id):
-    """Deletes a ride from the database."""
-    with sqlite3.connect(DB_FILE) as conn:
+    """Deletes a ride and its bookings from the database."""
+    with db_connection() as conn:
         c = conn.cursor()
+        c.execute("DELETE FROM bookings WHERE ride_id=?", (ride_id,))
         c.execute("DELETE FROM rides WHERE id=?", (ride_id,))
+        invalidate_queries(conn, "rides", f"ride:{ride_id}")
         conn.commit()
-        return c.rowcount > 0
+    forget_ride_route(ride_id)
+    return c.rowcount > 0
 
-def update_ride_db(ride_id, start_location, destination, date, time, available_seats):
-    """Updates an existing ride's details."""
-    with sqlite3.connect(DB_FILE) as conn:
+def update_ride_db(ride_id, start_location, destination, date, time, available_seats, start_coords=None, dest_coords=None):
+    """
+    Updates an existing ride's details and re-resolves the locations of its start and destination.
+    A place the ride did not use before is counted for the autocomplete ranking, as in add_ride_db.
+    """
+    places = _ride_places(start_location, destination, start_coords, dest_coords)
+    with db_connection() as conn:
         c = conn.cursor()
+        previous = c.execute("SELECT start_location_id, destination_id FROM rides WHERE id=?", (ride_id,)).fetchone() or ()
         c.execute('''
-            UPDATE rides SET start_location=?, destination=?, date=?, time=?, available_seats=?
+            UPDATE rides SET start_location=?, destination=?, date=?, time=?, departure_at=?, available_seats=?,
+                             start_location_id=?, destination_id=?, start_lat=?, start_lon=?, dest_lat=?, dest_lon=?
             WHERE id=?
-        ''', (start_location, destination, date, time, available_seats, ride_id))
+        ''', (start_location, destination, date, time, departure_at(date, time), available_seats) + places + (ride_id,))
+        invalidate_queries(conn, "rides")
         conn.commit()
-        return c.rowcount > 0
+    if c.rowcount:
+        count_ride_places(*(location_id for location_id in places[:2] if location_id not in previous))
+    refresh_ride_route(ride_id, _coords(places[2], places[3]), _coords(places[4], places[5]))
+    return c.rowcount > 0
+
+def backfill_ride_coordinates(batch_size=25):
+    """
+    Links rides to their locations and fills the coordinates they are missing.
+    Works in batches ordered by id and commits after each batch, so an interrupted run
+    resumes with the rows that are still missing something. Places that cannot be
+    geocoded stay NULL (and are answered from the negative geocoding cache next time).
+    Returns the number of rides updated.
+    """
+    filled = 0
+    last_id = 0
+    while True:
+        with db_connection() as conn:
+            rows = conn.execute('''
+                SELECT id, start_location, destination FROM rides
+                WHERE id > ? AND (start_lat IS NULL OR dest_lat IS NULL
+                                  OR start_location_id IS NULL OR destination_id IS NULL)
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+        if not rows:
+            return filled
+        # Geocode the batch's new places concurrently; _ride_places then reads from the cache
+        unknown = [a for row in rows for a in row[1:] if not (find_location(a) or (None, None))[1]]
+        prefetch_geodata(addresses=unknown)
+        updates = [_ride_places(start_location, destination) + (ride_id,)
+                   for ride_id, start_location, destination in rows]
+        with db_connection() as conn:
+            conn.executemany('''
+                UPDATE rides SET start_location_id=COALESCE(start_location_id, ?), destination_id=COALESCE(destination_id, ?),
+                                 start_lat=COALESCE(start_lat, ?), start_lon=COALESCE(start_lon, ?),
+                                 dest_lat=COALESCE(dest_lat, ?), dest_lon=COALESCE(dest_lon, ?)
+                WHERE id=?
+            ''', updates)
+            invalidate_queries(conn, "rides")
+            conn.commit()
+        filled += len(updates)
+        last_id = rows[-1][0]
+
+_backfill_started = False
+_backfill_lock = threading.Lock()
+
+def start_ride_coordinates_backfill():
+    """Runs backfill_ride_coordinates once per process in a background thread, off the render path."""
+    global _backfill_started
+    with _backfill_lock:
+        if _backfill_started:
+            return
+        _backfill_started = True
+    threading.Thread(target=backfill_ride_coordinates, name="ride-coordinates-backfill", daemon=True).start()
+
+def archive_departed_rides(batch_size=RIDE_EXPIRY_BATCH_SIZE):
+    """
+    Moves rides whose departure day is over, with their bookings, into rides_archive/bookings_archive.
+    Each batch is its own short write transaction, so the write lock is never held for long.
+    Full rides are kept: the listing only hides them, and their passengers still see them.
+    Returns the number of rides archived.
+    """
+    archived = 0
+    while True:
+        with db_connection() as conn:
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM rides WHERE departure_at < DATE('now') ORDER BY departure_at LIMIT ?",
+                (batch_size,))]
+            if not ids:
+                return archived
+            placeholders = ",".join("?" * len(ids))
+            conn.execute(f'''
+                INSERT OR REPLACE INTO rides_archive (id, provider_id, start_location, destination, date, time,
+                    departure_at, available_seats, start_location_id, destination_id,
+                    start_lat, start_lon, dest_lat, dest_lon, archived_at)
+                SELECT id, provider_id, start_location, destination, date, time,
+                    departure_at, available_seats, start_location_id, destination_id,
+                    start_lat, start_lon, dest_lat, dest_lon, DATETIME('now')
+                FROM rides WHERE id IN ({placeholders})
+            ''', ids)
+            conn.execute(f'''
+                INSERT OR REPLACE INTO bookings_archive (id, user_id, ride_id, archived_at)
+                SELECT id, user_id, ride_id, DATETIME('now') FROM bookings WHERE ride_id IN ({placeholders})
+            ''', ids)
+            conn.execute(f"DELETE FROM bookings WHERE ride_id IN ({placeholders})", ids)
+            conn.execute(f"DELETE FROM rides WHERE id IN ({placeholders})", ids)
+            invalidate_queries(conn, "rides", *(f"ride:{ride_id}" for ride_id in ids))
+            conn.commit()
+        for ride_id in ids:
+            forget_ride_route(ride_id)
+        archived += len(ids)
+
+def _ride_expiry_loop():
+    while True:
+        try:
+            count = archive_departed_rides()
+            if count:
+                print(f"Archived {count} departed rides.")
+        except Exception as e:
+            print(f"Error archiving departed rides: {e}")
+        time.sleep(RIDE_EXPIRY_INTERVAL_SECONDS)
+
+_expiry_started = False
+_expiry_lock = threading.Lock()
+
+def start_ride_expiry_job():
+    """Starts the background thread archiving departed rides every RIDE_EXPIRY_INTERVAL_SECONDS (once per process)."""
+    global _expiry_started
+    with _expiry_lock:
+        if _expiry_started:
+            return
+        _expiry_started = True
+    threading.Thread(target=_ride_expiry_loop, name="ride-expiry", daemon=True).start()
 
 # --- Booking Management Functions ---
 
+def _is_busy(error):
+    """True for SQLITE_BUSY/SQLITE_LOCKED (and their extended codes): another writer holds the lock."""
+    code = getattr(error, "sqlite_errorcode", None)
+    return code is not None and code & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
 def book_ride_db(user_id, ride_id):
     """
-    Books a ride for a user, decrementing available seats.
-    Returns True on successful booking, False otherwise (e.g., no seats).
+    Books a seat on a ride for a user, atomically.
+    The seat is taken with a guarded UPDATE (available_seats > 0) and the booking inserted in the
+    same BEGIN IMMEDIATE transaction, so concurrent bookings can never oversell a ride.
+    If the write lock stays busy past busy_timeout, the transaction is retried up to
+    BOOKING_MAX_ATTEMPTS times with a short jittered pause.
+    Returns True on successful booking, False otherwise (no seat left, ride gone, already booked, lock busy).
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        c = conn.cursor()
-        c.execute("SELECT available_seats FROM rides WHERE id=?", (ride_id,))
-        current_seats = c.fetchone()
-        
-        if current_seats and current_seats[0] > 0:
-            # Check if user has already booked this ride to prevent duplicate bookings
-            c.execute("SELECT COUNT(*) FROM bookings WHERE user_id=? AND ride_id=?", (user_id, ride_id))
-            if c.fetchone()[0] > 0:
-                print(f"User {user_id} has already booked ride {ride_id}.")
-                return False # User already booked this ride
-
-            c.execute("INSERT INTO bookings (user_id, ride_id) VALUES (?, ?)", (user_id, ride_id))
-            c.execute("UPDATE rides SET available_seats=? WHERE id=?", (current_seats[0] - 1, ride_id))
-            conn.commit()
-            return True
-        return False # No seats available or ride not found
-
+    with db_connection() as conn:
+        for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                taken = conn.execute(
+                    "UPDATE rides SET available_seats = available_seats - 1 WHERE id=? AND available_seats > 0",
+                    (ride_id,)).rowcount
+                if not taken:
+                    conn.rollback()
+                    return False # No seats available or ride not found
+                try:
+                    conn.execute("INSERT INTO bookings (user_id, ride_id) VALUES (?, ?)", (user_id, ride_id))
+                except sqlite3.IntegrityError:
+                    # UNIQUE(user_id, ride_id): the rollback gives the seat back
+                    conn.rollback()
+                    print(f"User {user_id} has already booked ride {ride_id}.")
+                    return False
+                invalidate_queries(conn, "rides", f"ride:{ride_id}")
+                conn.commit()
+                return True
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if not _is_busy(e):
+                    raise
+                if attempt < BOOKING_MAX_ATTEMPTS:
+                    time.sleep(random.uniform(0, BOOKING_RETRY_PAUSE_SECONDS * attempt))
+        print(f"Booking ride {ride_id} for user {user_id} gave up: database busy.")
+        return False
+
+@cached_query(("rides", "users"))
 def get_user_bookings_db(user_id):
     """
     Retrieves all bookings made by a specific user.
     Returns a list of tuples containing ride details.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute('''
             SELECT r.id, u_provider.username, r.start_location, r.destination, r.date, r.time, r.available_seats
@@ -335,10 +691,40 @@ def get_user_bookings_db(user_id):
             JOIN rides r ON b.ride_id = r.id
             JOIN users u_provider ON r.provider_id = u_provider.id
             WHERE b.user_id = ?
-            ORDER BY r.date, r.time
+            ORDER BY r.departure_at
         ''', (user_id,))
         return c.fetchall()
 
+PASSENGER_QUERY_CHUNK = 500  # Ride ids per query, well under SQLite's bound-parameter limit
+
+@cached_query(lambda ride_ids: ("users",) + tuple(f"ride:{ride_id}" for ride_id in ride_ids))
+def get_passengers_by_ride_db(ride_ids):
+    """
+    Retrieves the passengers of many rides at once (one query per PASSENGER_QUERY_CHUNK rides).
+    Args:
+        ride_ids: Iterable of ride IDs, e.g. every ride shown on a page.
+    Returns:
+        A read-only dict {ride_id: ((first_name, last_name, username, email, phone), ...)} in booking
+        order, with an empty tuple for rides without passengers. Cached under one "ride:<id>" tag per ride.
+    """
+    ride_ids = list(dict.fromkeys(ride_ids))
+    passengers = {ride_id: [] for ride_id in ride_ids}
+    if not ride_ids:
+        return passengers
+    with db_connection() as conn:
+        for i in range(0, len(ride_ids), PASSENGER_QUERY_CHUNK):
+            chunk = ride_ids[i:i + PASSENGER_QUERY_CHUNK]
+            rows = conn.execute(f'''
+                SELECT b.ride_id, u.first_name, u.last_name, u.username, u.email, u.phone
+                FROM bookings b
+                JOIN users u ON b.user_id = u.id
+                WHERE b.ride_id IN ({",".join("?" * len(chunk))})
+                ORDER BY b.id
+            ''', chunk)
+            for row in rows:
+                passengers[row[0]].append(row[1:])
+    return passengers
+
 # --- Vehicle Management Functions ---
 
 def add_vehicul_db(user_id, marque, model, date_mise_en_circulation, pictures=None):
@@ -353,7 +739,7 @@ def add_vehicul_db(user_id, marque, model, date_mise_en_circulation, pictures=No
     Returns:
         The ID of the newly added vehicle.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         # Ensure 'pictures' is a dictionary to safely use .get()
         pictures = pictures if pictures is not None else {}
@@ -369,15 +755,17 @@ def add_vehicul_db(user_id, marque, model, date_mise_en_circulation, pictures=No
             pictures.get('exter1'),
             pictures.get('exter2')
         ))
+        invalidate_queries(conn, f"vehicles:user:{user_id}")
         conn.commit()
-        return c.lastrowid
+    return c.lastrowid
 
+@cached_query(lambda user_id: (f"vehicles:user:{user_id}",))
 def get_user_vehiculs_db(user_id):
     """
-    Retrieves all vehicles associated with a specific user.
+    Retrieves all vehicles associated with a specific user (cached until one of them changes).
     Returns a list of tuples containing vehicle details and image paths.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute('''
             SELECT id, marque, model, date_mise_en_circulation,
@@ -396,17 +784,17 @@ def update_vehicul_pictures(vehicle_id, pictures):
     Returns:
         True on success, False otherwise.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         # Retrieve the old image paths to delete the files
         c.execute('''
-            SELECT picture_inter1, picture_inter2, picture_exter1, picture_exter2
+            SELECT picture_inter1, picture_inter2, picture_exter1, picture_exter2, user_id
             FROM vehicul WHERE id=?
         ''', (vehicle_id,))
         old_pics = c.fetchone()
         
         if old_pics: # Ensure old_pics is not None
-            for pic_path in old_pics:
+            for pic_path in old_pics[:4]:
                 if pic_path: # Only attempt to delete if path exists
                     delete_image(pic_path)
         
@@ -427,8 +815,10 @@ def update_vehicul_pictures(vehicle_id, pictures):
             pictures.get('exter2'),
             vehicle_id
         ))
+        if old_pics:
+            invalidate_queries(conn, f"vehicles:user:{old_pics[4]}")
         conn.commit()
-        return c.rowcount > 0
+    return c.rowcount > 0
 
 def delete_image(image_path):
     """
@@ -469,6 +859,7 @@ if __name__ == "__main__":
     print("--- Running Database_Fahrten.py tests ---")
     
     # Clean up for testing
+    close_all_connections()
     if os.path.exists(DB_FILE):
         os.remove(DB_FILE)
         print(f"Removed existing database: {DB_FILE}")
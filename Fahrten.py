@@ -10,7 +10,10 @@ from io import BytesIO
 from Rides import show_display_rides,show_offer_ride,show_my_rides
 from Css import style_css
 import socket
-import requests
+from Outbound_Fahrten import http_get
+from Connection_Fahrten import db_connection
+from QueryCache_Fahrten import invalidate_queries
+from Gazetteer_Fahrten import start_gazetteer_import
 
 
 
@@ -33,17 +36,11 @@ def get_local_ip():
 def get_public_ip():
     """Get the public IP address of the user"""
     try:
-        return requests.get('https://api.ipify.org').text
+        return http_get("ipify", 'https://api.ipify.org').text
     except:
         return "Non disponible"
     
 
-def get_db_connection():
-    conn = sqlite3.connect('priminsberg_rides.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
 UPLOAD_DIR = "uploads"
 PROFILE_PICTURES_DIR = os.path.join(UPLOAD_DIR, "profile_pictures")
 VEHICLE_PICTURES_DIR = os.path.join(UPLOAD_DIR, "vehicle_pictures")
@@ -58,7 +55,8 @@ from Database_Fahrten import (
     update_user_profile_picture, update_vehicul_pictures, delete_image, display_image,
     register_user_db, get_user_by_username_db, update_user_profile_db,
     add_ride_db, get_rides_db, delete_ride_db, update_ride_db,
-    book_ride_db, get_user_bookings_db, get_user_vehiculs_db
+    book_ride_db, get_user_bookings_db, get_user_vehiculs_db, start_ride_coordinates_backfill,
+    start_ride_expiry_job
 )
 from Utils_Fahrten import display_logo, hash_password, verify_password, translate, get_base64_icon
 
@@ -141,6 +139,9 @@ def main():
         )
 
     setup_db() # Ensure database is set up
+    start_ride_coordinates_backfill() # Geocode older rides once per process, in the background
+    start_ride_expiry_job() # Archive departed rides off the request path
+    start_gazetteer_import() # Offline geocoder: import GAZETTEER_FILE once, if configured
 
     # --- Session State Initialization ---
     if 'current_user' not in st.session_state:
@@ -396,18 +397,17 @@ def show_profile():
         st.info(translate("Aucun véhicule enregistré pour le moment."))
 
 def update_password_db(user_id, hashed_new_password):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_new_password, user_id))
-    conn.commit()
-    conn.close()
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute("UPDATE users SET password = ? WHERE id = ?", (hashed_new_password, user_id))
+        invalidate_queries(conn, "users")
+        conn.commit()
 
 def check_password_db(user_id, hashed_password):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT password FROM users WHERE id = ?", (user_id,))
-    stored_hashed_password = c.fetchone()
-    conn.close()
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT password FROM users WHERE id = ?", (user_id,))
+        stored_hashed_password = c.fetchone()
     if stored_hashed_password and stored_hashed_password[0] == hashed_password:
         return True
     return False
@@ -503,7 +503,7 @@ def show_edit_profile():
             if not all([first_name, last_name, phone, email]):
                 st.error(translate("Aucun champ personnel ne peut être vide !"))
             else:
-                update_user_profile_db(user_id, first_name, last_name, email, phone, user[8])
+                update_user_profile_db(user_id, first_name, last_name, user[5], email, phone, user[8])
                 update_user_profile_picture(user_id, current_profile_pic_path)
                 st.session_state.current_user = get_user_by_username_db(user[1])
                 st.success(translate("Profil personnel mis à jour avec succès !"))
@@ -549,9 +549,10 @@ def show_edit_profile():
                             for img_path in [pic_inter1, pic_inter2, pic_exter1, pic_exter2]:
                                 if img_path:
                                     delete_image(img_path)
-                            with sqlite3.connect('priminsberg_rides.db') as conn:
+                            with db_connection() as conn:
                                 c = conn.cursor()
                                 c.execute("DELETE FROM vehicul WHERE id=?", (vehicle_id,))
+                                invalidate_queries(conn, f"vehicles:user:{user_id}")
                                 conn.commit()
                             st.success(translate("Véhicule supprimé avec succès !"))
                             st.rerun()
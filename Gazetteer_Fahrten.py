@@ -0,0 +1,186 @@
+import sys
+import json
+import time
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+from Connection_Fahrten import db_connection
+from Geo_Fahrten import normalize_address, haversine_km
+from Config_Fahrten import get_setting
+
+# Offline geocoder for the deployment region, tried by geocode_address before any online provider.
+# The data is a GeoNames dump (https://download.geonames.org/export/dump/, e.g. MA.txt for Morocco):
+# tab-separated, one place per line, imported with import_gazetteer or `python Gazetteer_Fahrten.py MA.txt`.
+GAZETTEER_FILE = get_setting("GAZETTEER_FILE")        # Imported at startup while the gazetteer is empty
+GAZETTEER_FEATURE_CLASSES = get_setting("GAZETTEER_FEATURE_CLASSES", "PAS")  # Populated places, areas, spots (stations...)
+GAZETTEER_IMPORT_BATCH = 5000
+GAZETTEER_MIN_SIMILARITY = 0.85  # difflib ratio a fuzzy match needs ("Rabt" -> "Rabat" is 0.89)
+GAZETTEER_FUZZY_LENGTHS = (4, 32)  # Names shorter than 4 are too ambiguous to guess; longer ones are rare spellings
+GAZETTEER_QUALIFIER_KM = 30        # "Agdal, Fès": Agdal must lie this close to a place named Fès...
+GAZETTEER_ADMIN_QUALIFIER_KM = 150  # ...or this close to an administrative area (province, region) of that name
+
+# GeoNames "geoname" table columns used here (0-based)
+_GEONAMEID, _NAME, _ASCIINAME, _ALTERNATENAMES, _LAT, _LON, _FEATURE_CLASS, _FEATURE_CODE, _COUNTRY_CODE = range(9)
+_POPULATION = 14
+
+def gazetteer_key(name):
+    """normalize_address() without diacritics: "Salé" and "Sale" share a key."""
+    key = unicodedata.normalize("NFKD", normalize_address(name))
+    return "".join(c for c in key if not unicodedata.combining(c))
+
+def _deletes(key):
+    """key and every string obtained by deleting one of its characters."""
+    return {key} | {key[:i] + key[i + 1:] for i in range(len(key))}
+
+def _read_geonames(lines, feature_classes):
+    """Yields (place row, set of name keys) for every wanted line of a GeoNames dump, one line at a time."""
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) <= _POPULATION or (feature_classes and fields[_FEATURE_CLASS] not in feature_classes):
+            continue
+        try:
+            place = (int(fields[_GEONAMEID]), fields[_NAME], float(fields[_LAT]), float(fields[_LON]),
+                     fields[_FEATURE_CLASS], fields[_FEATURE_CODE], fields[_COUNTRY_CODE],
+                     int(fields[_POPULATION] or 0))
+        except ValueError:
+            continue  # Header or damaged line
+        names = [fields[_NAME], fields[_ASCIINAME], *fields[_ALTERNATENAMES].split(",")]
+        yield place, {key for key in map(gazetteer_key, names) if key}
+
+def import_gazetteer(path, feature_classes=GAZETTEER_FEATURE_CLASSES, batch_size=GAZETTEER_IMPORT_BATCH):
+    """
+    Replaces the gazetteer with the places of a GeoNames dump.
+    The file is streamed: at most batch_size places are held in memory, and each batch is
+    written with executemany and committed on its own, so the write lock is never held for long.
+    Args:
+        path: GeoNames TSV file (UTF-8).
+        feature_classes: GeoNames feature classes to keep (e.g. "PAS"); empty keeps everything.
+    Returns:
+        The number of places imported.
+    """
+    with db_connection() as conn:
+        for table in ("gazetteer_deletes", "gazetteer_names", "gazetteer"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+    next_name_id = 1
+    imported = 0
+    places, names, deletes = [], [], []
+
+    def flush():
+        with db_connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO gazetteer VALUES (?, ?, ?, ?, ?, ?, ?, ?)", places)
+            conn.executemany("INSERT INTO gazetteer_names (id, name_key, geonameid) VALUES (?, ?, ?)", names)
+            conn.executemany("INSERT OR IGNORE INTO gazetteer_deletes (delete_key, name_id) VALUES (?, ?)", deletes)
+            conn.commit()
+        places.clear()
+        names.clear()
+        deletes.clear()
+
+    with open(path, encoding="utf-8") as lines:
+        for place, keys in _read_geonames(lines, feature_classes):
+            places.append(place)
+            for key in keys:
+                names.append((next_name_id, key, place[0]))
+                if GAZETTEER_FUZZY_LENGTHS[0] <= len(key) <= GAZETTEER_FUZZY_LENGTHS[1]:
+                    deletes.extend((delete, next_name_id) for delete in _deletes(key))
+                next_name_id += 1
+            imported += 1
+            if len(places) >= batch_size:
+                flush()
+    if places:
+        flush()
+    return imported
+
+def _exact(conn, key):
+    """Places named key, largest first: (lat, lon, feature_class, feature_code, country_code) rows."""
+    return conn.execute('''
+        SELECT g.lat, g.lon, g.feature_class, g.feature_code, g.country_code
+        FROM gazetteer_names n JOIN gazetteer g ON g.geonameid = n.geonameid
+        WHERE n.name_key=? ORDER BY g.population DESC
+    ''', (key,)).fetchall()
+
+def _fuzzy(conn, key):
+    """Places named within one edit of key (symmetric deletes) and similar enough, most similar then largest first."""
+    if not GAZETTEER_FUZZY_LENGTHS[0] <= len(key) <= GAZETTEER_FUZZY_LENGTHS[1] + 1:
+        return []
+    candidates = conn.execute('''
+        SELECT DISTINCT g.geonameid, n.name_key, g.population, g.lat, g.lon, g.feature_class, g.feature_code, g.country_code
+        FROM gazetteer_deletes d
+        JOIN gazetteer_names n ON n.id = d.name_id
+        JOIN gazetteer g ON g.geonameid = n.geonameid
+        WHERE d.delete_key IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(sorted(_deletes(key))),)).fetchall()
+    scored = [(SequenceMatcher(None, key, row[1]).ratio(), row[2], row[3:]) for row in candidates]
+    scored.sort(key=lambda s: (s[0], s[1]), reverse=True)
+    return [place for ratio, _, place in scored if ratio >= GAZETTEER_MIN_SIMILARITY]
+
+def _qualifies(conn, place, qualifier):
+    """Whether a qualifier of the address ("Fès" in "Agdal, Fès") names the country of place, or a place near it."""
+    for lat, lon, feature_class, feature_code, country_code in _exact(conn, qualifier):
+        if feature_code and feature_code.startswith("PCL"):
+            if country_code == place[4]:
+                return True
+        elif haversine_km((lat, lon), place[:2]) <= (
+                GAZETTEER_ADMIN_QUALIFIER_KM if feature_class == "A" else GAZETTEER_QUALIFIER_KM):
+            return True
+    return False
+
+def gazetteer_lookup(address):
+    """
+    Coordinates of an address from the offline gazetteer, or None when it does not know the place.
+    Tries the whole address, then its first part, exactly and then fuzzily. The first part only
+    counts when every other part names its country or a place near it: "Agdal, Fès" is not
+    answered with the Agdal of Rabat; an address the gazetteer cannot confirm is left to the
+    online providers.
+    """
+    key = gazetteer_key(address)
+    if not key:
+        return None
+    first, *qualifiers = [part.strip() for part in key.split(",")]
+    qualifiers = [qualifier for qualifier in qualifiers if qualifier]
+    if not qualifiers:
+        key = first  # "Salé," is just "Salé"
+    with db_connection() as conn:
+        for lookup in (_exact, _fuzzy):
+            places = lookup(conn, key)
+            if places:
+                return places[0][:2]
+            if not qualifiers:
+                continue
+            for place in lookup(conn, first):
+                if all(_qualifies(conn, place, qualifier) for qualifier in qualifiers):
+                    return place[:2]
+    return None
+
+_import_started = False
+_import_lock = threading.Lock()
+
+def start_gazetteer_import():
+    """Imports GAZETTEER_FILE in a background thread once per process, if configured and the gazetteer is empty."""
+    global _import_started
+    if not GAZETTEER_FILE:
+        return
+    with _import_lock:
+        if _import_started:
+            return
+        _import_started = True
+    with db_connection() as conn:
+        if conn.execute("SELECT 1 FROM gazetteer LIMIT 1").fetchone():
+            return
+
+    def run():
+        try:
+            start = time.perf_counter()
+            count = import_gazetteer(GAZETTEER_FILE)
+            print(f"Imported {count} gazetteer places from {GAZETTEER_FILE} in {time.perf_counter() - start:.1f} s.")
+        except Exception as e:
+            print(f"Error importing gazetteer {GAZETTEER_FILE}: {e}")
+    threading.Thread(target=run, name="gazetteer-import", daemon=True).start()
+
+if __name__ == "__main__":
+    # python Gazetteer_Fahrten.py MA.txt [feature classes]
+    from Migrations_Fahrten import run_migrations
+    run_migrations()
+    start = time.perf_counter()
+    count = import_gazetteer(sys.argv[1], *sys.argv[2:3])
+    print(f"Imported {count} places in {time.perf_counter() - start:.1f} s.")
@@ -0,0 +1,218 @@
+import streamlit as st
+import threading
+import time
+import re
+import math
+import unicodedata
+from collections import OrderedDict
+import requests
+from Connection_Fahrten import db_connection
+from Outbound_Fahrten import governed_call, http_get, ProviderUnavailable
+
+GEOCODE_TTL_SECONDS = 30 * 24 * 3600      # Positive results: places do not move
+GEOCODE_NEGATIVE_TTL_SECONDS = 24 * 3600  # Misses: retry the provider once a day
+GEOCODE_MEMORY_SIZE = 1024                # Max entries kept in the in-memory tier
+
+OPENCAGE_URL = "https://api.opencagedata.com/geocode/v1/json"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+
+_MISSING = object()
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(a, b):
+    """Great-circle distance in km between two (lat, lon) points."""
+    lat1, lon1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lon2 = math.radians(b[0]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+def bounding_box(center, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) of a box containing every point within radius_km of center.
+    Boxes reaching a pole or the antimeridian span all longitudes.
+    """
+    lat, lon = center
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    if lon - dlon < -180 or lon + dlon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+def normalize_address(address):
+    """
+    Builds the cache key for an address so that trivial variants share one entry.
+    "  Rabat ", "rabat" and "RABAT." all normalize to "rabat".
+    """
+    if not address:
+        return ""
+    key = unicodedata.normalize("NFKC", str(address)).casefold()
+    key = re.sub(r"\s+", " ", key).strip()
+    key = re.sub(r"\s*,\s*", ", ", key)
+    return key.strip(" .,;")
+
+class GeocodeCache:
+    """
+    Two-tier cache for geocoding results.
+    The front tier is an in-memory LRU shared by every Streamlit session of the process,
+    the back tier is the `geocode_cache` table of the SQLite database, so results survive restarts.
+    Negative results (address not found) are cached as well, with a shorter TTL.
+    """
+
+    def __init__(self, max_entries=GEOCODE_MEMORY_SIZE,
+                 ttl=GEOCODE_TTL_SECONDS, negative_ttl=GEOCODE_NEGATIVE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = OrderedDict()  # key -> (coords or None, expires_at)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, coords, expires_at):
+        with self._lock:
+            self._memory[key] = (coords, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, address, allow_expired=False):
+        """
+        Looks up an address.
+        Returns the cached (lat, lon) tuple, None for a cached negative result,
+        or the module-level _MISSING sentinel when the provider has to be asked.
+        allow_expired=True also returns entries past their TTL (fallback while providers are down).
+        """
+        key = normalize_address(address)
+        now = 0 if allow_expired else time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT lat, lon, expires_at FROM geocode_cache WHERE address_key=?", (key,)
+            ).fetchone()
+        if row and row[2] > now:
+            coords = (row[0], row[1]) if row[0] is not None else None
+            self._remember(key, coords, row[2])
+            with self._lock:
+                self.db_hits += 1
+            return coords
+
+        with self._lock:
+            self.misses += 1
+        return _MISSING
+
+    def put(self, address, coords):
+        """Stores a gazetteer or provider answer; coords=None records a negative result."""
+        key = normalize_address(address)
+        expires_at = int(time.time() + (self.ttl if coords else self.negative_ttl))
+        lat, lon = coords if coords else (None, None)
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (address_key, lat, lon, expires_at) VALUES (?, ?, ?, ?)",
+                (key, lat, lon, expires_at))
+            conn.commit()
+        self._remember(key, coords, expires_at)
+
+    def stats(self):
+        """Returns hit/miss counters and the hit rate since process start."""
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+geocode_cache = GeocodeCache()
+
+# Provider calls go straight to the REST APIs through the shared pooled session
+# (the OpenCage/geopy clients would each open their own connections).
+# Network errors, 429 and 5xx answers are retried, then counted by the provider's circuit breaker;
+# any other 4xx is a definite "not found" for the address.
+GEOCODE_RETRY_ON = (requests.RequestException,)
+
+def _opencage_api_key():
+    try:
+        return st.secrets["OPEN_CAGE_API_KEY"]
+    except Exception:
+        # Missing key or missing secrets file
+        return None
+
+def _geocode_opencage(address, api_key):
+    response = http_get("opencage", OPENCAGE_URL, params={"q": address, "key": api_key, "limit": 1, "no_annotations": 1})
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    if response.status_code >= 400:
+        return None
+    results = response.json().get("results")
+    if results:
+        return (results[0]['geometry']['lat'], results[0]['geometry']['lng'])
+    return None
+
+def _geocode_nominatim(address):
+    response = http_get("nominatim", NOMINATIM_URL, params={"q": address, "format": "json", "limit": 1})
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    if response.status_code >= 400:
+        return None
+    results = response.json()
+    if results:
+        return (float(results[0]['lat']), float(results[0]['lon']))
+    return None
+
+def _geocode_with_provider(address):
+    """
+    Asks OpenCage (or Nominatim when no API key is configured, or while OpenCage is down)
+    for the coordinates of an address, through the outbound-call governor.
+    Raises:
+        ProviderUnavailable: no provider could answer.
+    """
+    api_key = _opencage_api_key()
+    if api_key:
+        try:
+            return governed_call("opencage", _geocode_opencage, address, api_key, retry_on=GEOCODE_RETRY_ON)
+        except ProviderUnavailable as e:
+            print(f"OpenCage unavailable, falling back to Nominatim: {e}")
+    return governed_call("nominatim", _geocode_nominatim, address, retry_on=GEOCODE_RETRY_ON)
+
+def geocode_address(address):
+    """Fonction pour géocoder une adresse en coordonnées GPS (cache persistant, puis gazetteer local et fournisseurs)."""
+    if not normalize_address(address):
+        return None
+    cached = geocode_cache.get(address)
+    if cached is not _MISSING:
+        return cached
+    from Gazetteer_Fahrten import gazetteer_lookup  # Imported lazily: it imports this module
+    coords = gazetteer_lookup(address)
+    if coords:
+        geocode_cache.put(address, coords)
+        return coords
+    try:
+        coords = _geocode_with_provider(address)
+    except ProviderUnavailable as e:
+        # Providers down: serve an expired entry if there is one, and cache nothing
+        print(f"Géocodage indisponible pour {address}: {e}")
+        stale = geocode_cache.get(address, allow_expired=True)
+        return None if stale is _MISSING else stale
+    except Exception as e:
+        # Provider errors are not cached: only a definitive "not found" is.
+        # Logged rather than shown: geocoding also runs in prefetch/backfill threads.
+        print(f"Erreur de géocodage pour {address}: {e}")
+        return None
+    geocode_cache.put(address, coords)
+    return coords
@@ -0,0 +1,218 @@
+import re
+import heapq
+import bisect
+import threading
+from collections import Counter
+from Connection_Fahrten import db_connection
+from Geo_Fahrten import geocode_address, normalize_address
+
+# Canonical places referenced by rides (rides.start_location_id / destination_id).
+# Every spelling ever typed is an alias (normalized with normalize_address) of exactly one
+# location, so "Rabat", "rabat " and "Rabat, Maroc" share one row, are geocoded once and carry
+# the same coordinates, which also makes them share route and distance cache entries.
+# Lookups are primary-key reads of location_aliases; ids are not cached in memory, so they can
+# never outlive the database they came from (use_database switches files in benchmarks).
+LOCATION_COORD_PRECISION = 3  # ~100 m: two spellings geocoded to the same point are the same place
+
+AUTOCOMPLETE_LIMIT = 8            # Suggestions shown under a place input
+AUTOCOMPLETE_RANGE_LIMIT = 256    # Prefixes matching more keys than this keep a precomputed top list
+
+def _coords(lat, lon):
+    return (lat, lon) if lat is not None and lon is not None else None
+
+def _alias_location(conn, alias):
+    row = conn.execute('''
+        SELECT l.id, l.lat, l.lon FROM location_aliases a JOIN locations l ON l.id = a.location_id
+        WHERE a.alias=?
+    ''', (alias,)).fetchone()
+    return (row[0], _coords(row[1], row[2])) if row else None
+
+def _location_at(conn, coords):
+    """Id of a location within LOCATION_COORD_PRECISION of coords (expression index idx_locations_point), or None."""
+    row = conn.execute(f'''
+        SELECT id FROM locations
+        WHERE ROUND(lat, {LOCATION_COORD_PRECISION}) = ? AND ROUND(lon, {LOCATION_COORD_PRECISION}) = ?
+        ORDER BY id LIMIT 1
+    ''', (round(coords[0], LOCATION_COORD_PRECISION), round(coords[1], LOCATION_COORD_PRECISION))).fetchone()
+    return row[0] if row else None
+
+class PlaceIndex:
+    """
+    In-process prefix index of place names for autocomplete.
+    Every alias of a location is a key, and so is each of its words ("rabat, maroc" is found from
+    "rab" and from "mar"). Matches are ranked by how many rides use the place.
+    A prefix is a contiguous range of the sorted key list, found by bisection. Prefixes whose
+    range holds more than range_limit keys ("s", "schw" of every "..., Schweiz") keep their top
+    `limit` locations instead, updated as spellings and rides are added (use counts only grow,
+    so a place only ever moves up). A query never looks at more than range_limit keys.
+    """
+
+    def __init__(self, limit=AUTOCOMPLETE_LIMIT, range_limit=AUTOCOMPLETE_RANGE_LIMIT):
+        self.limit = limit
+        self.range_limit = range_limit
+        self._entries = []     # Sorted (key, location_id)
+        self._top = {}         # Crowded prefix -> best location ids, best first
+        self._keys = {}        # location_id -> set of its keys
+        self.names = {}        # location_id -> display name
+        self.uses = Counter()  # location_id -> rides starting or ending there
+        self._lock = threading.Lock()
+
+    def _rank(self, location_id):
+        return -self.uses[location_id], self.names[location_id]
+
+    def _range(self, prefix):
+        return (bisect.bisect_left(self._entries, (prefix,)),
+                bisect.bisect_left(self._entries, (prefix + "\U0010ffff",)))
+
+    def _best_in_range(self, start, end):
+        return heapq.nsmallest(self.limit, {location_id for _, location_id in self._entries[start:end]}, key=self._rank)
+
+    def _promote(self, prefix, location_id):
+        """Puts location_id in the top list of prefix if it ranks high enough now."""
+        top = self._top[prefix]
+        if location_id in top:
+            top.remove(location_id)
+        elif len(top) >= self.limit and self._rank(location_id) >= self._rank(top[-1]):
+            return
+        bisect.insort(top, location_id, key=self._rank)
+        del top[self.limit:]
+
+    def _update_prefixes(self, key, location_id):
+        # A longer prefix never matches more keys than a shorter one: stop at the first uncrowded one
+        for length in range(1, len(key) + 1):
+            prefix = key[:length]
+            if prefix in self._top:
+                self._promote(prefix, location_id)
+                continue
+            start, end = self._range(prefix)
+            if end - start <= self.range_limit:
+                return
+            self._top[prefix] = self._best_in_range(start, end)  # Just crossed the limit: a short scan
+
+    def add(self, location_id, name, alias):
+        """Registers a spelling (alias) of a location; adding a known one is a no-op."""
+        with self._lock:
+            self.names[location_id] = name
+            keys = self._keys.setdefault(location_id, set())
+            for match in re.finditer(r"\w+", alias):
+                key = alias[match.start():]
+                if key in keys:
+                    continue
+                keys.add(key)
+                bisect.insort(self._entries, (key, location_id))
+                self._update_prefixes(key, location_id)
+
+    def add_use(self, location_id, count=1):
+        with self._lock:
+            self.uses[location_id] += count
+            for key in self._keys.get(location_id, ()):
+                self._update_prefixes(key, location_id)
+
+    def suggest(self, text):
+        """Display names of the places matching the typed prefix, most used first; never touches the network."""
+        prefix = normalize_address(text)
+        if not prefix:
+            return []
+        with self._lock:
+            best = self._top.get(prefix)
+            if best is None:
+                best = self._best_in_range(*self._range(prefix))
+            return [self.names[i] for i in best]
+
+    def __len__(self):
+        return len(self._entries)
+
+def load_place_index():
+    """Builds a PlaceIndex of every location and alias, weighted by the rides (current and archived) using them."""
+    index = PlaceIndex()
+    with db_connection() as conn:
+        for alias, location_id, name in conn.execute(
+                "SELECT a.alias, l.id, l.name FROM location_aliases a JOIN locations l ON l.id = a.location_id"):
+            index.add(location_id, name, alias)
+        for table in ("rides", "rides_archive"):
+            for location_id, count in conn.execute(f'''
+                    SELECT location_id, COUNT(*) FROM (
+                        SELECT start_location_id AS location_id FROM {table}
+                        UNION ALL SELECT destination_id FROM {table})
+                    WHERE location_id IS NOT NULL GROUP BY location_id'''):
+                index.add_use(location_id, count)
+    return index
+
+_place_index = None
+_place_index_lock = threading.Lock()
+
+def get_place_index():
+    """Process-wide PlaceIndex, loaded on first use and then kept current by resolve_location/count_ride_places."""
+    global _place_index
+    with _place_index_lock:
+        if _place_index is None:
+            _place_index = load_place_index()
+        return _place_index
+
+def count_ride_places(*location_ids):
+    """Records that a new ride uses these locations (ranks them higher in suggestions)."""
+    if _place_index is None:
+        return  # Counted from the database on first use anyway
+    for location_id in location_ids:
+        if location_id is not None:
+            _place_index.add_use(location_id)
+
+def find_location(name):
+    """
+    Looks up a spelling without geocoding or writing anything.
+    Returns (location_id, coords) of the location it is an alias of (coords None while the place
+    is not geocoded), or None for a spelling never seen.
+    """
+    alias = normalize_address(name)
+    if not alias:
+        return None
+    with db_connection() as conn:
+        return _alias_location(conn, alias)
+
+def resolve_location(name, coords=None):
+    """
+    Returns the canonical location of an address, creating it the first time a spelling is seen.
+    Args:
+        name: The address as typed.
+        coords: Known (lat, lon) of the address; a new or not yet geocoded place is geocoded otherwise.
+    Returns:
+        (location_id, coords); (None, None) for an empty address. coords is None while the place
+        cannot be geocoded (the location still exists, so its spellings are linked).
+    A new spelling geocoded to the point of an existing location becomes an alias of that location.
+    """
+    alias = normalize_address(name)
+    if not alias:
+        return None, None
+    found = find_location(name)
+    if found and found[1] is not None:
+        return found
+    if coords is None:
+        coords = geocode_address(name)  # Before the transaction: may wait for the network
+    with db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Re-read under the write lock: another session may have created it meanwhile
+            found = _alias_location(conn, alias)
+            location_id = found[0] if found else (_location_at(conn, coords) if coords else None)
+            if location_id is None:
+                location_id = conn.execute(
+                    "INSERT INTO locations (name, normalized_name, lat, lon) VALUES (?, ?, ?, ?)",
+                    (str(name).strip(), alias) + tuple(coords or (None, None))).lastrowid
+            elif coords:
+                conn.execute("UPDATE locations SET lat=?, lon=? WHERE id=? AND lat IS NULL", tuple(coords) + (location_id,))
+            conn.execute("INSERT OR IGNORE INTO location_aliases (alias, location_id) VALUES (?, ?)", (alias, location_id))
+            row = conn.execute("SELECT lat, lon, name FROM locations WHERE id=?", (location_id,)).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if _place_index is not None:
+        _place_index.add(location_id, row[2], alias)
+    return location_id, _coords(row[0], row[1])
+
+def location_coords(name):
+    """(lat, lon) of an address: the coordinates of its location when the spelling is known, else geocoded."""
+    found = find_location(name)
+    if found and found[1] is not None:
+        return found[1]
+    return geocode_address(name)
@@ -0,0 +1,256 @@
+import math
+import json
+import time
+import threading
+from collections import defaultdict
+from Geo_Fahrten import bounding_box, EARTH_RADIUS_KM
+from Connection_Fahrten import db_connection
+from Routing_Fahrten import route_key
+from Config_Fahrten import get_setting
+
+# Route-corridor matching: which rides pass close to a passenger's pickup, then close to the drop-off?
+# Every segment of every route geometry is registered in the cells of a uniform lat/lon grid;
+# a query only looks at the segments registered around the two points.
+CORRIDOR_MAX_KM = get_setting("CORRIDOR_MAX_KM", 3.0, float)  # Default pickup/drop-off detour allowed
+CORRIDOR_CELL_KM = 2.0             # Grid cell size (north-south); about the typical query radius
+CORRIDOR_INDEX_TTL_SECONDS = 300   # Rebuild the process-wide index from the database this often
+
+KM_PER_DEGREE = math.radians(1) * EARTH_RADIUS_KM
+
+class CorridorIndex:
+    """
+    Grid index of route segments.
+    Cells are cell_km high and the same number of degrees wide, so they get narrower towards the
+    poles; queries enumerate cells from a bounding box, which accounts for that.
+    """
+
+    def __init__(self, cell_km=CORRIDOR_CELL_KM):
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEGREE
+        self.cells = defaultdict(list)  # (row, col) -> [(ride_id, segment index)]
+        self.routes = {}                # ride_id -> [(lat, lon), ...]
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _segment_cells(self, a, b):
+        """Every cell the segment ab passes through (a query then only needs the cells of its own box)."""
+        row_a, col_a = self._cell(*a)
+        row_b, col_b = self._cell(*b)
+        if abs(row_a - row_b) <= 1 and abs(col_a - col_b) <= 1:
+            # Short segment (OSRM geometries): the cells of its bounding box
+            return {(row, col) for row in range(min(row_a, row_b), max(row_a, row_b) + 1)
+                    for col in range(min(col_a, col_b), max(col_a, col_b) + 1)}
+        # Long segment (straight-line fallback): sample every half cell; every point of the segment
+        # is then within a quarter cell of a sample, so in the sample's cell or one of its neighbours
+        steps = math.ceil(max(abs(b[0] - a[0]), abs(b[1] - a[1])) / (self.cell_deg / 2))
+        cells = set()
+        for i in range(steps + 1):
+            row, col = self._cell(a[0] + (b[0] - a[0]) * i / steps, a[1] + (b[1] - a[1]) * i / steps)
+            cells.update((row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1))
+        return cells
+
+    def add_route(self, ride_id, geometry):
+        """Registers (or replaces) the route of a ride; geometry is a list of (lat, lon) points."""
+        geometry = [tuple(p) for p in geometry]
+        if len(geometry) == 1:
+            geometry = geometry * 2
+        with self._lock:
+            self._remove(ride_id)
+            self.routes[ride_id] = geometry
+            for i in range(len(geometry) - 1):
+                for cell in self._segment_cells(geometry[i], geometry[i + 1]):
+                    self.cells[cell].append((ride_id, i))
+
+    def _remove(self, ride_id):
+        geometry = self.routes.pop(ride_id, None)
+        if not geometry:
+            return
+        for i in range(len(geometry) - 1):
+            for cell in self._segment_cells(geometry[i], geometry[i + 1]):
+                entries = self.cells.get(cell)
+                if entries:
+                    entries[:] = [e for e in entries if e[0] != ride_id]
+                    if not entries:
+                        del self.cells[cell]
+
+    def remove_route(self, ride_id):
+        with self._lock:
+            self._remove(ride_id)
+
+    def nearest_positions(self, point, max_km, ride_ids=None):
+        """
+        Rides passing within max_km of point (only those in ride_ids, when given).
+        Returns {ride_id: [(position, distance_km), ...]} where position = segment index + offset on
+        the segment, i.e. how far along the route the closest approach is (one entry per segment).
+        """
+        min_lat, max_lat, min_lon, max_lon = bounding_box(point, max_km)
+        row_min, col_min = self._cell(min_lat, min_lon)
+        row_max, col_max = self._cell(max_lat, max_lon)
+        # Equirectangular projection around point (km), inlined: this loop is the hot path
+        lat0, lon0 = point
+        kx, ky = KM_PER_DEGREE * math.cos(math.radians(lat0)), KM_PER_DEGREE
+        max_km2 = max_km * max_km
+        hits = defaultdict(list)
+        seen = set()
+        with self._lock:
+            for row in range(row_min, row_max + 1):
+                for col in range(col_min, col_max + 1):
+                    for entry in self.cells.get((row, col), ()):
+                        ride_id, i = entry
+                        if entry in seen or (ride_ids is not None and ride_id not in ride_ids):
+                            continue
+                        seen.add(entry)
+                        geometry = self.routes[ride_id]
+                        a, b = geometry[i], geometry[i + 1]
+                        ax, ay = (a[1] - lon0) * kx, (a[0] - lat0) * ky
+                        dx, dy = (b[1] - lon0) * kx - ax, (b[0] - lat0) * ky - ay
+                        length2 = dx * dx + dy * dy
+                        t = 0.0 if length2 == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length2))
+                        x, y = ax + t * dx, ay + t * dy
+                        distance2 = x * x + y * y
+                        if distance2 <= max_km2:
+                            hits[ride_id].append((i + t, math.sqrt(distance2)))
+        return hits
+
+    def match(self, pickup, dropoff, max_km=CORRIDOR_MAX_KM):
+        """
+        Rides passing within max_km of pickup and, further along the route, within max_km of dropoff.
+        Returns a list of dicts {ride_id, pickup_km, dropoff_km, pickup_position, dropoff_position},
+        smallest total detour first.
+        """
+        pickups = self.nearest_positions(pickup, max_km)
+        if not pickups:
+            return []
+        # Only rides passing the pickup can match: skip every other segment around the drop-off
+        dropoffs = self.nearest_positions(dropoff, max_km, ride_ids=pickups.keys())
+        matches = []
+        for ride_id, pickup_hits in pickups.items():
+            best = None
+            for drop_position, drop_km in dropoffs.get(ride_id, ()):
+                # Closest pickup that comes before this drop-off on the route
+                before = [hit for hit in pickup_hits if hit[0] < drop_position]
+                if not before:
+                    continue
+                pick_position, pick_km = min(before, key=lambda hit: hit[1])
+                if best is None or pick_km + drop_km < best["pickup_km"] + best["dropoff_km"]:
+                    best = {"ride_id": ride_id, "pickup_km": pick_km, "dropoff_km": drop_km,
+                            "pickup_position": pick_position, "dropoff_position": drop_position}
+            if best:
+                matches.append(best)
+        matches.sort(key=lambda m: m["pickup_km"] + m["dropoff_km"])
+        return matches
+
+    def __len__(self):
+        return len(self.routes)
+
+def load_corridor_index(cell_km=CORRIDOR_CELL_KM):
+    """
+    Builds a CorridorIndex of every bookable future ride with coordinates.
+    Geometries come from the route cache only (no routing calls); rides without a cached route
+    get a straight line between their end points.
+    """
+    index = CorridorIndex(cell_km)
+    with db_connection() as conn:
+        rides = conn.execute('''
+            SELECT id, start_lat, start_lon, dest_lat, dest_lon FROM rides
+            WHERE departure_at >= DATE('now') AND available_seats > 0
+              AND start_lat IS NOT NULL AND dest_lat IS NOT NULL
+        ''').fetchall()
+        keys = {ride[0]: route_key(ride[1:3], ride[3:5]) for ride in rides}
+        geometries = dict(conn.execute(
+            "SELECT route_key, geometry FROM route_cache WHERE route_key IN (SELECT value FROM json_each(?)) AND geometry IS NOT NULL",
+            (json.dumps(list(set(keys.values()))),)).fetchall())
+    for ride_id, start_lat, start_lon, dest_lat, dest_lon in rides:
+        geometry = geometries.get(keys[ride_id])
+        index.add_route(ride_id, json.loads(geometry) if geometry else [(start_lat, start_lon), (dest_lat, dest_lon)])
+    return index
+
+_index = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+_first_build_lock = threading.Lock()
+_rebuilding = False
+_pending = []  # (ride_id, geometry or None) written while a rebuild runs, replayed on the new index
+
+def _apply(index, ride_id, geometry):
+    if geometry is None:
+        index.remove_route(ride_id)
+    else:
+        index.add_route(ride_id, geometry)
+
+def _rebuild_index():
+    """Builds a fresh index off the lock, replays the writes made meanwhile, then swaps it in."""
+    global _index, _index_built_at, _rebuilding
+    try:
+        index = load_corridor_index()
+    except Exception as e:
+        print(f"Error rebuilding the corridor index: {e}")
+        index = None
+    with _index_lock:
+        if index is not None:
+            for ride_id, geometry in _pending:
+                _apply(index, ride_id, geometry)
+            _index = index
+            _index_built_at = time.monotonic()
+        _pending.clear()
+        _rebuilding = False
+
+def _start_rebuild():
+    """Marks a rebuild as running (under _index_lock); returns False if one already is."""
+    global _rebuilding
+    if _rebuilding:
+        return False
+    _rebuilding = True
+    _pending.clear()
+    return True
+
+def get_corridor_index():
+    """
+    Process-wide index shared by all sessions.
+    Only the first call builds it in the caller; afterwards it is rebuilt every
+    CORRIDOR_INDEX_TTL_SECONDS in a background thread while sessions keep using the current one,
+    which refresh_ride_route/forget_ride_route keep up to date in between.
+    """
+    if _index is None:
+        with _first_build_lock:
+            if _index is None:
+                with _index_lock:
+                    started = _start_rebuild()
+                if started:
+                    _rebuild_index()
+    with _index_lock:
+        if time.monotonic() - _index_built_at > CORRIDOR_INDEX_TTL_SECONDS and _start_rebuild():
+            threading.Thread(target=_rebuild_index, name="corridor-index-rebuild", daemon=True).start()
+        return _index or CorridorIndex()
+
+def match_rides(pickup, dropoff, max_km=CORRIDOR_MAX_KM):
+    """Corridor matches of the bookable rides for a pickup and a drop-off (lat, lon); see CorridorIndex.match."""
+    return get_corridor_index().match(pickup, dropoff, max_km)
+
+def _update_index(ride_id, geometry):
+    """Applies a ride write to the loaded index, and to the one being rebuilt if any."""
+    with _index_lock:
+        if _rebuilding:
+            _pending.append((ride_id, geometry))
+        index = _index
+    if index is not None:
+        _apply(index, ride_id, geometry)
+
+def refresh_ride_route(ride_id, start_coords, dest_coords):
+    """Re-registers a written ride in the loaded index (cached route geometry, else a straight line)."""
+    if _index is None and not _rebuilding:
+        return  # Built from the database on first use anyway
+    if not start_coords or not dest_coords:
+        _update_index(ride_id, None)
+        return
+    with db_connection() as conn:
+        row = conn.execute("SELECT geometry FROM route_cache WHERE route_key=?",
+                           (route_key(start_coords, dest_coords),)).fetchone()
+    _update_index(ride_id, json.loads(row[0]) if row and row[0] else [start_coords, dest_coords])
+
+def forget_ride_route(ride_id):
+    """Drops a deleted or archived ride from the loaded index."""
+    if _index is not None or _rebuilding:
+        _update_index(ride_id, None)
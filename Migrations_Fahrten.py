@@ -0,0 +1,452 @@
+import re
+import threading
+from collections import Counter
+from Connection_Fahrten import db_connection
+from Geo_Fahrten import normalize_address
+
+# Schema migrations, applied in order. The database records the number of migrations already
+# applied in PRAGMA user_version; each migration runs in its own BEGIN IMMEDIATE transaction
+# together with the user_version bump, so a failed migration leaves the schema untouched.
+# Never edit or reorder a migration that has shipped: append a new one instead.
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+def _add_columns(conn, table, columns):
+    """Adds the missing ones of `columns` ({name: declaration}) to `table`."""
+    existing = _columns(conn, table)
+    for name, declaration in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+def _m001_baseline(conn):
+    """Users, rides, bookings and vehicul tables (also adopts databases created by the old setup_db)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        station TEXT,
+        email TEXT,
+        phone TEXT,
+        driving_license_date TEXT,
+        profile_picture TEXT -- Path to the profile picture
+    )''')
+    _add_columns(conn, "users", {"driving_license_date": "TEXT", "profile_picture": "TEXT"})
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rides (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        provider_id INTEGER,
+        start_location TEXT,
+        destination TEXT,
+        date TEXT,      -- Format: DD.MM.YYYY
+        time TEXT,      -- Format: HH:MM
+        available_seats INTEGER,
+        FOREIGN KEY(provider_id) REFERENCES users(id)
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bookings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        ride_id INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        FOREIGN KEY(ride_id) REFERENCES rides(id)
+    )''')
+
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS vehicul (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        marque TEXT,
+        model TEXT,
+        date_mise_en_circulation TEXT,
+        picture_inter1 TEXT, -- Path to interior picture 1
+        picture_inter2 TEXT, -- Path to interior picture 2
+        picture_exter1 TEXT, -- Path to exterior picture 1
+        picture_exter2 TEXT, -- Path to exterior picture 2
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )''')
+
+def _m002_ride_coordinates(conn):
+    """Coordinates geocoded once when a ride is written."""
+    _add_columns(conn, "rides", {"start_lat": "REAL", "start_lon": "REAL", "dest_lat": "REAL", "dest_lon": "REAL"})
+
+def _m003_geo_caches(conn):
+    """Persistent tiers of the geocoding and routing caches."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        address_key TEXT PRIMARY KEY,
+        lat REAL,      -- NULL for a cached negative result
+        lon REAL,
+        expires_at INTEGER NOT NULL
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS route_cache (
+        route_key TEXT PRIMARY KEY,
+        distance_m REAL NOT NULL,
+        duration_s REAL NOT NULL,
+        geometry TEXT,              -- JSON list of [lat, lon] points
+        fetched_at INTEGER NOT NULL
+    )''')
+
+def _m004_indexes(conn):
+    """Secondary indexes for the hot lookups and one booking per (user, ride)."""
+    # Duplicate bookings must go before the UNIQUE index can be built; each one had taken a seat
+    conn.execute('''
+        UPDATE rides SET available_seats = available_seats + (
+            SELECT COUNT(*) - COUNT(DISTINCT user_id) FROM bookings WHERE bookings.ride_id = rides.id)
+        WHERE id IN (SELECT ride_id FROM bookings GROUP BY user_id, ride_id HAVING COUNT(*) > 1)''')
+    conn.execute('''
+        DELETE FROM bookings WHERE id NOT IN (SELECT MIN(id) FROM bookings GROUP BY user_id, ride_id)''')
+    # (user_id, ride_id): a user's bookings, the NOT IN filter of the ride list, the duplicate check
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_user_ride ON bookings(user_id, ride_id)")
+    # (ride_id, user_id): passengers of a ride and deleting a ride's bookings, without touching the table
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_ride_user ON bookings(ride_id, user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rides_provider ON rides(provider_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicul_user ON vehicul(user_id)")
+
+def _m005_departure_at(conn):
+    """Sortable departure timestamp ('YYYY-MM-DD HH:MM') next to the displayed date/time text."""
+    _add_columns(conn, "rides", {"departure_at": "TEXT"})
+    # date is stored as DD.MM.YYYY and time as HH:MM; rows in any other format stay NULL
+    conn.execute('''
+        UPDATE rides
+        SET departure_at = SUBSTR(date,7,4)||'-'||SUBSTR(date,4,2)||'-'||SUBSTR(date,1,2)||' '||SUBSTR(time,1,5)
+        WHERE date GLOB '[0-3][0-9].[01][0-9].[0-9][0-9][0-9][0-9]'
+          AND time GLOB '[0-2][0-9]:[0-5][0-9]*'
+        ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rides_departure ON rides(departure_at)")
+    # Supersedes idx_rides_provider: also returns a provider's rides already sorted
+    conn.execute("DROP INDEX IF EXISTS idx_rides_provider")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rides_provider_departure ON rides(provider_id, departure_at)")
+
+def _m006_archive(conn):
+    """Archive tables for rides that have departed, filled by the background expiry job."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rides_archive (
+        id INTEGER PRIMARY KEY,     -- Same id as the archived rides row
+        provider_id INTEGER,
+        start_location TEXT,
+        destination TEXT,
+        date TEXT,
+        time TEXT,
+        departure_at TEXT,
+        available_seats INTEGER,
+        start_lat REAL,
+        start_lon REAL,
+        dest_lat REAL,
+        dest_lon REAL,
+        archived_at TEXT NOT NULL
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bookings_archive (
+        id INTEGER PRIMARY KEY,     -- Same id as the archived bookings row
+        user_id INTEGER,
+        ride_id INTEGER,
+        archived_at TEXT NOT NULL
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_archive_user ON bookings_archive(user_id)")
+
+def _m007_rides_fts(conn):
+    """FTS5 index over rides.start_location/destination, kept in sync with rides by triggers."""
+    # External content: the index stores only tokens, the text stays in rides
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS rides_fts USING fts5(
+        start_location, destination,
+        content='rides', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS rides_fts_insert AFTER INSERT ON rides BEGIN
+        INSERT INTO rides_fts (rowid, start_location, destination)
+        VALUES (new.id, new.start_location, new.destination);
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS rides_fts_delete AFTER DELETE ON rides BEGIN
+        INSERT INTO rides_fts (rides_fts, rowid, start_location, destination)
+        VALUES ('delete', old.id, old.start_location, old.destination);
+    END''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS rides_fts_update AFTER UPDATE OF start_location, destination ON rides BEGIN
+        INSERT INTO rides_fts (rides_fts, rowid, start_location, destination)
+        VALUES ('delete', old.id, old.start_location, old.destination);
+        INSERT INTO rides_fts (rowid, start_location, destination)
+        VALUES (new.id, new.start_location, new.destination);
+    END''')
+    conn.execute("INSERT INTO rides_fts (rides_fts) VALUES ('rebuild')")
+
+def _m008_rides_rtree(conn):
+    """R*Tree indexes of ride start and destination points (id = rides.id), kept in sync by triggers."""
+    for table, lat, lon in (("rides_start_geo", "start_lat", "start_lon"), ("rides_dest_geo", "dest_lat", "dest_lon")):
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+        point = f"SELECT new.id, new.{lat}, new.{lat}, new.{lon}, new.{lon} WHERE new.{lat} IS NOT NULL AND new.{lon} IS NOT NULL"
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON rides BEGIN
+            INSERT INTO {table} {point};
+        END''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF {lat}, {lon} ON rides BEGIN
+            DELETE FROM {table} WHERE id = old.id;
+            INSERT INTO {table} {point};
+        END''')
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON rides BEGIN
+            DELETE FROM {table} WHERE id = old.id;
+        END''')
+        conn.execute(f'''
+            INSERT OR REPLACE INTO {table} SELECT id, {lat}, {lat}, {lon}, {lon} FROM rides
+            WHERE {lat} IS NOT NULL AND {lon} IS NOT NULL''')
+
+def _m009_distance_cache(conn):
+    """Persistent tier of the distance-matrix cell cache (one row per origin/destination pair)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS distance_cache (
+        route_key TEXT PRIMARY KEY, -- Same key as route_cache
+        distance_m REAL,            -- NULL for a cached "no route"
+        duration_s REAL,
+        fetched_at INTEGER NOT NULL
+    )''')
+
+def _m010_locations(conn):
+    """Canonical places (locations) with every spelling seen as an alias; rides reference them by id."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,                   -- Display name: the most used spelling
+        normalized_name TEXT NOT NULL UNIQUE,
+        lat REAL,                             -- NULL while the place cannot be geocoded
+        lon REAL
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS location_aliases (
+        alias TEXT PRIMARY KEY,               -- normalize_address() of a spelling
+        location_id INTEGER NOT NULL REFERENCES locations(id)
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_location_aliases_location ON location_aliases(location_id)")
+    # Same expression as Locations_Fahrten._location_at: finds the place at a geocoded point
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_locations_point ON locations(ROUND(lat, 3), ROUND(lon, 3))")
+    for table in ("rides", "rides_archive"):
+        _add_columns(conn, table, {"start_location_id": "INTEGER REFERENCES locations(id)",
+                                   "destination_id": "INTEGER REFERENCES locations(id)"})
+
+    # Deduplicate the places already stored on rides: spellings with the same normalized form are
+    # one place, and so are spellings geocoded to the same point (rounded to ~100 m)
+    places = {}  # alias -> [Counter of raw spellings, coords]
+    for table in ("rides", "rides_archive"):
+        for text, lat, lon in conn.execute(f'''
+                SELECT start_location, start_lat, start_lon FROM {table}
+                UNION ALL SELECT destination, dest_lat, dest_lon FROM {table}'''):
+            alias = normalize_address(text)
+            if not alias:
+                continue
+            place = places.setdefault(alias, [Counter(), None])
+            place[0][text.strip()] += 1
+            if place[1] is None and lat is not None and lon is not None:
+                place[1] = (lat, lon)
+    groups = {}
+    for alias, (_, coords) in places.items():
+        key = (round(coords[0], 3), round(coords[1], 3)) if coords else alias
+        groups.setdefault(key, []).append(alias)
+    for aliases in groups.values():
+        name = sum((places[alias][0] for alias in aliases), Counter()).most_common(1)[0][0]
+        coords = next((places[alias][1] for alias in aliases if places[alias][1]), (None, None))
+        location_id = conn.execute(
+            "INSERT INTO locations (name, normalized_name, lat, lon) VALUES (?, ?, ?, ?)",
+            (name, normalize_address(name)) + coords).lastrowid
+        conn.executemany("INSERT INTO location_aliases (alias, location_id) VALUES (?, ?)",
+                         [(alias, location_id) for alias in aliases])
+
+    for table in ("rides", "rides_archive"):
+        for column, id_column in (("start_location", "start_location_id"), ("destination", "destination_id")):
+            conn.executemany(
+                f"UPDATE {table} SET {id_column} = (SELECT location_id FROM location_aliases WHERE alias=?) WHERE id=?",
+                [(normalize_address(text), ride_id)
+                 for ride_id, text in conn.execute(f"SELECT id, {column} FROM {table}").fetchall()
+                 if normalize_address(text)])
+        # A spelling that never geocoded gets the coordinates of its place
+        for id_column, lat, lon in (("start_location_id", "start_lat", "start_lon"), ("destination_id", "dest_lat", "dest_lon")):
+            conn.execute(f'''
+                UPDATE {table} SET
+                    {lat} = (SELECT l.lat FROM locations l WHERE l.id = {table}.{id_column}),
+                    {lon} = (SELECT l.lon FROM locations l WHERE l.id = {table}.{id_column})
+                WHERE {lat} IS NULL AND {id_column} IN (SELECT id FROM locations WHERE lat IS NOT NULL)''')
+
+def _m011_gazetteer(conn):
+    """Offline gazetteer (GeoNames dump) with its searchable names, filled by Gazetteer_Fahrten.import_gazetteer."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS gazetteer (
+        geonameid INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL,
+        feature_class TEXT,
+        feature_code TEXT,
+        country_code TEXT,
+        population INTEGER NOT NULL DEFAULT 0
+    )''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS gazetteer_names (
+        id INTEGER PRIMARY KEY,
+        name_key TEXT NOT NULL,     -- gazetteer_key() of the name, ASCII name or an alternate name
+        geonameid INTEGER NOT NULL
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gazetteer_names_key ON gazetteer_names(name_key, geonameid)")
+    # Fuzzy matching (symmetric deletes): each name key and every variant of it with one character
+    # deleted; a misspelled query shares at least one of these with the name it was meant to be
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS gazetteer_deletes (
+        delete_key TEXT NOT NULL,
+        name_id INTEGER NOT NULL,   -- gazetteer_names.id
+        PRIMARY KEY (delete_key, name_id)
+    ) WITHOUT ROWID''')
+
+def _m012_change_log(conn):
+    """Cache tags invalidated by each write, read by the other processes' query caches (QueryCache_Fahrten.ChangeLog)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, -- Never reused, so readers can tell when they missed rows
+        origin TEXT NOT NULL,                  -- Process that wrote it (its own rows are skipped)
+        tags TEXT NOT NULL,                    -- JSON list of query cache tags
+        changed_at INTEGER NOT NULL
+    )''')
+
+def _m013_user_station(conn):
+    """Location and coordinates of a user's station, resolved when the profile is saved."""
+    _add_columns(conn, "users", {"station_location_id": "INTEGER REFERENCES locations(id)",
+                                 "station_lat": "REAL", "station_lon": "REAL"})
+
+MIGRATIONS = [
+    _m001_baseline,
+    _m002_ride_coordinates,
+    _m003_geo_caches,
+    _m004_indexes,
+    _m005_departure_at,
+    _m006_archive,
+    _m007_rides_fts,
+    _m008_rides_rtree,
+    _m009_distance_cache,
+    _m010_locations,
+    _m011_gazetteer,
+    _m012_change_log,
+    _m013_user_station,
+]
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations():
+    """
+    Applies every migration newer than the database's user_version.
+    Returns the list of migration names applied (empty when the schema is current).
+    """
+    applied = []
+    with db_connection() as conn:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            if schema_version(conn) >= version:
+                continue
+            # IMMEDIATE takes the write lock up front, so two processes starting together
+            # cannot both apply the same migration: the second one re-checks user_version.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(migration.__name__)
+    return applied
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """Runs the migrations once per process; later calls (every Streamlit rerun) return immediately."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            applied = run_migrations()
+            if applied:
+                print(f"Applied migrations: {', '.join(applied)}")
+            _schema_ready = True
+
+# Query shapes that run on every page render; none of them may scan a whole table.
+HOT_QUERIES = {
+    "bookings of a user": "SELECT ride_id FROM bookings WHERE user_id=?",
+    "duplicate booking check": "SELECT COUNT(*) FROM bookings WHERE user_id=? AND ride_id=?",
+    "passengers of a ride": '''SELECT u.first_name, u.last_name, u.username, u.email, u.phone
+                               FROM bookings b JOIN users u ON b.user_id = u.id WHERE b.ride_id=?''',
+    "rides of a provider": "SELECT id, start_location, destination, date, time FROM rides WHERE provider_id=? ORDER BY departure_at",
+    "bookable rides page": '''SELECT r.id, u.username FROM rides r JOIN users u ON r.provider_id = u.id
+                              WHERE r.available_seats >= ? AND r.departure_at >= DATE('now')
+                                AND (r.departure_at, r.id) > (?, ?) AND r.provider_id != ?
+                                AND r.id NOT IN (SELECT ride_id FROM bookings WHERE user_id=?)
+                              ORDER BY r.departure_at, r.id LIMIT ?''',
+    "bookings of a ride": "DELETE FROM bookings WHERE ride_id=?",
+    "ride search": '''SELECT r.id, u.username FROM rides r JOIN users u ON r.provider_id = u.id
+                      WHERE r.available_seats >= ? AND r.departure_at >= DATE('now')
+                        AND (r.departure_at, r.id) > (?, ?) AND r.provider_id != ?
+                        AND r.id NOT IN (SELECT ride_id FROM bookings WHERE user_id=?)
+                        AND r.id IN (SELECT rowid FROM rides_fts WHERE rides_fts MATCH ?)
+                        AND r.departure_at < ? AND u.username = ?
+                      ORDER BY r.departure_at, r.id LIMIT ?''',
+    "ranking columns": '''SELECT id, available_seats, start_lat, start_lon, dest_lat, dest_lon, departure_at FROM rides
+                          WHERE available_seats >= 1 AND departure_at >= DATE('now') ORDER BY departure_at, id LIMIT ?''',
+    "rides a user cannot book": "SELECT id FROM rides WHERE provider_id=? UNION SELECT ride_id FROM bookings WHERE user_id=?",
+    "rides near a point": '''SELECT r.id, r.start_lat, r.start_lon FROM rides_start_geo g JOIN rides r ON r.id = g.id
+                             WHERE g.max_lat >= ? AND g.min_lat <= ? AND g.max_lon >= ? AND g.min_lon <= ?''',
+    "location of a spelling": '''SELECT l.id, l.lat, l.lon FROM location_aliases a JOIN locations l ON l.id = a.location_id
+                                  WHERE a.alias=?''',
+    "gazetteer name": '''SELECT g.lat, g.lon FROM gazetteer_names n JOIN gazetteer g ON g.geonameid = n.geonameid
+                          WHERE n.name_key=? ORDER BY g.population DESC LIMIT 1''',
+    "changes since": "SELECT seq, origin, tags FROM change_log WHERE seq > ? ORDER BY seq",
+    "departed rides": "SELECT id FROM rides WHERE departure_at < date('now') ORDER BY departure_at LIMIT ?",
+    "vehicles of a user": "SELECT id, marque, model FROM vehicul WHERE user_id=?",
+}
+
+_VTAB_INDEX_SEARCH = re.compile(r"VIRTUAL TABLE INDEX \d+:\S")
+
+def full_scans(conn, queries=None):
+    """
+    Runs EXPLAIN QUERY PLAN on each query (HOT_QUERIES by default).
+    Returns {query name: [plan lines]} for the queries whose plan contains a full table scan.
+    """
+    offenders = {}
+    for name, sql in (queries or HOT_QUERIES).items():
+        params = (None,) * sql.count("?")
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # "SCAN t" is a full scan; "SCAN t USING COVERING INDEX" walks a whole index, just as bad.
+        # Virtual tables (FTS5, R*Tree) always show as SCAN; "INDEX n:<constraints>" means their
+        # own index is searched, an empty constraint string means a full scan.
+        if any(line.startswith("SCAN ") and not _VTAB_INDEX_SEARCH.search(line) for line in plan):
+            offenders[name] = plan
+    return offenders
+
+if __name__ == "__main__":
+    # Self-check: migrate a scratch database and verify the hot query plans
+    import os
+    import tempfile
+    from Connection_Fahrten import use_database, close_all_connections
+
+    scratch = os.path.join(tempfile.mkdtemp(), "migrations_check.db")
+    use_database(scratch)
+    print(f"Applied: {run_migrations()}")
+    assert run_migrations() == [], "A second run must not apply anything"
+    with db_connection() as conn:
+        assert schema_version(conn) == len(MIGRATIONS)
+        offenders = full_scans(conn)
+    for name, plan in offenders.items():
+        print(f"FULL SCAN in '{name}': {plan}")
+    assert not offenders, "Hot queries must use an index"
+    print(f"All {len(HOT_QUERIES)} hot queries use an index.")
+    close_all_connections()
@@ -0,0 +1,110 @@
+import json
+import re
+import threading
+import time
+import random
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from Geo_Fahrten import haversine_km
+from Routing_Fahrten import ROAD_FACTOR, AVERAGE_SPEED_KMH
+
+GEOMETRY_POINTS = 50
+
+_ROUTE_PATH = re.compile(r"^/route/v1/driving/(-?[\d.]+),(-?[\d.]+);(-?[\d.]+),(-?[\d.]+)$")
+_TABLE_PATH = re.compile(r"^/table/v1/driving/(-?[\d.]+,-?[\d.]+(?:;-?[\d.]+,-?[\d.]+)*)$")
+
+class _MockOsrmHandler(BaseHTTPRequestHandler):
+    """Answers /route/v1/driving and /table/v1/driving like OSRM does, with synthetic straight-line routes."""
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real server
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        path, _, query = self.path.partition("?")
+        match = _ROUTE_PATH.match(path)
+        table_match = _TABLE_PATH.match(path)
+        if server.failure_rate and random.random() < server.failure_rate:
+            self._send(503, {"code": "ServiceUnavailable"})
+        elif table_match:
+            coordinates = [tuple(map(float, c.split(","))) for c in table_match.group(1).split(";")]
+            points = [(lat, lon) for lon, lat in coordinates]
+            params = {k: v[0] for k, v in parse_qs(query).items()}
+            sources = [int(i) for i in params["sources"].split(";")] if "sources" in params else range(len(points))
+            destinations = ([int(i) for i in params["destinations"].split(";")]
+                            if "destinations" in params else range(len(points)))
+            self._send(200, synthetic_osrm_table([points[i] for i in sources], [points[j] for j in destinations]))
+        elif not match:
+            self._send(400, {"code": "InvalidUrl", "message": f"URL string malformed: {path}"})
+        else:
+            lon1, lat1, lon2, lat2 = map(float, match.groups())
+            self._send(200, synthetic_osrm_response((lat1, lon1), (lat2, lon2)))
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Benchmarks hammer this server; keep stderr quiet
+
+def synthetic_osrm_response(start_coords, end_coords):
+    """OSRM /route JSON for a straight line between two (lat, lon) points, sampled in GEOMETRY_POINTS points."""
+    distance_km = haversine_km(start_coords, end_coords) * ROAD_FACTOR
+    coordinates = [
+        [start_coords[1] + (end_coords[1] - start_coords[1]) * i / (GEOMETRY_POINTS - 1),
+         start_coords[0] + (end_coords[0] - start_coords[0]) * i / (GEOMETRY_POINTS - 1)]
+        for i in range(GEOMETRY_POINTS)
+    ]
+    return {
+        "code": "Ok",
+        "routes": [{
+            "distance": distance_km * 1000,
+            "duration": distance_km / AVERAGE_SPEED_KMH * 3600,
+            "geometry": {"type": "LineString", "coordinates": coordinates},
+        }],
+    }
+
+def synthetic_osrm_table(sources, destinations):
+    """OSRM /table JSON (distances and durations) for straight lines between (lat, lon) points."""
+    distances = [[haversine_km(s, d) * ROAD_FACTOR * 1000 for d in destinations] for s in sources]
+    return {
+        "code": "Ok",
+        "distances": distances,
+        "durations": [[m / 1000 / AVERAGE_SPEED_KMH * 3600 for m in row] for row in distances],
+    }
+
+def start_mock_osrm(host="127.0.0.1", port=0, latency=0.0, failure_rate=0.0):
+    """
+    Starts the mock OSRM server in a daemon thread.
+    Args:
+        port: 0 picks a free port.
+        latency: Seconds slept before answering each request (simulates network RTT).
+        failure_rate: Share of requests answered with HTTP 503 (exercises retries/circuit breaker).
+    Returns:
+        (server, base_url); call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), _MockOsrmHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.failure_rate = failure_rate
+    threading.Thread(target=server.serve_forever, name="mock-osrm", daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Local OSRM-compatible mock server for benchmarks and tests.")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of 503 answers (0-1)")
+    args = parser.parse_args()
+    server, base_url = start_mock_osrm(port=args.port, latency=args.latency, failure_rate=args.failure_rate)
+    print(f"Mock OSRM listening on {base_url} (set FAHRTEN_OSRM_BASE_URL={base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,265 @@
+import threading
+import time
+import random
+import bisect
+import requests
+from requests.adapters import HTTPAdapter
+
+# Per-provider limits. Nominatim's usage policy allows at most 1 request per second;
+# the public OSRM demo server asks for the same order of magnitude.
+PROVIDER_SETTINGS = {
+    "opencage": {"rate": 1.0, "burst": 1, "max_retries": 2, "failure_threshold": 5, "reset_timeout": 60},
+    "nominatim": {"rate": 1.0, "burst": 1, "max_retries": 2, "failure_threshold": 3, "reset_timeout": 120},
+    "osrm": {"rate": 1.0, "burst": 5, "max_retries": 2, "failure_threshold": 3, "reset_timeout": 60},
+}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RATE_LIMIT_WAIT_SECONDS = 10.0  # Give up on a call that would queue longer than this
+
+HTTP_DEFAULT_TIMEOUT = (3.05, 10)  # (connect, read) seconds, unless a call passes its own
+HTTP_POOL_CONNECTIONS = 8          # Distinct hosts kept in the pool
+HTTP_POOL_MAXSIZE = 16             # Keep-alive connections per host (>= prefetch workers)
+HTTP_USER_AGENT = "priminsberg_rides"  # Nominatim's policy requires an identifying User-Agent
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class ProviderUnavailable(Exception):
+    """Raised when a provider's circuit is open, its rate limit queue is full, or retries are exhausted."""
+
+    def __init__(self, provider, message):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` banked."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=RATE_LIMIT_WAIT_SECONDS):
+        """Takes one token, sleeping until one is available. Returns False if that takes longer than timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker.
+    closed: calls go through; `failure_threshold` consecutive failures open it.
+    open: calls are refused until `reset_timeout` seconds have passed.
+    half-open: a single trial call is let through; success closes, failure re-opens.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_running = False
+
+    def release(self):
+        """Ends a half-open trial without a verdict (the call never reached the provider)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+class ProviderGovernor:
+    """Rate limiter, retry policy and circuit breaker for one external provider."""
+
+    def __init__(self, name, rate, burst, max_retries, failure_threshold, reset_timeout):
+        self.name = name
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def is_available(self):
+        """True unless the circuit is open (cheap check used to pick a fallback up front)."""
+        return self.breaker.state != "open" or time.monotonic() - self.breaker.opened_at >= self.breaker.reset_timeout
+
+    def call(self, fn, *args, retry_on=(Exception,), **kwargs):
+        """
+        Runs fn(*args, **kwargs) under the provider's rate limit.
+        Exceptions listed in retry_on are retried up to max_retries times with jittered
+        exponential backoff, then counted as one failure by the circuit breaker.
+        Raises:
+            ProviderUnavailable: circuit open, rate limit wait too long, or retries exhausted.
+        """
+        if not self.breaker.allow():
+            raise ProviderUnavailable(self.name, "circuit open")
+        attempt = 0
+        while True:
+            if not self.bucket.acquire():
+                # Not the provider's fault: no failure is counted
+                self.breaker.release()
+                raise ProviderUnavailable(self.name, "rate limit queue full")
+            try:
+                result = fn(*args, **kwargs)
+            except retry_on as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self.breaker.record_failure()
+                    raise ProviderUnavailable(self.name, f"giving up after {attempt} attempts: {e}") from e
+                # "Full jitter" backoff: random delay up to the exponential cap
+                time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+                continue
+            except Exception:
+                # Not a provider outage (e.g. a bug or bad input): propagate without a verdict
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+_governors = {name: ProviderGovernor(name, **settings) for name, settings in PROVIDER_SETTINGS.items()}
+
+def get_governor(provider):
+    """Returns the process-wide governor of a provider ("opencage", "nominatim" or "osrm")."""
+    return _governors[provider]
+
+def governed_call(provider, fn, *args, retry_on=(Exception,), **kwargs):
+    """Shortcut for get_governor(provider).call(fn, *args, retry_on=retry_on, **kwargs)."""
+    return _governors[provider].call(fn, *args, retry_on=retry_on, **kwargs)
+
+# --- Shared HTTP client ---
+
+class _TimeoutSession(requests.Session):
+    """requests.Session that applies HTTP_DEFAULT_TIMEOUT to calls that do not pass one."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", HTTP_DEFAULT_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Returns the process-wide HTTP session shared by every Streamlit session.
+    Connections are kept alive and pooled per host; retries are left to the governors.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = _TimeoutSession()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                                      pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["User-Agent"] = HTTP_USER_AGENT
+                _http_session = session
+    return _http_session
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (milliseconds) for one external dependency."""
+
+    def __init__(self, bounds_ms=LATENCY_BUCKETS_MS):
+        self.bounds_ms = bounds_ms
+        self.counts = [0] * (len(bounds_ms) + 1)  # Last bucket: above the highest bound
+        self.total = 0
+        self.sum_ms = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds_ms, ms)] += 1
+            self.total += 1
+            self.sum_ms += ms
+            if error:
+                self.errors += 1
+
+    def quantile(self, q):
+        """Upper bound (ms) of the bucket holding the q-quantile; None above the last bound."""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = q * self.total
+            seen = 0
+            for bound, count in zip(self.bounds_ms + (None,), self.counts):
+                seen += count
+                if seen >= rank:
+                    return bound
+            return None
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f"<={b}ms": c for b, c in zip(self.bounds_ms, self.counts)}
+            buckets[f">{self.bounds_ms[-1]}ms"] = self.counts[-1]
+            total, sum_ms, errors = self.total, self.sum_ms, self.errors
+        return {
+            "count": total,
+            "errors": errors,
+            "mean_ms": sum_ms / total if total else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "buckets": buckets,
+        }
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def _histogram(dependency):
+    with _histograms_lock:
+        if dependency not in _histograms:
+            _histograms[dependency] = LatencyHistogram()
+        return _histograms[dependency]
+
+def http_get(dependency, url, **kwargs):
+    """
+    GET through the shared session, recording the call's latency under `dependency`
+    (e.g. "osrm", "opencage", "nominatim", "ipify"). Network errors are recorded and re-raised.
+    """
+    start = time.perf_counter()
+    try:
+        response = get_http_session().get(url, **kwargs)
+    except requests.RequestException:
+        _histogram(dependency).observe(time.perf_counter() - start, error=True)
+        raise
+    _histogram(dependency).observe(time.perf_counter() - start, error=response.status_code >= 500)
+    return response
+
+def latency_histograms():
+    """Snapshot of every dependency's latency histogram, keyed by dependency name."""
+    with _histograms_lock:
+        names = list(_histograms)
+    return {name: _histogram(name).snapshot() for name in names}
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import functools
+import threading
+from types import MappingProxyType
+from collections import OrderedDict, Counter
+from Config_Fahrten import get_setting
+
+# Read-through cache of data-access results (profiles, vehicles, ride listings), shared by every
+# Streamlit session of the process, so a rerun that changes nothing does not query SQLite again.
+# Every entry carries tags naming what it was read from: a table ("rides", "users") or an entity
+# ("ride:12", "vehicles:user:3"). Write functions call invalidate_queries() with the tags they
+# touched, inside their transaction; other server processes learn about them through the
+# change_log row it commits with the write (ChangeLog). The TTL bounds what writes cannot signal: rides leaving the listings when
+# their day is over.
+QUERY_CACHE_SIZE_MB = get_setting("QUERY_CACHE_SIZE_MB", 32, int)  # 0 disables the cache
+QUERY_CACHE_TTL_SECONDS = get_setting("QUERY_CACHE_TTL_SECONDS", 300, int)
+CHANGE_LOG_KEEP = 10000   # change_log rows kept; a process that fell further behind drops its whole cache
+CHANGE_LOG_PRUNE_EVERY = 1000
+
+def _approx_size(value):
+    """Rough memory footprint of a cached result in bytes (containers plus their items)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(_approx_size(item) for item in value)
+    elif isinstance(value, (dict, MappingProxyType)):
+        size += sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    return size
+
+def _freeze_result(value):
+    """Read-only version of a result shared between sessions: lists become tuples, dicts read-only views."""
+    if isinstance(value, list):
+        return tuple(value)  # Rows from sqlite3 are already tuples
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze_result(v) for k, v in value.items()})
+    if isinstance(value, tuple) and any(isinstance(item, (list, dict)) for item in value):
+        return tuple(_freeze_result(item) for item in value)
+    return value
+
+def _freeze_arg(value):
+    """Hashable version of an argument; iterables (lists, generators) are read once into tuples."""
+    if isinstance(value, (str, bytes)):
+        return value
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze_arg(v)) for k, v in value.items()))
+    if isinstance(value, (tuple, list, set, frozenset)) or hasattr(value, "__next__"):
+        return tuple(_freeze_arg(item) for item in value)
+    return value
+
+class QueryCache:
+    """
+    LRU of query results bounded by their approximate size in bytes, with tag invalidation.
+    A load that overlaps an invalidation of one of its tags is returned but not stored: it may
+    have read the rows from before the write.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_SIZE_MB * 1024 * 1024, ttl=QUERY_CACHE_TTL_SECONDS, sync=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sync = sync               # Called before every lookup (ChangeLog.sync), or None
+        self._entries = OrderedDict()  # key -> (result, tags, size, expires_at)
+        self._tagged = {}              # tag -> keys of the entries carrying it
+        self._versions = Counter()     # tag -> invalidations so far
+        self._generation = 0           # clear() calls so far
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = Counter()          # function name -> hits
+        self.misses = Counter()        # function name -> misses
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        _, tags, size, _ = self._entries.pop(key)
+        self.bytes -= size
+        for tag in tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def _store(self, key, result, tags):
+        size = _approx_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (result, tags, size, time.monotonic() + self.ttl)
+        self.bytes += size
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get_or_load(self, name, key, tags, load):
+        """
+        Returns the cached result for key, or calls load() and caches its result under tags.
+        Args:
+            name: Function name the hit/miss counters are kept under.
+            key: Hashable key of the query and its parameters.
+            tags: Tags invalidating the entry (tuple of str).
+            load: Callable running the query.
+        """
+        if self.sync is not None:
+            self.sync()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[3] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits[name] += 1
+                    return entry[0]
+                self._drop(key)
+            self.misses[name] += 1
+            versions = [self._generation] + [self._versions[tag] for tag in tags]
+        result = _freeze_result(load())
+        with self._lock:
+            if versions == [self._generation] + [self._versions[tag] for tag in tags]:
+                self._store(key, result, tags)
+        return result
+
+    def invalidate(self, *tags):
+        """Drops every entry carrying one of the tags, and any load of them still running."""
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] += 1
+                for key in list(self._tagged.get(tag, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """Drops everything, e.g. when the process switches to another database file."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tagged.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns hit/miss counters and the hit rate since process start, overall and per function."""
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "functions": {
+                    name: {"hits": self.hits[name], "misses": self.misses[name],
+                           "hit_rate": self.hits[name] / (self.hits[name] + self.misses[name])}
+                    for name in sorted(self.hits.keys() | self.misses.keys())
+                },
+            }
+
+class ChangeLog:
+    """
+    Keeps a QueryCache coherent with the writes of other processes using the same database.
+    Every invalidation is also appended to the change_log table. Before each cache lookup, sync()
+    reads PRAGMA data_version on a dedicated connection; it only changes when another connection
+    has committed, so while nothing was written a hit costs that one pragma and no query. When it
+    changed, the change_log rows appended since the last sync are read and their tags invalidated.
+    This process's own tags were already dropped when written, but before the commit: they are
+    invalidated once more, for a load that ran in between and read the rows from before the write.
+    """
+
+    def __init__(self, cache, keep=CHANGE_LOG_KEEP):
+        self.cache = cache
+        self.keep = keep
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"  # Unique even if a pid is reused
+        self._conn = None
+        self._data_version = None
+        self._last_seq = 0
+        self._lock = threading.Lock()
+        self.reads = 0                 # data_version changes followed by a change_log read
+        self.remote_invalidations = 0  # Tags invalidated because another process wrote them
+        self.own_invalidations = 0     # Own tags invalidated again once committed
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+    def reset(self):
+        """Forgets the database followed so far (use_database); the next sync starts from its current state."""
+        with self._lock:
+            self._close()
+
+    def _connect(self):
+        from Connection_Fahrten import open_connection  # Imported lazily: it imports this module
+        self._conn = open_connection()
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+    def sync(self):
+        """Invalidates what other processes changed since the last call."""
+        with self._lock:
+            try:
+                if self._conn is None:
+                    self._connect()
+                    return
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version == self._data_version:
+                    return
+                rows = self._conn.execute(
+                    "SELECT seq, origin, tags FROM change_log WHERE seq > ? ORDER BY seq", (self._last_seq,)).fetchall()
+            except sqlite3.Error as e:
+                print(f"Error reading change_log: {e}")
+                self._close()
+                return
+            self._data_version = data_version
+            self.reads += 1
+            missed = bool(rows) and rows[0][0] > self._last_seq + 1  # Pruned before this process read them
+            remote, own = set(), set()
+            for seq, origin, row_tags in rows:
+                self._last_seq = seq
+                (own if origin == self.origin else remote).update(json.loads(row_tags))
+            self.remote_invalidations += len(remote)
+            self.own_invalidations += len(own)
+        if missed:
+            self.cache.clear()
+        elif remote or own:
+            self.cache.invalidate(*(remote | own))
+
+    def record(self, conn, tags):
+        """
+        Appends the tags of a write for the other processes, on the writer's connection: the row is
+        committed or rolled back with the write itself. Trims the log now and then.
+        """
+        seq = conn.execute("INSERT INTO change_log (origin, tags, changed_at) VALUES (?, ?, ?)",
+                           (self.origin, json.dumps(sorted(tags)), int(time.time()))).lastrowid
+        if seq % CHANGE_LOG_PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM change_log WHERE seq <= ?", (seq - self.keep,))
+
+query_cache = QueryCache()
+change_log = ChangeLog(query_cache)
+query_cache.sync = change_log.sync
+
+def invalidate_queries(conn, *tags):
+    """
+    To be called by write functions on their connection, before their commit, with the
+    tables/entities they changed. Logs the tags in change_log within the write's transaction, so a
+    committed write is always seen by the other processes, and drops the entries of this process.
+    """
+    if tags:
+        change_log.record(conn, tags)
+    query_cache.invalidate(*tags)
+
+def cached_query(tags):
+    """
+    Decorator caching a data-access function in query_cache.
+    Args:
+        tags: Tags of the result, e.g. ("rides", "users"), or a callable receiving the function's
+            arguments and returning them, e.g. lambda user_id: [f"vehicles:user:{user_id}"].
+    The result is returned read-only (lists as tuples, dicts as read-only views): it is shared
+    with every other caller. Iterable arguments are read into tuples before the call.
+    The undecorated function stays available as `.uncached`.
+    """
+    tags_of = tags if callable(tags) else (lambda *args, **kwargs: tags)
+
+    def decorator(fn):
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            args = tuple(_freeze_arg(arg) for arg in args)
+            kwargs = {k: _freeze_arg(v) for k, v in kwargs.items()}
+            key = (name, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return fn(*args, **kwargs)  # Unhashable parameter: not cacheable
+            return query_cache.get_or_load(name, key, tuple(tags_of(*args, **kwargs)), lambda: fn(*args, **kwargs))
+
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
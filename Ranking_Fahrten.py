@@ -0,0 +1,63 @@
+import numpy as np
+from datetime import datetime
+from Geo_Fahrten import EARTH_RADIUS_KM
+
+# Relevance of a bookable ride for one user: each term decays from 1 (perfect) towards 0.
+#   station     - ride start close to the user's home station
+#   destination - ride destination close to the destination the user searched for
+#   time        - departure soon after the reference time (now, or the start of the searched dates)
+RANKING_WEIGHTS = {"station": 0.5, "destination": 0.3, "time": 0.2}
+DISTANCE_SCALE_KM = 20.0   # A start 20 km away scores 1/e of a start at the station
+TIME_SCALE_HOURS = 48.0    # A departure in 2 days scores 1/e of one leaving now
+RANKING_MAX_CANDIDATES = 50000
+
+def haversine_km_np(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in km; arguments are arrays (or scalars) in degrees, NaN propagates."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+def _closeness(point, lat, lon):
+    """exp(-distance / DISTANCE_SCALE_KM) for every ride; 0 where the ride has no coordinates."""
+    closeness = np.exp(-haversine_km_np(point[0], point[1], lat, lon) / DISTANCE_SCALE_KM)
+    return np.nan_to_num(closeness, nan=0.0)
+
+def relevance_scores(start_lat, start_lon, dest_lat, dest_lon, departure, station=None, destination=None,
+                     reference_time=None, weights=RANKING_WEIGHTS):
+    """
+    Scores every candidate ride in one vectorized pass.
+    Args:
+        start_lat, start_lon, dest_lat, dest_lon: float arrays (NaN where not geocoded).
+        departure: datetime64 array of departure times.
+        station: (lat, lon) of the user's station, or None to ignore that term.
+        destination: (lat, lon) of the searched destination, or None to ignore that term.
+        reference_time: datetime the time term is measured from (default: now).
+    Returns:
+        A float array of scores, higher is more relevant.
+    """
+    scores = np.zeros(len(departure))
+    if station:
+        scores += weights["station"] * _closeness(station, start_lat, start_lon)
+    if destination:
+        scores += weights["destination"] * _closeness(destination, dest_lat, dest_lon)
+    reference = np.datetime64(reference_time or datetime.now(), "m")
+    hours = (departure - reference) / np.timedelta64(1, "h")
+    scores += weights["time"] * np.exp(-np.maximum(hours, 0.0) / TIME_SCALE_HOURS)
+    return scores
+
+def rank_rides(candidates, station=None, destination=None, reference_time=None):
+    """
+    Orders candidate rides by relevance.
+    Args:
+        candidates: Dict of arrays (id, start_lat, start_lon, dest_lat, dest_lon, departure) in
+            departure order, as returned by Database_Fahrten.get_ride_candidates_db.
+        station, destination, reference_time: See relevance_scores.
+    Returns:
+        The ride ids, most relevant first; equal scores keep departure order.
+    """
+    if not len(candidates["id"]):
+        return []
+    scores = relevance_scores(candidates["start_lat"], candidates["start_lon"], candidates["dest_lat"],
+                              candidates["dest_lon"], candidates["departure"], station, destination, reference_time)
+    order = np.argsort(-scores, kind="stable")
+    return candidates["id"][order].tolist()
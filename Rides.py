@@ -6,59 +6,52 @@ from datetime import date, timedelta
 from PIL import Image
 import os
 import base64
-from Database_Fahrten import setup_db
-from Utils_Fahrten import display_logo, hash_password, verify_password, translate, get_base64_icon, styled_subheader
+from Database_Fahrten import (setup_db, add_ride_db, update_ride_db, delete_ride_db, book_ride_db,
+                              get_passengers_by_ride_db, search_rides_db, get_ride_candidates_db, find_rides_near_db,
+                              update_user_station_place, RIDES_PAGE_SIZE)
+from Ranking_Fahrten import rank_rides
+from Connection_Fahrten import db_connection
+from QueryCache_Fahrten import cached_query, invalidate_queries
+from Locations_Fahrten import location_coords, get_place_index
+from Geo_Fahrten import normalize_address
+from Matching_Fahrten import match_rides
+from Utils_Fahrten import (display_logo, hash_password, verify_password, translate, get_base64_icon, styled_subheader,
+                           get_user_by_username_db)
 from Css import style_css
 from streamlit_folium import folium_static
 import folium
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-from opencage.geocoder import OpenCageGeocode
-import requests
+from Routing_Fahrten import fetch_route, format_route_info, prefetch_geodata
 
 def get_route_info(start_coords, end_coords):
-    """Obtient les informations d'itinéraire (distance, durée) depuis l'API OSRM"""
-    try:
-        osrm_url = f"http://router.project-osrm.org/route/v1/driving/{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}?overview=full"
-        response = requests.get(osrm_url)
-        route_data = response.json()
-        
-        if route_data.get('code') == 'Ok':
-            distance_km = route_data['routes'][0]['distance'] / 1000  # Convertir en km
-            duration_min = route_data['routes'][0]['duration'] / 60   # Convertir en minutes
-            
-            # Formater les résultats
-            distance_str = f"{distance_km:.1f} km"
-            duration_str = f"{int(duration_min // 60)}h{int(duration_min % 60):02d}" if duration_min >= 60 else f"{int(duration_min)} min"
-            
-            return distance_str, duration_str
-        return None, None
-    except:
-        return None, None
+    """Obtient les informations d'itinéraire (distance, durée) via le cache d'itinéraires OSRM"""
+    return format_route_info(fetch_route(start_coords, end_coords))
 
-def geocode_address(address):
-    """Fonction pour géocoder une adresse en coordonnées GPS."""
-    try:
-        api_key = st.secrets["OPEN_CAGE_API_KEY"]
-        geolocator = OpenCageGeocode(api_key)
-        results = geolocator.geocode(address)
-        if results and len(results):
-            return (results[0]['geometry']['lat'], results[0]['geometry']['lng'])
+def coords_or_none(lat, lon):
+    """Retourne les coordonnées stockées sur un trajet, ou None si l'adresse n'a pas été géocodée."""
+    if lat is None or lon is None:
         return None
-    except KeyError:
-       # st.warning("OpenCage API key not found in secrets. Falling back to Nominatim (may be rate-limited).")
-        geolocator = Nominatim(user_agent="priminsberg_rides")
-        try:
-            location = geolocator.geocode(address, timeout=10)
-            if location:
-                return (location.latitude, location.longitude)
-            return None
-        except GeocoderTimedOut:
-            st.warning(f"Geocoding timed out for: {address}. Retrying...")
-            return geocode_address(address)
-        except Exception as e:
-            st.error(f"Erreur de géocodage pour {address}: {e}")
-            return None
+    return (lat, lon)
+
+def _pick_place_suggestion(key):
+    """Recopie la suggestion choisie dans le champ de lieu."""
+    choice = st.session_state.get(f"{key}_suggestions")
+    if choice:
+        st.session_state[key] = choice
+    st.session_state[f"{key}_suggestions"] = None
+
+def place_input(label, key, value=""):
+    """
+    Champ de lieu avec suggestions des lieux déjà connus (index de préfixes en mémoire, sans appel réseau).
+    Hors formulaire : les suggestions se mettent à jour dès que le champ est validé.
+    """
+    if key not in st.session_state:
+        st.session_state[key] = value or ""
+    text = st.text_input(label, key=key)
+    suggestions = [s for s in get_place_index().suggest(text) if normalize_address(s) != normalize_address(text)]
+    if suggestions:
+        st.pills(translate("Suggestions"), suggestions, key=f"{key}_suggestions", label_visibility="collapsed",
+                 on_change=_pick_place_suggestion, args=(key,))
+    return text
 
 def calculate_arrival_time(departure_time_str, duration_str):
     """Calcule l'heure d'arrivée estimée"""
@@ -80,21 +73,53 @@ def calculate_arrival_time(departure_time_str, duration_str):
         return "N/A"
 
 
-def show_my_rides():
-    styled_subheader("Trajets réservés/Reservierte Fahrten")
-    with sqlite3.connect('priminsberg_rides.db') as conn:
+@cached_query(("rides", "users"))
+def get_booked_rides_db(user_id):
+    """Trajets à venir réservés par un utilisateur, avec leur conducteur (en cache jusqu'à la prochaine écriture)."""
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute(
             """SELECT r.id, u.username, r.start_location, r.destination, r.date, r.time, r.available_seats,
-                      r.provider_id, b.id, u.first_name, u.last_name, u.phone, u.email
+                      r.provider_id, b.id, u.first_name, u.last_name, u.phone, u.email,
+                      r.start_lat, r.start_lon, r.dest_lat, r.dest_lon
                FROM bookings b
                JOIN rides r ON b.ride_id = r.id
                JOIN users u ON r.provider_id = u.id
-               WHERE b.user_id=? AND SUBSTR(r.date,7,4)||SUBSTR(r.date,4,2)||SUBSTR(r.date,1,2) >= STRFTIME('%Y%m%d','now')
-               ORDER BY SUBSTR(r.date,7,4)||SUBSTR(r.date,4,2)||SUBSTR(r.date,1,2), r.time""",
-            (st.session_state.current_user[0],))
-        booked_rides = c.fetchall()
+               WHERE b.user_id=? AND r.departure_at >= DATE('now')
+               ORDER BY r.departure_at""",
+            (user_id,))
+        return c.fetchall()
+
+@cached_query(("rides",))
+def get_offered_rides_db(user_id):
+    """Trajets proposés par un utilisateur (en cache jusqu'à la prochaine écriture sur les trajets)."""
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute(
+            "SELECT id, start_location, destination, date, time, available_seats, start_lat, start_lon, dest_lat, dest_lon FROM rides WHERE provider_id=? ORDER BY departure_at",
+            (user_id,))
+        return c.fetchall()
+
+@cached_query(("rides",))
+def get_ride_db(ride_id):
+    """Champs modifiables d'un trajet, ou None s'il n'existe plus."""
+    with db_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT start_location, destination, date, time, available_seats FROM rides WHERE id=?", (ride_id,))
+        return c.fetchone()
+
+def show_my_rides():
+    booked_rides = get_booked_rides_db(st.session_state.current_user[0])
+    offered_rides = get_offered_rides_db(st.session_state.current_user[0])
+    # Passagers de tous les trajets proposés en une seule requête
+    passengers_by_ride = get_passengers_by_ride_db(f[0] for f in offered_rides)
+
+    # Itinéraires de toute la page résolus en parallèle avant le premier expander
+    _, routes = prefetch_geodata(coordinate_pairs=(
+        [(coords_or_none(f[13], f[14]), coords_or_none(f[15], f[16])) for f in booked_rides] +
+        [(coords_or_none(f[6], f[7]), coords_or_none(f[8], f[9])) for f in offered_rides]))
 
+    styled_subheader("Trajets réservés/Reservierte Fahrten")
     if not booked_rides:
         st.info("Vous n'avez réservé aucun trajet.")
     else:
@@ -113,11 +138,11 @@ def show_my_rides():
                 """, unsafe_allow_html=True)
                 
                 # Section Informations sur l'itinéraire
-                start_coords = geocode_address(f[2])
-                end_coords = geocode_address(f[3])
+                start_coords = coords_or_none(f[13], f[14])
+                end_coords = coords_or_none(f[15], f[16])
                 
                 if start_coords and end_coords:
-                    distance, duration = get_route_info(start_coords, end_coords)
+                    distance, duration = format_route_info(routes.get((start_coords, end_coords)))
                     arrival_time = calculate_arrival_time(f[5], duration) if duration else "N/A"
                     
                     st.markdown(f"""
@@ -145,26 +170,20 @@ def show_my_rides():
                 """, unsafe_allow_html=True)
 
                 if st.button("Annuler la réservation", key=f"cancel_booking_{f[8]}"):
-                    with sqlite3.connect('priminsberg_rides.db') as conn:
+                    with db_connection() as conn:
                         c = conn.cursor()
                         c.execute("SELECT ride_id FROM bookings WHERE id=?", (f[8],))
                         ride_id_to_update = c.fetchone()
                         if ride_id_to_update:
                             c.execute("UPDATE rides SET available_seats=available_seats+1 WHERE id=?", (ride_id_to_update[0],))
                         c.execute("DELETE FROM bookings WHERE id=?", (f[8],))
+                        invalidate_queries(conn, "rides", f"ride:{f[0]}")
                         conn.commit()
                     st.success("Réservation annulée !")
                     st.rerun()
 
     st.markdown("---")
     styled_subheader("Trajets proposés/Angebotene Fahrten")
-    with sqlite3.connect('priminsberg_rides.db') as conn:
-        c = conn.cursor()
-        c.execute(
-            "SELECT id, start_location, destination, date, time, available_seats FROM rides WHERE provider_id=? ORDER BY SUBSTR(date,7,4)||SUBSTR(date,4,2)||SUBSTR(date,1,2), time",
-            (st.session_state.current_user[0],))
-        offered_rides = c.fetchall()
-
     if not offered_rides:
         st.info("Vous n'avez proposé aucun de vos propres trajets.")
     else:
@@ -180,14 +199,7 @@ def show_my_rides():
                             Passagers sur ce trajet
                         </h4>
                     """, unsafe_allow_html=True)
-                    with sqlite3.connect('priminsberg_rides.db') as conn:
-                        c = conn.cursor()
-                        c.execute('''SELECT u.first_name, u.last_name, u.username, u.email, u.phone
-                                    FROM bookings b
-                                    JOIN users u ON b.user_id = u.id
-                                    WHERE b.ride_id=?
-                                 ''', (f[0],))
-                        passengers_on_ride = c.fetchall()
+                    passengers_on_ride = passengers_by_ride[f[0]]
                     if not passengers_on_ride:
                         st.markdown("<p style='color: white;'>Pas encore de passagers pour ce trajet.</p>", unsafe_allow_html=True)
                     else:
@@ -203,11 +215,13 @@ def show_my_rides():
                         </h4>
                     """, unsafe_allow_html=True)
                     
-                    start_coords = geocode_address(f[1])
-                    end_coords = geocode_address(f[2])
+                    start_coords = coords_or_none(f[6], f[7])
+                    end_coords = coords_or_none(f[8], f[9])
                     
+                    # Un seul itinéraire (préchargé) pour la distance, la durée et le tracé de la carte
+                    route = routes.get((start_coords, end_coords))
                     if start_coords and end_coords:
-                        distance, duration = get_route_info(start_coords, end_coords)
+                        distance, duration = format_route_info(route)
                         arrival_time = calculate_arrival_time(f[4], duration) if duration else "N/A"
                         
                         st.markdown(f"""
@@ -228,11 +242,8 @@ def show_my_rides():
                             st.rerun()
                     with col_btn2:
                         if st.button("Supprimer", key=f"delete_ride_{f[0]}", use_container_width=True):
-                            with sqlite3.connect('priminsberg_rides.db') as conn:
-                                c = conn.cursor()
-                                c.execute("DELETE FROM rides WHERE id=?", (f[0],))
-                                c.execute("DELETE FROM bookings WHERE ride_id=?", (f[0],))
-                                conn.commit()
+                            # Réservations, cache et index des itinéraires mis à jour ensemble
+                            delete_ride_db(f[0])
                             st.success("Trajet supprimé !")
                             st.rerun()
                 
@@ -256,27 +267,14 @@ def show_my_rides():
                             icon=folium.Icon(color='red')
                         ).add_to(m)
                         
-                        try:
-                            osrm_url = f"http://router.project-osrm.org/route/v1/driving/{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}?overview=full&geometries=geojson"
-                            response = requests.get(osrm_url)
-                            route_data = response.json()
-                            
-                            if route_data.get('code') == 'Ok':
-                                route_coords = [(coord[1], coord[0]) for coord in route_data['routes'][0]['geometry']['coordinates']]
-                                folium.PolyLine(
-                                    locations=route_coords,
-                                    color='blue',
-                                    weight=3,
-                                    opacity=0.7
-                                ).add_to(m)
-                            else:
-                                folium.PolyLine(
-                                    locations=[start_coords, end_coords],
-                                    color='blue',
-                                    weight=2.5,
-                                    opacity=1
-                                ).add_to(m)
-                        except:
+                        if route and route.get('geometry'):
+                            folium.PolyLine(
+                                locations=route['geometry'],
+                                color='blue',
+                                weight=3,
+                                opacity=0.7
+                            ).add_to(m)
+                        else:
                             folium.PolyLine(
                                 locations=[start_coords, end_coords],
                                 color='blue',
@@ -288,10 +286,7 @@ def show_my_rides():
                     else:
                         st.warning("Impossible de géocoder une ou plusieurs adresses")
 def edit_ride(ride_id):
-    with sqlite3.connect('priminsberg_rides.db') as conn:
-        c = conn.cursor()
-        c.execute("SELECT start_location, destination, date, time, available_seats FROM rides WHERE id=?", (ride_id,))
-        r = c.fetchone()
+    r = get_ride_db(ride_id)
 
     if not r:
         st.error("Le trajet n'existe plus !")
@@ -309,12 +304,13 @@ def edit_ride(ride_id):
     except ValueError:
         current_time = datetime.time(0, 0)
 
+    start_location = place_input("Lieu de départ", key=f"edit_start_location_{ride_id}", value=r[0])
+    destination = place_input("Destination", key=f"edit_destination_{ride_id}", value=r[1])
     with st.form(key=f"edit_ride_form_{ride_id}"):
-        start_location = st.text_input("Lieu de départ", value=r[0], key=f"edit_start_location_{ride_id}")
-        destination = st.text_input("Destination", value=r[1], key=f"edit_destination_{ride_id}")
         date_input = st.date_input("Date", value=current_date, min_value=date.today(), key=f"edit_date_{ride_id}")
         time_input = st.time_input("Heure", value=current_time, key=f"edit_time_{ride_id}")
-        available_seats = st.number_input("Sièges disponibles", min_value=1, value=r[4], step=1, key=f"edit_available_seats_{ride_id}")
+        # Un trajet complet reste affiché (0 place libre) : il doit rester modifiable
+        available_seats = st.number_input("Sièges disponibles", min_value=0, value=r[4], step=1, key=f"edit_available_seats_{ride_id}")
 
         col1, col2 = st.columns(2)
         with col1:
@@ -328,44 +324,134 @@ def edit_ride(ride_id):
             st.rerun()
 
         if submitted:
-            if not all([start_location, destination, date_input, time_input, available_seats]):
+            if not all([start_location, destination, date_input, time_input]) or available_seats is None:
                 st.error("Veuillez remplir tous les champs !")
             else:
                 date_str_save = date_input.strftime("%d.%m.%Y")
                 time_str_save = time_input.strftime("%H:%M")
 
-                with sqlite3.connect('priminsberg_rides.db') as conn:
-                    c = conn.cursor()
-                    c.execute("UPDATE rides SET start_location=?, destination=?, date=?, time=?, available_seats=? WHERE id=?",
-                              (start_location, destination, date_str_save, time_str_save, available_seats, ride_id))
-                    conn.commit()
+                update_ride_db(ride_id, start_location, destination, date_str_save, time_str_save, available_seats)
                 st.success("Trajet mis à jour avec succès !")
                 if 'edit_ride' in st.session_state:
                     del st.session_state.edit_ride
                 st.rerun()
 
+def show_ride_search_form():
+    """Formulaire de recherche ; les filtres sont gardés en session et appliqués en SQL par search_rides_db."""
+    filters = st.session_state.setdefault("display_rides_filters", {})
+    # Une date gardée en session peut être passée depuis : date_input refuse une valeur avant min_value
+    today = date.today()
+    saved_date_from = max(filters["date_from"], today) if filters.get("date_from") else None
+    saved_date_to = max(filters["date_to"], today) if filters.get("date_to") else None
+    with st.expander(translate("Rechercher un trajet"), expanded=bool(filters)):
+        with st.form(key="ride_search_form"):
+            col_from, col_to = st.columns(2)
+            origin = col_from.text_input(translate("Lieu de départ"), value=filters.get("origin", ""), key="search_origin")
+            destination = col_to.text_input(translate("Destination"), value=filters.get("destination", ""), key="search_destination")
+            along_route = st.checkbox(translate("Inclure les trajets qui passent près de ces lieux"),
+                                      value=filters.get("along_route", False), key="search_along_route")
+            col_date_from, col_date_to = st.columns(2)
+            date_from = col_date_from.date_input(translate("Du"), value=saved_date_from, min_value=today, key="search_date_from")
+            date_to = col_date_to.date_input(translate("Au"), value=saved_date_to, min_value=today, key="search_date_to")
+            col_seats, col_driver, col_near = st.columns(3)
+            min_seats = col_seats.number_input(translate("Sièges disponibles"), min_value=1, step=1, value=filters.get("min_seats", 1), key="search_min_seats")
+            driver = col_driver.text_input(translate("Conducteur"), value=filters.get("driver", ""), key="search_driver")
+            near_km = col_near.number_input(translate("Départ à moins de (km) de ma gare"), min_value=0, max_value=500, step=5,
+                                            value=filters.get("near_km", 0), key="search_near_km", help=translate("0 = partout"))
+            sort = st.radio(translate("Trier par"), ["date", "relevance"], horizontal=True, key="search_sort",
+                            index=["date", "relevance"].index(filters.get("sort", "date")),
+                            format_func=lambda option: translate("Date" if option == "date" else "Pertinence"))
+            col_search, col_reset = st.columns(2)
+            searched = col_search.form_submit_button(translate("Rechercher"))
+            reset = col_reset.form_submit_button(translate("Réinitialiser"))
+        if searched or reset:
+            st.session_state.display_rides_filters = {} if reset else {
+                "origin": origin, "destination": destination, "date_from": date_from,
+                "date_to": date_to, "min_seats": min_seats, "driver": driver, "near_km": near_km,
+                "along_route": along_route, "sort": sort,
+                # Lieux géocodés une fois ici, pas à chaque page : corridor (départ et destination), tri (destination)
+                "origin_coords": location_coords(origin) if along_route and origin and destination else None,
+                "destination_coords": location_coords(destination) if destination and (along_route or sort == "relevance") else None,
+            }
+            # Nouveaux critères : on repart de la première page
+            st.session_state.display_rides_pages = 1
+            st.rerun()
+    return filters
+
+def user_station_coords():
+    """
+    Coordonnées de la gare de l'utilisateur, enregistrées avec son profil.
+    Une gare enregistrée avant que ses coordonnées le soient est localisée une fois, puis enregistrée.
+    """
+    user = st.session_state.current_user
+    if user[10] is None and user[5] and update_user_station_place(user[0], user[5]):
+        user = st.session_state.current_user = get_user_by_username_db(user[1])
+    return (user[10], user[11]) if user[10] is not None else None
+
+def ride_search_kwargs(filters):
+    """Convertit les filtres du formulaire en arguments de search_rides_db (rayon, corridor -> coordonnées)."""
+    search = dict(filters)
+    near_km = search.pop("near_km", 0)
+    pickup, dropoff = search.pop("origin_coords", None), search.pop("destination_coords", None)
+    if search.pop("along_route", False) and search.get("origin") and search.get("destination"):
+        # Corridor : en plus des correspondances textuelles, les trajets dont l'itinéraire passe
+        # près du départ puis de la destination demandés
+        if pickup and dropoff:
+            search["along_ride_ids"] = [m["ride_id"] for m in match_rides(pickup, dropoff)]
+        else:
+            st.warning(translate("Lieux introuvables : recherche le long de l'itinéraire ignorée."))
+    if near_km:
+        station_coords = user_station_coords()
+        if station_coords:
+            # Trajets proches cherchés une fois ici : la même liste sert à toutes les pages
+            search["ride_ids"] = [ride_id for ride_id, _ in find_rides_near_db(station_coords, near_km)]
+        else:
+            st.warning(translate("Votre gare n'a pas pu être localisée : filtre de distance ignoré."))
+    return search
+
+def load_ranked_rides(filters, search, pages):
+    """
+    Trajets triés par pertinence (gare de l'utilisateur, destination cherchée, heure de départ).
+    Tous les candidats sont notés en une passe NumPy ; seules les lignes affichées sont ensuite lues.
+    Retourne (rows, has_more).
+    """
+    user = st.session_state.current_user
+    candidates = get_ride_candidates_db(user[0], **search)
+    # Gare enregistrée avec le profil, destination géocodée à la validation du formulaire
+    station = user_station_coords()
+    destination = filters.get("destination_coords")
+    reference_time = datetime.datetime.combine(filters["date_from"], datetime.time()) if filters.get("date_from") else None
+    ranked = rank_rides(candidates, station, destination, reference_time)
+    shown = ranked[:pages * RIDES_PAGE_SIZE]
+    if not shown:
+        return [], False
+    rows, _ = search_rides_db(user[0], ride_ids=shown, limit=len(shown))
+    position = {ride_id: i for i, ride_id in enumerate(shown)}
+    rows = sorted(rows, key=lambda r: position[r[0]])  # Résultat en cache : partagé, non modifiable
+    return rows, len(ranked) > len(shown)
+
 def show_display_rides():
-    with sqlite3.connect('priminsberg_rides.db') as conn:
-        c = conn.cursor()
-        c.execute("DELETE FROM rides WHERE available_seats <= 0 OR SUBSTR(date,7,4)||SUBSTR(date,4,2)||SUBSTR(date,1,2) < STRFTIME('%Y%m%d','now')")
-        conn.commit()
-
-        c.execute('''
-            SELECT r.id, u.username, r.start_location, r.destination, r.date, r.time, r.available_seats,
-                   u.first_name, u.last_name, u.email, u.phone
-            FROM rides r
-            JOIN users u ON r.provider_id = u.id
-            WHERE r.available_seats > 0
-              AND SUBSTR(r.date,7,4)||SUBSTR(r.date,4,2)||SUBSTR(r.date,1,2) >= STRFTIME('%Y%m%d','now')
-              AND r.provider_id != ?
-              AND r.id NOT IN (SELECT ride_id FROM bookings WHERE user_id=?)
-            ORDER BY SUBSTR(r.date,7,4)||SUBSTR(r.date,4,2)||SUBSTR(r.date,1,2) ASC, r.time ASC
-        ''', (st.session_state.current_user[0], st.session_state.current_user[0]))
-        rows = c.fetchall()
+    filters = show_ride_search_form()
+    search = ride_search_kwargs(filters)
+    # Lecture seule : les trajets passés sont archivés par la tâche de fond (start_ride_expiry_job)
+    pages = st.session_state.setdefault("display_rides_pages", 1)
+    if search.pop("sort", "date") == "relevance":
+        rows, has_more = load_ranked_rides(filters, search, pages)
+    else:
+        # Pagination par curseur : chaque page reprend après le dernier trajet de la précédente
+        rows, cursor = [], None
+        for _ in range(pages):
+            page_rows, cursor = search_rides_db(st.session_state.current_user[0], after=cursor, **search)
+            rows.extend(page_rows)
+            if cursor is None:
+                break
+        has_more = cursor is not None
 
     if not rows:
         st.info(translate("Aucun trajet réservable trouvé."))
     else:
+        # Passagers de tous les trajets affichés en une seule requête
+        passengers_by_ride = get_passengers_by_ride_db(r[0] for r in rows)
         for r in rows:
             with st.expander(f"{r[2]} → {r[3]}, {r[4]} {r[5]}, {translate('Fournisseur')} : {r[1]}, {translate('Sièges')} : {r[6]}", expanded=False):
                 st.markdown(f"""
@@ -388,14 +474,7 @@ def show_display_rides():
                 st.write(f"**{translate('Téléphone')} :** {r[10]}")
                 st.markdown("</div>", unsafe_allow_html=True)
 
-                with sqlite3.connect('priminsberg_rides.db') as conn:
-                    c = conn.cursor()
-                    c.execute('''SELECT u.first_name, u.last_name, u.username, u.email, u.phone
-                                FROM bookings b
-                                JOIN users u ON b.user_id = u.id
-                                WHERE b.ride_id=?
-                             ''', (r[0],))
-                    passengers = c.fetchall()
+                passengers = passengers_by_ride[r[0]]
 
                 st.markdown(f"""
                 <div style='background-color: var(--light-gray); padding: 15px; border-radius: 10px; margin-top: 10px;'>
@@ -410,29 +489,26 @@ def show_display_rides():
 
                 if r[6] > 0:
                     if st.button(translate("Réserver le trajet"), key=f"book_ride_{r[0]}"):
-                        with sqlite3.connect('priminsberg_rides.db') as conn:
-                            c = conn.cursor()
-                            c.execute("SELECT available_seats FROM rides WHERE id=?", (r[0],))
-                            current_seats = c.fetchone()
-                            if not current_seats or current_seats[0] <= 0:
-                                st.error(translate("Ce trajet n'est plus réservable ou n'a plus de sièges disponibles !"))
-                                st.rerun()
-                            else:
-                                c.execute("INSERT INTO bookings (user_id, ride_id) VALUES (?, ?)",
-                                          (st.session_state.current_user[0], r[0]))
-                                c.execute("UPDATE rides SET available_seats=available_seats-1 WHERE id=?", (r[0],))
-                                conn.commit()
-                                st.success(translate("Trajet réservé avec succès !"))
-                                st.rerun()
+                        # Réservation atomique : impossible de vendre deux fois le dernier siège
+                        if book_ride_db(st.session_state.current_user[0], r[0]):
+                            st.success(translate("Trajet réservé avec succès !"))
+                        else:
+                            st.error(translate("Ce trajet n'est plus réservable ou n'a plus de sièges disponibles !"))
+                        st.rerun()
+
+    if rows and has_more:
+        if st.button(translate("Charger plus de trajets"), key="display_rides_load_more"):
+            st.session_state.display_rides_pages = pages + 1
+            st.rerun()
 
     if st.button(translate("Retour au profil"), key="display_rides_back_button"):
         st.session_state.menu_selection = "profile"
         st.rerun()
 
 def show_offer_ride():
+    start_location = place_input(translate("Lieu de départ"), key="offer_start_location")
+    destination = place_input(translate("Destination"), key="offer_destination")
     with st.form(key="offer_ride_form"):
-        start_location = st.text_input(translate("Lieu de départ"), key="offer_start_location")
-        destination = st.text_input(translate("Destination"), key="offer_destination")
         date_input = st.date_input(translate("Date"), min_value=date.today(), key="offer_date")
         time_input = st.time_input(translate("Heure"), key="offer_time")
         available_seats = st.number_input(translate("Sièges disponibles"), min_value=1, step=1, value=1, key="offer_available_seats")
@@ -447,20 +523,16 @@ def show_offer_ride():
                     date_str = date_input.strftime("%d.%m.%Y")
                     time_str = time_input.strftime("%H:%M")
 
-                    with sqlite3.connect('priminsberg_rides.db') as conn:
-                        c = conn.cursor()
-                        c.execute("INSERT INTO rides (provider_id, start_location, destination, date, time, available_seats) VALUES (?, ?, ?, ?, ?, ?)",
-                                  (st.session_state.current_user[0], start_location, destination, date_str, time_str, available_seats))
-                        conn.commit()
+                    add_ride_db(st.session_state.current_user[0], start_location, destination, date_str, time_str, available_seats)
                     st.success(translate("Trajet créé avec succès !"))
                     st.rerun()
         with col2:
             if st.form_submit_button(translate("Retour au profil")):
                 st.session_state.menu_selection = "profile"
                 st.rerun()
+    start_location = place_input("Lieu de départ", key="offer_start_location")
+    destination = place_input("Destination", key="offer_destination")
     with st.form(key="offer_ride_form"):
-        start_location = st.text_input("Lieu de départ", key="offer_start_location")
-        destination = st.text_input("Destination", key="offer_destination")
         date_input = st.date_input("Date", min_value=date.today(), key="offer_date")
         time_input = st.time_input("Heure", key="offer_time")
         available_seats = st.number_input("Sièges disponibles", min_value=1, step=1, value=1, key="offer_available_seats")
@@ -475,11 +547,7 @@ def show_offer_ride():
                     date_str = date_input.strftime("%d.%m.%Y")
                     time_str = time_input.strftime("%H:%M")
 
-                    with sqlite3.connect('priminsberg_rides.db') as conn:
-                        c = conn.cursor()
-                        c.execute("INSERT INTO rides (provider_id, start_location, destination, date, time, available_seats) VALUES (?, ?, ?, ?, ?, ?)",
-                                  (st.session_state.current_user[0], start_location, destination, date_str, time_str, available_seats))
-                        conn.commit()
+                    add_ride_db(st.session_state.current_user[0], start_location, destination, date_str, time_str, available_seats)
                     st.success("Trajet créé avec succès !")
                     st.rerun()
         with col2:
@@ -0,0 +1,551 @@
+import threading
+import time
+import json
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from Geo_Fahrten import geocode_address, haversine_km
+from Connection_Fahrten import db_connection
+from Outbound_Fahrten import governed_call, http_get, ProviderUnavailable
+from Config_Fahrten import get_setting
+
+# Routing backend, selected with the ROUTING_BACKEND setting (env FAHRTEN_ROUTING_BACKEND or secrets.toml):
+#   "osrm"    - OSRM HTTP API at OSRM_BASE_URL (default: public demo server)
+#   "offline" - haversine x ROAD_FACTOR at AVERAGE_SPEED_KMH, no network at all
+#   "mock"    - OSRM HTTP against the local MockOsrm_Fahrten server, started on first use
+ROUTING_BACKEND = get_setting("ROUTING_BACKEND", "osrm")
+OSRM_BASE_URL = get_setting("OSRM_BASE_URL", "http://router.project-osrm.org")
+
+ROUTE_TTL_SECONDS = 7 * 24 * 3600  # Road network changes slowly; refresh weekly
+ROUTE_MEMORY_SIZE = 512
+ROUTE_COORD_PRECISION = 4          # ~11 m: same key for the "same" address geocoded twice
+
+# Offline estimator, also the fallback while OSRM is unavailable
+ROAD_FACTOR = get_setting("ROUTING_ROAD_FACTOR", 1.3, float)  # Typical road / great-circle distance ratio
+AVERAGE_SPEED_KMH = get_setting("ROUTING_AVERAGE_SPEED_KMH", 70.0, float)
+
+# OSRM's --max-table-size (default 100): larger matrices are split into several /table calls
+OSRM_TABLE_MAX_COORDINATES = get_setting("OSRM_TABLE_MAX_COORDINATES", 100, int)
+DISTANCE_MEMORY_SIZE = 20000       # Matrix cells are small; keep many more of them than routes
+
+PREFETCH_WORKERS = 8               # Shared by all sessions of the process
+PREFETCH_TIMEOUT_SECONDS = 15      # Upper bound for a whole prefetch, whatever the list size
+
+def route_key(start_coords, end_coords):
+    """Cache key for a route: both endpoints rounded to ROUTE_COORD_PRECISION decimals."""
+    return ",".join(f"{round(float(v), ROUTE_COORD_PRECISION):.{ROUTE_COORD_PRECISION}f}"
+                    for v in (start_coords[0], start_coords[1], end_coords[0], end_coords[1]))
+
+class RouteCache:
+    """
+    Cache of OSRM route results (distance, duration and geometry) keyed by rounded coordinates.
+    An in-memory LRU sits in front of the `route_cache` table so results survive restarts.
+    Entries past their TTL are still returned by get_stale() so a failed refresh can fall back
+    to them.
+    """
+
+    def __init__(self, max_entries=ROUTE_MEMORY_SIZE, ttl=ROUTE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (route, fetched_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _remember(self, key, route, fetched_at):
+        with self._lock:
+            self._memory[key] = (route, fetched_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        with db_connection() as conn:
+            row = conn.execute(
+                "SELECT distance_m, duration_s, geometry, fetched_at FROM route_cache WHERE route_key=?", (key,)
+            ).fetchone()
+        if not row:
+            return None
+        route = {
+            "distance_m": row[0],
+            "duration_s": row[1],
+            "geometry": [tuple(p) for p in json.loads(row[2])] if row[2] else None,
+        }
+        self._remember(key, route, row[3])
+        return route, row[3]
+
+    def get(self, start_coords, end_coords):
+        """Returns the cached route dict, or None when absent or stale."""
+        entry = self._lookup(route_key(start_coords, end_coords))
+        with self._lock:
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def get_stale(self, start_coords, end_coords):
+        """
+        Fallback after get() missed and the refresh failed: the cached route even past its TTL, or None.
+        The lookup was counted as a miss by get(); serving a stale route turns it into a stale hit.
+        """
+        entry = self._lookup(route_key(start_coords, end_coords))
+        if entry is None:
+            return None
+        with self._lock:
+            self.misses -= 1
+            self.stale_hits += 1
+        return entry[0]
+
+    def put(self, start_coords, end_coords, route):
+        key = route_key(start_coords, end_coords)
+        fetched_at = int(time.time())
+        geometry = json.dumps(route["geometry"]) if route.get("geometry") else None
+        with db_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO route_cache (route_key, distance_m, duration_s, geometry, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (key, route["distance_m"], route["duration_s"], geometry, fetched_at))
+            conn.commit()
+        self._remember(key, route, fetched_at)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+route_cache = RouteCache()
+
+class DistanceCache:
+    """
+    Cache of distance-matrix cells: {"distance_m", "duration_s"} of one origin/destination pair,
+    or None for a pair without a route. Keyed like RouteCache, with an in-memory LRU in front of
+    the `distance_cache` table; a cached full route also answers for its pair.
+    Works on many pairs at once so a matrix costs one SQL round trip, not one per cell.
+    """
+
+    def __init__(self, max_entries=DISTANCE_MEMORY_SIZE, ttl=ROUTE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (cell, fetched_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def _remember(self, entries):
+        with self._lock:
+            for key, entry in entries.items():
+                self._memory[key] = entry
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found, remaining = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = entry
+                else:
+                    remaining.append(key)
+        if not remaining:
+            return found
+        remaining = json.dumps(remaining)
+        with db_connection() as conn:
+            rows = conn.execute('''
+                SELECT route_key, distance_m, duration_s, fetched_at FROM distance_cache
+                WHERE route_key IN (SELECT value FROM json_each(?))
+                UNION ALL
+                SELECT route_key, distance_m, duration_s, fetched_at FROM route_cache
+                WHERE route_key IN (SELECT value FROM json_each(?))
+            ''', (remaining, remaining)).fetchall()
+        loaded = {}
+        for key, distance_m, duration_s, fetched_at in rows:
+            if key not in loaded or fetched_at > loaded[key][1]:  # Keep the freshest of both tables
+                cell = None if distance_m is None else {"distance_m": distance_m, "duration_s": duration_s}
+                loaded[key] = (cell, fetched_at)
+        self._remember(loaded)
+        found.update(loaded)
+        return found
+
+    def get_many(self, pairs):
+        """
+        Looks up (start_coords, end_coords) pairs.
+        Returns {pair: cell} for the pairs cached and fresh only (cell is None for a cached "no route").
+        """
+        keys = {pair: route_key(*pair) for pair in pairs}
+        entries = self._lookup(list(set(keys.values())))
+        now = time.time()
+        cells = {}
+        with self._lock:
+            for pair, key in keys.items():
+                entry = entries.get(key)
+                if entry is not None and now - entry[1] < self.ttl:
+                    self.hits += 1
+                    cells[pair] = entry[0]
+                else:
+                    self.misses += 1
+        return cells
+
+    def get_many_stale(self, pairs):
+        """
+        Fallback for pairs get_many() missed when the refresh failed: {pair: cell} for the cached
+        pairs even past their TTL. Each cell served turns its earlier miss into a stale hit.
+        """
+        keys = {pair: route_key(*pair) for pair in pairs}
+        entries = self._lookup(list(set(keys.values())))
+        cells = {pair: entries[key][0] for pair, key in keys.items() if key in entries}
+        with self._lock:
+            self.misses -= len(cells)
+            self.stale_hits += len(cells)
+        return cells
+
+    def put_many(self, cells):
+        """Stores {(start_coords, end_coords): cell or None} in both tiers."""
+        fetched_at = int(time.time())
+        entries = {route_key(*pair): (cell, fetched_at) for pair, cell in cells.items()}
+        with db_connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO distance_cache (route_key, distance_m, duration_s, fetched_at) VALUES (?, ?, ?, ?)",
+                [(key, cell and cell["distance_m"], cell and cell["duration_s"], fetched_at)
+                 for key, (cell, _) in entries.items()])
+            conn.commit()
+        self._remember(entries)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+distance_cache = DistanceCache()
+
+def estimate_straight_line_route(start_coords, end_coords):
+    """Rough route from the great-circle distance; never cached."""
+    distance_km = haversine_km(start_coords, end_coords) * ROAD_FACTOR
+    return {
+        "distance_m": distance_km * 1000,
+        "duration_s": distance_km / AVERAGE_SPEED_KMH * 3600,
+        "geometry": [tuple(start_coords), tuple(end_coords)],
+        "estimated": True,
+    }
+
+def estimate_straight_line_cell(start_coords, end_coords):
+    """Distance-matrix cell of estimate_straight_line_route (no geometry); never cached."""
+    route = estimate_straight_line_route(start_coords, end_coords)
+    return {"distance_m": route["distance_m"], "duration_s": route["duration_s"], "estimated": True}
+
+class RoutingBackend(ABC):
+    """
+    Interface of a routing backend.
+    route() returns {"distance_m", "duration_s", "geometry"} or None when there is no route,
+    and raises requests errors for outages so the governor can retry them.
+    table() returns one row per source with one {"distance_m", "duration_s"} cell (or None when
+    there is no route) per destination, and raises like route().
+    """
+    name = "base"
+    cacheable = False  # Whether results belong in the persistent route cache
+    governed = False   # Whether calls go through the "osrm" rate limiter / circuit breaker
+
+    @abstractmethod
+    def route(self, start_coords, end_coords):
+        """Route between two (lat, lon) points."""
+
+    @abstractmethod
+    def table(self, sources, destinations):
+        """Distance matrix from every source to every destination ((lat, lon) lists)."""
+
+class OsrmBackend(RoutingBackend):
+    """OSRM HTTP API (/route/v1/driving) at a configurable base URL."""
+    name = "osrm"
+    cacheable = True
+    governed = True
+
+    def __init__(self, base_url=OSRM_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+
+    def route(self, start_coords, end_coords):
+        """Single OSRM call returning distance, duration and the full GeoJSON geometry."""
+        osrm_url = (f"{self.base_url}/route/v1/driving/"
+                    f"{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
+                    "?overview=full&geometries=geojson")
+        response = http_get("osrm", osrm_url)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        route_data = response.json()
+        if route_data.get('code') != 'Ok':
+            return None
+        best = route_data['routes'][0]
+        return {
+            "distance_m": best['distance'],
+            "duration_s": best['duration'],
+            # OSRM returns [lon, lat]; folium and the rest of the app use (lat, lon)
+            "geometry": [(coord[1], coord[0]) for coord in best['geometry']['coordinates']],
+        }
+
+    def table(self, sources, destinations):
+        """Single OSRM /table call for the whole sources x destinations matrix."""
+        coordinates = ";".join(f"{lon},{lat}" for lat, lon in (*sources, *destinations))
+        osrm_url = (f"{self.base_url}/table/v1/driving/{coordinates}"
+                    f"?sources={';'.join(str(i) for i in range(len(sources)))}"
+                    f"&destinations={';'.join(str(len(sources) + j) for j in range(len(destinations)))}"
+                    "&annotations=distance,duration")
+        response = http_get("osrm", osrm_url)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        table_data = response.json()
+        if table_data.get('code') != 'Ok':
+            # Unlike /route, unreachable pairs are null cells; any other code is a bad request
+            raise ValueError(f"OSRM table answered {table_data.get('code')}: {table_data.get('message')}")
+        distances, durations = table_data['distances'], table_data['durations']
+        return [
+            [None if distances[i][j] is None or durations[i][j] is None
+             else {"distance_m": distances[i][j], "duration_s": durations[i][j]}
+             for j in range(len(destinations))]
+            for i in range(len(sources))
+        ]
+
+class OfflineBackend(RoutingBackend):
+    """Haversine distance x road factor at an average speed: instant, no network, good enough for load tests."""
+    name = "offline"
+
+    def route(self, start_coords, end_coords):
+        return estimate_straight_line_route(start_coords, end_coords)
+
+    def table(self, sources, destinations):
+        return [[estimate_straight_line_cell(s, d) for d in destinations] for s in sources]
+
+class MockOsrmBackend(OsrmBackend):
+    """OSRM HTTP against a local MockOsrm_Fahrten server (started once per process) for benchmarks and tests."""
+    name = "mock"
+    cacheable = False  # Synthetic routes must never end up in the shared cache
+    governed = False   # Benchmarks want the raw HTTP path, not the public server's rate limit
+
+    def __init__(self):
+        from MockOsrm_Fahrten import start_mock_osrm  # Imported lazily: it imports this module
+        self.server, base_url = start_mock_osrm()
+        super().__init__(base_url)
+
+_BACKENDS = {"osrm": OsrmBackend, "offline": OfflineBackend, "mock": MockOsrmBackend}
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_routing_backend():
+    """Returns the process-wide routing backend selected by the ROUTING_BACKEND setting."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _BACKENDS[ROUTING_BACKEND]()
+    return _backend
+
+def set_routing_backend(backend):
+    """Replaces the process-wide routing backend (benchmarks, tests); returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+def fetch_route(start_coords, end_coords):
+    """
+    Returns {"distance_m", "duration_s", "geometry"} for a driving route, or None.
+    For cacheable backends, fresh cache entries are served directly; stale ones are refreshed
+    and only returned as-is when the refresh fails. While the backend is unavailable (circuit
+    open or retries exhausted) and nothing is cached, a straight-line estimate is returned.
+    """
+    if not start_coords or not end_coords:
+        return None
+    backend = get_routing_backend()
+    if backend.cacheable:
+        route = route_cache.get(start_coords, end_coords)
+        if route is not None:
+            return route
+    return _refresh_route(backend, start_coords, end_coords)
+
+def _refresh_route(backend, start_coords, end_coords):
+    """fetch_route() after the cache lookup: asks the backend, falls back to a stale route or an estimate."""
+    try:
+        if backend.governed:
+            route = governed_call("osrm", backend.route, start_coords, end_coords,
+                                  retry_on=(requests.RequestException,))
+        else:
+            route = backend.route(start_coords, end_coords)
+    except (ProviderUnavailable, requests.RequestException) as e:
+        print(f"Error fetching route from {backend.name}: {e}")
+        stale = route_cache.get_stale(start_coords, end_coords) if backend.cacheable else None
+        return stale if stale is not None else estimate_straight_line_route(start_coords, end_coords)
+    except (ValueError, KeyError, IndexError) as e:
+        # Malformed answer: not an outage, nothing to retry
+        print(f"Unexpected {backend.name} response: {e}")
+        route = None
+    if not backend.cacheable:
+        return route
+    if route is None:
+        return route_cache.get_stale(start_coords, end_coords)
+    route_cache.put(start_coords, end_coords, route)
+    return route
+
+def _table_chunks(sources, destinations, max_coordinates=OSRM_TABLE_MAX_COORDINATES):
+    """Splits a matrix into sub-matrices of at most max_coordinates sources + destinations each."""
+    sources_per_call = min(len(sources), max(max_coordinates // 2, max_coordinates - len(destinations)))
+    destinations_per_call = max_coordinates - sources_per_call
+    for i in range(0, len(sources), sources_per_call):
+        for j in range(0, len(destinations), destinations_per_call):
+            yield sources[i:i + sources_per_call], destinations[j:j + destinations_per_call]
+
+def fetch_distance_matrix(sources, destinations):
+    """
+    Driving distances and durations from every source to every destination.
+    Args:
+        sources, destinations: Lists of (lat, lon) points.
+    Returns:
+        matrix[i][j] = {"distance_m", "duration_s"} from sources[i] to destinations[j], or None
+        when there is no route.
+    Cells are cached one by one (see DistanceCache), so a matrix overlapping earlier ones only
+    asks the backend for its missing cells, each /table call staying within
+    OSRM_TABLE_MAX_COORDINATES. While the backend is unavailable, missing
+    cells come from stale cache entries, else from the straight-line estimate ("estimated": True).
+    """
+    sources = [tuple(s) for s in sources]
+    destinations = [tuple(d) for d in destinations]
+    pairs = list(dict.fromkeys((s, d) for s in sources for d in destinations))
+    backend = get_routing_backend()
+    cells = distance_cache.get_many(pairs) if backend.cacheable else {}
+    # Sources missing the same destinations form one sub-matrix: a matrix that adds rows and
+    # columns to a cached one fetches the new rows, plus the new columns of the old rows
+    missing_by_source = {}
+    for s, d in pairs:
+        if (s, d) not in cells:
+            missing_by_source.setdefault(s, []).append(d)
+    blocks = {}
+    for s, missing_destinations in missing_by_source.items():
+        blocks.setdefault(tuple(missing_destinations), []).append(s)
+    chunks = [chunk for block_destinations, block_sources in blocks.items()
+              for chunk in _table_chunks(block_sources, list(block_destinations))]
+
+    for chunk_sources, chunk_destinations in chunks:
+        try:
+            if backend.governed:
+                table = governed_call("osrm", backend.table, chunk_sources, chunk_destinations,
+                                      retry_on=(requests.RequestException,))
+            else:
+                table = backend.table(chunk_sources, chunk_destinations)
+        except (ProviderUnavailable, requests.RequestException, ValueError, KeyError, IndexError) as e:
+            print(f"Error fetching distance matrix from {backend.name}: {e}")
+            chunk_pairs = [(s, d) for s in chunk_sources for d in chunk_destinations if (s, d) not in cells]
+            stale = distance_cache.get_many_stale(chunk_pairs) if backend.cacheable else {}
+            for pair in chunk_pairs:
+                cells[pair] = stale[pair] if pair in stale else estimate_straight_line_cell(*pair)
+            continue
+        fetched = {(s, d): table[i][j] for i, s in enumerate(chunk_sources) for j, d in enumerate(chunk_destinations)}
+        if backend.cacheable:
+            distance_cache.put_many(fetched)
+        cells.update(fetched)
+    return [[cells[(s, d)] for d in destinations] for s in sources]
+
+def passenger_detours(start_coords, end_coords, passengers):
+    """
+    Extra driving a ride costs its driver for each passenger taken alone, from one distance matrix.
+    Args:
+        passengers: List of (pickup_coords, dropoff_coords).
+    Returns:
+        One {"distance_m", "duration_s"} per passenger (start -> pickup -> drop-off -> end, minus
+        start -> end), or None for a passenger whose detour has no route.
+    """
+    pickups = [tuple(p) for p, _ in passengers]
+    dropoffs = [tuple(d) for _, d in passengers]
+    n = len(passengers)
+    # Rows: start, pickups, drop-offs; columns: pickups, drop-offs, end
+    matrix = fetch_distance_matrix([start_coords, *pickups, *dropoffs], [*pickups, *dropoffs, end_coords])
+    direct = matrix[0][2 * n]
+    detours = []
+    for k in range(n):
+        legs = (matrix[0][k], matrix[1 + k][n + k], matrix[1 + n + k][2 * n])
+        if direct is None or None in legs:
+            detours.append(None)
+            continue
+        detour = {field: sum(leg[field] for leg in legs) - direct[field] for field in ("distance_m", "duration_s")}
+        if any(cell.get("estimated") for cell in (direct, *legs)):
+            detour["estimated"] = True
+        detours.append(detour)
+    return detours
+
+def format_route_info(route):
+    """Formats a route as ("12.3 km", "1h05" / "45 min"), or (None, None) when unknown. Estimates get a "≈" prefix on the distance."""
+    if not route:
+        return None, None
+    distance_km = route["distance_m"] / 1000  # Convertir en km
+    duration_min = route["duration_s"] / 60   # Convertir en minutes
+    distance_str = f"{distance_km:.1f} km"
+    duration_str = f"{int(duration_min // 60)}h{int(duration_min % 60):02d}" if duration_min >= 60 else f"{int(duration_min)} min"
+    if route.get("estimated"):
+        # Straight-line estimate: keep calculate_arrival_time able to parse the duration
+        distance_str = f"≈ {distance_str}"
+    return distance_str, duration_str
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="geo-prefetch")
+
+def prefetch_geodata(addresses=(), coordinate_pairs=(), timeout=PREFETCH_TIMEOUT_SECONDS):
+    """
+    Resolves geocodes and routes for a whole page concurrently, before anything is rendered.
+    Args:
+        addresses: Addresses to geocode.
+        coordinate_pairs: (start_coords, end_coords) pairs to route.
+        timeout: Overall deadline in seconds; anything unresolved by then is left out.
+    Returns:
+        A tuple (coords, routes): coords maps address -> (lat, lon) or None,
+        routes maps (start_coords, end_coords) -> route dict or None.
+    """
+    addresses = list(dict.fromkeys(a for a in addresses if a))
+    pairs = list(dict.fromkeys((tuple(s), tuple(e)) for s, e in coordinate_pairs if s and e))
+    coords, routes = {}, {}
+
+    # Routes already cached are answered inline; only real misses go to the pool
+    backend = get_routing_backend()
+    pending_pairs = []
+    for pair in pairs:
+        route = route_cache.get(*pair) if backend.cacheable else None
+        if route is not None:
+            routes[pair] = route
+        else:
+            pending_pairs.append(pair)
+
+    futures = {}
+    for address in addresses:
+        futures[_prefetch_pool.submit(geocode_address, address)] = (coords, address)
+    for pair in pending_pairs:
+        futures[_prefetch_pool.submit(_refresh_route, backend, *pair)] = (routes, pair)  # Not looked up twice
+    if not futures:
+        return coords, routes
+
+    done, not_done = wait(futures, timeout=timeout)
+    for future in not_done:
+        future.cancel()
+    for future in done:
+        target, key = futures[future]
+        try:
+            target[key] = future.result()
+        except Exception as e:
+            print(f"Error prefetching {key}: {e}")
+            target[key] = None
+    return coords, routes
@@ -8,18 +8,21 @@ from datetime import date
 from PIL import Image
 import os
 import base64
+from Connection_Fahrten import db_connection
+from QueryCache_Fahrten import cached_query
 
 
-DB_FILE = 'priminsberg_rides.db'
+@cached_query(("users",))
 def get_user_by_username_db(username):
     """
-    Retrieves user information by username.
+    Retrieves user information by username (cached; user writes invalidate the "users" tag).
     Returns a tuple of user data or None if not found.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with db_connection() as conn:
         c = conn.cursor()
         c.execute('''
-            SELECT id, username, password, first_name, last_name, station, email, phone, driving_license_date, profile_picture 
+            SELECT id, username, password, first_name, last_name, station, email, phone, driving_license_date, profile_picture,
+                   station_lat, station_lon
             FROM users WHERE username = ?
         ''', (username,))
         return c.fetchone()
@@ -243,6 +246,34 @@ translations = {
         "Passagers / Mitfahrer",
     "Pas encore de passagers pour ce trajet.": 
         "Pas encore de passagers pour ce trajet. / Noch keine Mitfahrer für diese Fahrt.",
+    "Charger plus de trajets": 
+        "Charger plus de trajets / Weitere Fahrten laden",
+    "Rechercher un trajet": 
+        "Rechercher un trajet / Fahrt suchen",
+    "Rechercher": 
+        "Rechercher / Suchen",
+    "Réinitialiser": 
+        "Réinitialiser / Zurücksetzen",
+    "Du": 
+        "Du / Von",
+    "Au": 
+        "Au / Bis",
+    "Départ à moins de (km) de ma gare": 
+        "Départ à moins de (km) de ma gare / Abfahrt im Umkreis (km) meines Bahnhofs",
+    "0 = partout": 
+        "0 = partout / 0 = überall",
+    "Trier par": 
+        "Trier par / Sortieren nach",
+    "Pertinence": 
+        "Pertinence / Relevanz",
+    "Suggestions": 
+        "Suggestions / Vorschläge",
+    "Inclure les trajets qui passent près de ces lieux": 
+        "Inclure les trajets qui passent près de ces lieux / Auch Fahrten, die an diesen Orten vorbeifahren",
+    "Lieux introuvables : recherche le long de l'itinéraire ignorée.": 
+        "Lieux introuvables : recherche le long de l'itinéraire ignorée. / Orte nicht gefunden: Suche entlang der Route ignoriert.",
+    "Votre gare n'a pas pu être localisée : filtre de distance ignoré.": 
+        "Votre gare n'a pas pu être localisée : filtre de distance ignoré. / Ihr Bahnhof konnte nicht gefunden werden: Entfernungsfilter ignoriert.",
     "Réserver le trajet": 
         "Réserver le trajet / Fahrt buchen",
     "Ce trajet n'est plus réservable ou n'a plus de sièges disponibles !": 
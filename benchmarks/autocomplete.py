@@ -0,0 +1,132 @@
+"""
+Place-name autocomplete: the bisect prefix index vs. scanning every known spelling.
+
+    python benchmarks/autocomplete.py --places 20000 --queries 2000
+
+Place names are synthetic ("Ober-Wilstal", "Saint Brunach", ...), a few spellings per place,
+with a skewed number of rides per place. Prefixes are 1 to 6 characters of random words.
+The index is measured without database or network; a last check adds and edits rides in a
+scratch database and compares the live use counts with a reload.
+"""
+import os
+import re
+import sys
+import time
+import random
+import tempfile
+import argparse
+
+os.environ.setdefault("FAHRTEN_ROUTING_BACKEND", "offline")  # No network, no route cache writes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Locations_Fahrten import PlaceIndex, AUTOCOMPLETE_LIMIT, get_place_index, load_place_index, find_location
+from Geo_Fahrten import normalize_address
+from Connection_Fahrten import use_database, close_all_connections
+from Migrations_Fahrten import run_migrations
+from Database_Fahrten import add_ride_db, update_ride_db, register_user_db
+
+SYLLABLES = ["ber", "wil", "stal", "bru", "nach", "zü", "rich", "gen", "tal", "lau", "sanne", "mar", "burg",
+             "feld", "hof", "see", "dorf", "ach", "ing", "en", "ol", "ten", "ba", "sel", "lu", "zern"]
+PREFIXES = ["", "", "", "Ober-", "Unter-", "Saint ", "Bad "]
+
+def synthetic_places(count, rng):
+    """{location_id: (display name, [spellings], rides)}."""
+    places = {}
+    for location_id in range(1, count + 1):
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        name = rng.choice(PREFIXES) + word
+        spellings = [name, name.lower() + " ", f"{name}, Schweiz"]
+        places[location_id] = (name, spellings, int(rng.paretovariate(1.2)))
+    return places
+
+def linear_suggest(places, text, limit=AUTOCOMPLETE_LIMIT):
+    """Reference: same matching and ranking as PlaceIndex.suggest, by looking at every spelling."""
+    prefix = normalize_address(text)
+    matches = set()
+    for location_id, (name, spellings, _) in places.items():
+        for spelling in spellings:
+            alias = normalize_address(spelling)
+            words = [alias[match.start():] for match in re.finditer(r"\w+", alias)]
+            if any(word.startswith(prefix) for word in words):
+                matches.add(location_id)
+    best = sorted(matches, key=lambda i: (-places[i][2], places[i][0]))[:limit]
+    return [places[i][0] for i in best]
+
+def check_ride_edits():
+    """Places typed while adding or editing a ride are counted once per ride, as a reload counts them."""
+    use_database(os.path.join(tempfile.mkdtemp(), "autocomplete.db"))
+    run_migrations()
+    driver = register_user_db("driver", "x", "Driver", "Test", None, None, None)
+    places = {"Winterthur": (47.5, 8.72), "Zürich": (47.37, 8.54), "Bern": (46.95, 7.44), "Basel": (47.56, 7.59)}
+    index = get_place_index()
+    first = add_ride_db(driver, "Winterthur", "Zürich", "01.01.2099", "08:00", 3,
+                        start_coords=places["Winterthur"], dest_coords=places["Zürich"])
+    add_ride_db(driver, "Zürich", "Bern", "02.01.2099", "08:00", 3, start_coords=places["Zürich"], dest_coords=places["Bern"])
+    update_ride_db(first, "Winterthur", "Basel", "01.01.2099", "08:00", 3,  # New destination
+                   start_coords=places["Winterthur"], dest_coords=places["Basel"])
+    update_ride_db(first, "Winterthur", "Basel", "01.01.2099", "09:00", 2,  # Same places
+                   start_coords=places["Winterthur"], dest_coords=places["Basel"])
+    reloaded = load_place_index()
+    for name in ("Winterthur", "Basel", "Bern"):
+        location_id = find_location(name)[0]
+        assert index.uses[location_id] == reloaded.uses[location_id], f"{name}: {index.uses[location_id]} uses counted"
+    assert index.suggest("Ba") == ["Basel"]
+    close_all_connections()
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--places", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--check", type=int, default=20, help="Queries also answered by a linear scan and compared")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    places = synthetic_places(args.places, rng)
+    start = time.perf_counter()
+    index = PlaceIndex()
+    for location_id, (name, spellings, rides) in places.items():
+        for spelling in spellings:
+            index.add(location_id, name, normalize_address(spelling))
+        index.add_use(location_id, rides)
+    build_s = time.perf_counter() - start
+
+    # Incremental update, as on a ride insert: a new spelling, then one more ride
+    start = time.perf_counter()
+    index.add(args.places + 1, "Bad Neuwil", normalize_address("Bad Neuwil"))
+    index.add_use(args.places + 1)
+    places[args.places + 1] = ("Bad Neuwil", ["Bad Neuwil"], 1)
+    update_us = (time.perf_counter() - start) * 1e6
+
+    names = [p[0] for p in places.values()]
+    queries = []
+    for _ in range(args.queries):
+        word = rng.choice(rng.choice(names).replace("-", " ").split())
+        queries.append(word[:rng.randint(1, min(6, len(word)))])
+
+    timings = []
+    for text in queries:
+        start = time.perf_counter()
+        index.suggest(text)
+        timings.append((time.perf_counter() - start) * 1e6)
+
+    linear_us = []
+    for text in queries[:args.check]:
+        start = time.perf_counter()
+        expected = linear_suggest(places, text)
+        linear_us.append((time.perf_counter() - start) * 1e6)
+        assert index.suggest(text) == expected, f"Index and linear scan disagree on {text!r}"
+
+    print(f"{args.places} places, {len(index)} index entries, built in {build_s:.2f} s")
+    print(f"incremental update: {update_us:.0f} us")
+    print(f"prefix index: p50 {percentile(timings, 0.5):.0f} us, p99 {percentile(timings, 0.99):.0f} us, "
+          f"max {max(timings):.0f} us")
+    print(f"linear scan:  p50 {percentile(linear_us, 0.5) / 1000:.1f} ms over {len(linear_us)} queries")
+    assert percentile(timings, 0.99) < 1000, "Suggestions must come back in under a millisecond"
+
+    check_ride_edits()
+    print("ride edits: use counts match a reload")
@@ -0,0 +1,88 @@
+"""
+Hammers a single ride with concurrent bookings and checks that no seat is sold twice.
+
+    python benchmarks/booking_contention.py --sessions 32 --seats 10
+
+Each session is a thread with its own user trying to book the same ride, all released
+at once. Runs against a scratch database, never against priminsberg_rides.db.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Connection_Fahrten import db_connection, use_database, close_all_connections
+from Migrations_Fahrten import run_migrations
+from Database_Fahrten import add_ride_db, book_ride_db
+
+def seed(sessions, seats):
+    """Creates a driver, `sessions` passengers and one ride; returns (ride_id, passenger ids)."""
+    with db_connection() as conn:
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, 'x')",
+                         [(f"user{i}",) for i in range(sessions + 1)])
+        conn.commit()
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+    ride_id = add_ride_db(user_ids[0], "Zürich", "Bern", "01.01.2099", "08:00", seats,
+                          start_coords=(47.3769, 8.5417), dest_coords=(46.948, 7.4474))
+    return ride_id, user_ids[1:]
+
+def run(sessions, seats, attempts_per_session):
+    ride_id, passengers = seed(sessions, seats)
+    barrier = threading.Barrier(sessions)
+    results = []
+    results_lock = threading.Lock()
+
+    def session(user_id):
+        barrier.wait()
+        outcomes = [book_ride_db(user_id, ride_id) for _ in range(attempts_per_session)]
+        with results_lock:
+            results.extend(outcomes)
+
+    threads = [threading.Thread(target=session, args=(user_id,)) for user_id in passengers]
+    # book_ride_db prints every refused duplicate; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+    with db_connection() as conn:
+        booked = conn.execute("SELECT COUNT(*) FROM bookings WHERE ride_id=?", (ride_id,)).fetchone()[0]
+        seats_left = conn.execute("SELECT available_seats FROM rides WHERE id=?", (ride_id,)).fetchone()[0]
+    return {
+        "attempts": len(results),
+        "succeeded": sum(results),
+        "booked": booked,
+        "seats_left": seats_left,
+        "oversold": max(0, booked - seats) + max(0, -seats_left),
+        "consistent": booked + seats_left == seats,
+        "elapsed_s": elapsed,
+        "attempts_per_s": len(results) / elapsed if elapsed else float("inf"),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=32, help="Concurrent sessions (threads)")
+    parser.add_argument("--seats", type=int, default=10, help="Seats offered on the ride")
+    parser.add_argument("--attempts", type=int, default=3, help="Booking attempts per session")
+    args = parser.parse_args()
+
+    use_database(os.path.join(tempfile.mkdtemp(), "booking_benchmark.db"))
+    run_migrations()
+    report = run(args.sessions, args.seats, args.attempts)
+    close_all_connections()
+
+    print(f"{args.sessions} sessions x {args.attempts} attempts on a ride with {args.seats} seats")
+    print(f"  succeeded:   {report['succeeded']} / {report['attempts']}")
+    print(f"  booked:      {report['booked']} (seats left: {report['seats_left']})")
+    print(f"  oversold:    {report['oversold']}")
+    print(f"  throughput:  {report['attempts_per_s']:.0f} attempts/s ({report['elapsed_s'] * 1000:.1f} ms)")
+    assert report["oversold"] == 0 and report["consistent"], "Seats were oversold"
+    assert report["succeeded"] == report["booked"] == min(args.seats, args.sessions)
@@ -0,0 +1,91 @@
+"""
+Query cache coherence between processes: cost of a cache hit, and a booking made by another process.
+
+    python benchmarks/cache_coherence.py --rides 200 --hits 20000
+
+Two processes share a scratch database, as two Streamlit servers behind a load balancer would.
+This one caches the ride listing; a second process books a seat; the next listing read here
+must show it. Never runs against priminsberg_rides.db.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+
+os.environ.setdefault("FAHRTEN_ROUTING_BACKEND", "offline")  # No network, no route cache writes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Connection_Fahrten import db_connection, use_database, close_all_connections
+from Migrations_Fahrten import run_migrations
+from Database_Fahrten import add_ride_db, book_ride_db, search_rides_db, register_user_db
+from QueryCache_Fahrten import query_cache, change_log
+
+def seed(rides):
+    """A viewer, a driver offering `rides` rides and two passengers; returns their user ids."""
+    users = [register_user_db(name, "x", name.title(), "Test", None, None, None)
+             for name in ("viewer", "driver", "passenger", "other_passenger")]
+    for i in range(rides):
+        add_ride_db(users[1], f"Start {i}", f"Ziel {i}", f"{i % 28 + 1:02d}.01.2099", "08:00", 3,
+                    start_coords=(47.0 + i / 1000, 8.0), dest_coords=(46.5, 7.5 + i / 1000))
+    return users
+
+def hit_microseconds(viewer, hits):
+    start = time.perf_counter()
+    for _ in range(hits):
+        search_rides_db(viewer)
+    return (time.perf_counter() - start) / hits * 1e6
+
+def seats(viewer, ride_id):
+    rows, _ = search_rides_db(viewer, ride_ids=[ride_id])
+    return rows[0][6]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rides", type=int, default=200)
+    parser.add_argument("--hits", type=int, default=20000)
+    parser.add_argument("--book", nargs=3, metavar=("DB", "USER", "RIDE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.book:
+        # Second process: one booking, then exit
+        db_file, user_id, ride_id = args.book
+        use_database(db_file)
+        assert book_ride_db(int(user_id), int(ride_id))
+        sys.exit(0)
+
+    db_file = os.path.join(tempfile.mkdtemp(), "cache_coherence.db")
+    use_database(db_file)
+    run_migrations()
+    viewer, driver, passenger, other_passenger = seed(args.rides)
+    rows, _ = search_rides_db(viewer)
+    ride_id, free = rows[0][0], rows[0][6]
+
+    # Cost of a hit while nothing is written: one PRAGMA data_version, compared to no coherence at all
+    with_sync = hit_microseconds(viewer, args.hits)
+    query_cache.sync = None
+    without_sync = hit_microseconds(viewer, args.hits)
+    query_cache.sync = change_log.sync
+
+    # A booking in another process is seen here at the next read
+    reads = change_log.reads
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--book", db_file, str(passenger), str(ride_id)], check=True)
+    assert seats(viewer, ride_id) == free - 1, "Still serving the seats from before the other process's booking"
+    assert change_log.remote_invalidations > 0
+
+    # A booking made here was invalidated locally, and once more when its change_log row is read back
+    remote, own = change_log.remote_invalidations, change_log.own_invalidations
+    assert book_ride_db(other_passenger, ride_id)
+    assert seats(viewer, ride_id) == free - 2
+    assert change_log.remote_invalidations == remote, "Own writes must not be counted as another process's"
+    assert change_log.own_invalidations > own
+
+    with db_connection() as conn:
+        logged = conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+    stats = query_cache.stats()
+    close_all_connections()
+    print(f"cache hit: {with_sync:.1f} us with the data_version check, {without_sync:.1f} us without")
+    print(f"other process's booking seen at the next read ({change_log.reads - reads} change_log reads)")
+    print(f"{logged} change_log rows, {change_log.remote_invalidations} tags invalidated remotely, "
+          f"{change_log.own_invalidations} own tags again after commit, hit rate {stats['hit_rate']:.1%}")
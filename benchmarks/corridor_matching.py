@@ -0,0 +1,115 @@
+"""
+Route-corridor matching on synthetic routes: grid index vs. scanning every segment.
+
+    python benchmarks/corridor_matching.py --rides 2000 --queries 500
+
+Routes are random walks between random points of a ~200 x 200 km region, with one point
+every ~500 m (like OSRM geometries). Pickup/drop-off pairs are taken near random routes so
+that queries do find matches. No database or network is involved.
+"""
+import os
+import sys
+import math
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Matching_Fahrten import CorridorIndex, CORRIDOR_MAX_KM, CORRIDOR_CELL_KM, KM_PER_DEGREE
+
+REGION = (46.0, 6.0, 47.8, 8.8)  # min_lat, min_lon, max_lat, max_lon
+POINT_SPACING_KM = 0.5
+
+def project(point, origin):
+    """Equirectangular projection of (lat, lon) in km around origin."""
+    return ((point[1] - origin[1]) * KM_PER_DEGREE * math.cos(math.radians(origin[0])),
+            (point[0] - origin[0]) * KM_PER_DEGREE)
+
+def point_segment(p, a, b):
+    """Distance from p to segment ab (projected), and the position 0..1 of the closest point."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length2))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy), t
+
+def synthetic_route(rng):
+    start = (rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3]))
+    end = (rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3]))
+    length_km = math.hypot(*project(end, start))
+    points = max(2, int(length_km / POINT_SPACING_KM))
+    route, wobble = [], 0.0
+    for i in range(points):
+        f = i / (points - 1)
+        wobble = 0.9 * wobble + rng.gauss(0, 0.004)  # Roads are not straight lines
+        route.append((start[0] + (end[0] - start[0]) * f + wobble, start[1] + (end[1] - start[1]) * f - wobble))
+    return route
+
+def near(point, rng, km):
+    return (point[0] + rng.uniform(-km, km) / 111.2, point[1] + rng.uniform(-km, km) / 76.0)
+
+def brute_force_match(routes, pickup, dropoff, max_km):
+    """Reference: every segment of every route, same ordering rule as CorridorIndex.match."""
+    matched = set()
+    for ride_id, route in routes.items():
+        pick, drop = [], []
+        for i in range(len(route) - 1):
+            for target, hits in ((pickup, pick), (dropoff, drop)):
+                distance, t = point_segment((0.0, 0.0), project(route[i], target), project(route[i + 1], target))
+                if distance <= max_km:
+                    hits.append(i + t)
+        if pick and drop and min(pick) < max(drop):
+            matched.add(ride_id)
+    return matched
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rides", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--max-km", type=float, default=CORRIDOR_MAX_KM)
+    parser.add_argument("--cell-km", type=float, default=CORRIDOR_CELL_KM)
+    parser.add_argument("--check", type=int, default=10, help="Queries also answered by brute force and compared")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    routes = {ride_id: synthetic_route(rng) for ride_id in range(1, args.rides + 1)}
+    segments = sum(len(r) - 1 for r in routes.values())
+
+    start = time.perf_counter()
+    index = CorridorIndex(args.cell_km)
+    for ride_id, route in routes.items():
+        index.add_route(ride_id, route)
+    build_s = time.perf_counter() - start
+
+    queries = []
+    for _ in range(args.queries):
+        route = routes[rng.randint(1, args.rides)]
+        a, b = sorted(rng.sample(range(len(route)), 2))
+        queries.append((near(route[a], rng, args.max_km / 2), near(route[b], rng, args.max_km / 2)))
+
+    timings, matches = [], 0
+    for pickup, dropoff in queries:
+        start = time.perf_counter()
+        result = index.match(pickup, dropoff, args.max_km)
+        timings.append((time.perf_counter() - start) * 1000)
+        matches += len(result)
+
+    brute_ms = []
+    for pickup, dropoff in queries[:args.check]:
+        start = time.perf_counter()
+        expected = brute_force_match(routes, pickup, dropoff, args.max_km)
+        brute_ms.append((time.perf_counter() - start) * 1000)
+        got = {m["ride_id"] for m in index.match(pickup, dropoff, args.max_km)}
+        assert got == expected, f"Index and brute force disagree: {sorted(got ^ expected)[:10]}"
+
+    print(f"{args.rides} routes, {segments} segments, {len(index.cells)} grid cells ({args.cell_km} km), "
+          f"built in {build_s:.2f} s")
+    print(f"grid index:  p50 {percentile(timings, 0.5):.2f} ms, p95 {percentile(timings, 0.95):.2f} ms, "
+          f"{matches / len(queries):.1f} matches per query")
+    if brute_ms:
+        print(f"brute force: p50 {percentile(brute_ms, 0.5):.1f} ms over {len(brute_ms)} queries (results identical)")
@@ -0,0 +1,104 @@
+"""
+Distance matrices through OSRM /table vs. one /route call per pair, and cell reuse between matrices.
+
+    python benchmarks/distance_matrix.py --sources 10 --destinations 10 --latency 0.02
+
+Runs against the local mock OSRM server (with `latency` seconds per request, like a network
+round trip) and a scratch database, never against priminsberg_rides.db.
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Connection_Fahrten import use_database, close_all_connections
+from Migrations_Fahrten import run_migrations
+from MockOsrm_Fahrten import start_mock_osrm
+from Routing_Fahrten import (OsrmBackend, set_routing_backend, fetch_route, fetch_distance_matrix,
+                             passenger_detours, distance_cache)
+
+REGION = (46.0, 6.0, 47.8, 8.8)  # min_lat, min_lon, max_lat, max_lon
+
+class CountingMockBackend(OsrmBackend):
+    """OSRM HTTP against the mock server, cached like the real backend, counting calls and cells."""
+    name = "mock"
+    governed = False  # Measure the HTTP path, not the public server's rate limit
+
+    def __init__(self, base_url):
+        super().__init__(base_url)
+        self.route_calls = self.table_calls = self.table_cells = 0
+
+    def route(self, start_coords, end_coords):
+        self.route_calls += 1
+        return super().route(start_coords, end_coords)
+
+    def table(self, sources, destinations):
+        self.table_calls += 1
+        self.table_cells += len(sources) * len(destinations)
+        return super().table(sources, destinations)
+
+def points(rng, count):
+    return [(round(rng.uniform(REGION[0], REGION[2]), 4), round(rng.uniform(REGION[1], REGION[3]), 4))
+            for _ in range(count)]
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sources", type=int, default=10)
+    parser.add_argument("--destinations", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every mock answer")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    use_database(os.path.join(tempfile.mkdtemp(), "distance_matrix.db"))
+    run_migrations()
+    server, base_url = start_mock_osrm(latency=args.latency)
+    backend = CountingMockBackend(base_url)
+    set_routing_backend(backend)
+    rng = random.Random(args.seed)
+    sources, destinations = points(rng, args.sources), points(rng, args.destinations)
+    cells = args.sources * args.destinations
+
+    # Baseline: one /route call per pair (fresh points, so nothing is cached yet)
+    pair_sources, pair_destinations = points(rng, args.sources), points(rng, args.destinations)
+    routes, pairs_ms = timed(lambda: [[fetch_route(s, d) for d in pair_destinations] for s in pair_sources])
+
+    matrix, matrix_ms = timed(fetch_distance_matrix, sources, destinations)
+    calls_before = backend.table_calls
+    _, cached_ms = timed(fetch_distance_matrix, sources, destinations)
+    assert backend.table_calls == calls_before, "A repeated matrix must be answered from the cache"
+
+    # Half the sources and destinations already known: only the new rows/columns are fetched
+    cells_before = backend.table_cells
+    overlap_sources = sources[:args.sources // 2] + points(rng, args.sources - args.sources // 2)
+    overlap_destinations = destinations[:args.destinations // 2] + points(rng, args.destinations - args.destinations // 2)
+    _, overlap_ms = timed(fetch_distance_matrix, overlap_sources, overlap_destinations)
+    overlap_fetched = backend.table_cells - cells_before
+
+    # The matrix agrees with the per-pair routes (same synthetic road model)
+    check = fetch_distance_matrix(pair_sources, pair_destinations)
+    for i, row in enumerate(routes):
+        for j, route in enumerate(row):
+            assert abs(check[i][j]["distance_m"] - route["distance_m"]) < 1, "Matrix and /route disagree"
+
+    passengers = list(zip(sources[:5], destinations[:5]))
+    detours, detours_ms = timed(passenger_detours, sources[-1], destinations[-1], passengers)
+    assert all(d is not None and d["distance_m"] >= -1 for d in detours)
+
+    server.shutdown()
+    close_all_connections()
+    print(f"{args.sources} x {args.destinations} matrix, {args.latency * 1000:.0f} ms per request")
+    print(f"  per-pair /route:  {pairs_ms:.0f} ms ({backend.route_calls} requests)")
+    print(f"  one /table:       {matrix_ms:.0f} ms ({calls_before} request(s), {cells} cells)")
+    print(f"  repeated matrix:  {cached_ms:.1f} ms (0 requests)")
+    print(f"  50% overlap:      {overlap_ms:.0f} ms ({overlap_fetched} of {cells} cells fetched)")
+    print(f"  {len(passengers)} passenger detours: {detours_ms:.0f} ms")
+    print(f"  cell cache: {distance_cache.stats()}")
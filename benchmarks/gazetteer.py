@@ -0,0 +1,111 @@
+"""
+Offline gazetteer: streaming import of a GeoNames-style dump, then exact and fuzzy lookups.
+
+    python benchmarks/gazetteer.py --places 100000 --queries 1000
+
+The dump is synthetic (same 19 tab-separated columns as GeoNames, a few alternate names per
+place, plus the country and two places sharing a name). Lookups use misspelled names for the
+fuzzy part, and "Name, Qualifier" addresses must pick the place the qualifier is near. Runs against a scratch database,
+never against priminsberg_rides.db, and never calls an online provider.
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Connection_Fahrten import use_database, close_all_connections
+from Migrations_Fahrten import run_migrations
+from Gazetteer_Fahrten import import_gazetteer, gazetteer_lookup
+
+# Same name in two cities, the larger one first; the country row makes ", Maroc" a qualifier
+LANDMARKS = [
+    (900001, "Agdal", 34.0, -6.85, "P", "PPLX", 60000), (900002, "Rabat", 34.02, -6.84, "P", "PPLC", 580000),
+    (900003, "Agdal", 34.03, -5.01, "P", "PPLX", 20000), (900004, "Fès", 34.03, -5.0, "P", "PPLA", 1100000),
+    (900005, "Kingdom of Morocco", 32.0, -6.0, "A", "PCLI", 36000000),
+]
+
+SYLLABLES = ["ra", "bat", "sa", "lé", "tem", "ara", "kén", "itra", "khe", "mis", "set", "tif", "let", "zem",
+             "mour", "zaër", "sid", "di", "bou", "knad", "el", "ma", "ri", "har", "hou", "ja", "dida"]
+
+def synthetic_dump(path, places, rng):
+    """Writes a GeoNames-style TSV; returns {geonameid: (name, lat, lon)}."""
+    written = {}
+    with open(path, "w", encoding="utf-8") as f:
+        for geonameid in range(1, places + 1):
+            name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+            lat, lon = rng.uniform(33.5, 34.2), rng.uniform(-7.2, -6.3)
+            ascii_name = name.replace("é", "e").replace("ë", "e")
+            alternates = ",".join({name.upper(), f"{ascii_name} Ville"})
+            f.write("\t".join([str(geonameid), name, ascii_name, alternates, f"{lat:.5f}", f"{lon:.5f}",
+                               rng.choice("PPPAS"), "PPL", "MA", "", "04", "", "", "",
+                               str(int(rng.paretovariate(1.1) * 100)), "", "50", "Africa/Casablanca",
+                               "2024-01-01"]) + "\n")
+            written[geonameid] = (name, lat, lon)
+        for geonameid, name, lat, lon, feature_class, feature_code, population in LANDMARKS:
+            alternates = "Morocco,Maroc" if feature_code == "PCLI" else ""
+            f.write("\t".join([str(geonameid), name, name, alternates, f"{lat:.5f}", f"{lon:.5f}",
+                               feature_class, feature_code, "MA", "", "", "", "", "", str(population), "", "",
+                               "Africa/Casablanca", "2024-01-01"]) + "\n")
+    return written
+
+def misspell(name, rng):
+    """One dropped, doubled or swapped letter, away from the first one."""
+    i = rng.randrange(1, len(name) - 1)
+    return rng.choice([name[:i] + name[i + 1:], name[:i] + name[i] + name[i:],
+                       name[:i] + name[i + 1] + name[i] + name[i + 2:]])
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--places", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp()
+    dump = os.path.join(workdir, "synthetic_geonames.txt")
+    places = synthetic_dump(dump, args.places, rng)
+    use_database(os.path.join(workdir, "gazetteer.db"))
+    run_migrations()
+
+    start = time.perf_counter()
+    imported = import_gazetteer(dump, feature_classes="")
+    import_s = time.perf_counter() - start
+
+    sample = rng.sample(sorted(places), min(args.queries, len(places)))
+    results = {}
+    for kind, spell in (("exact", lambda name: name), ("accents/case", lambda name: f" {name.upper().replace('É', 'E')}, Maroc"),
+                        ("misspelled", lambda name: misspell(name, rng))):
+        timings, found = [], 0
+        for geonameid in sample:
+            name, lat, lon = places[geonameid]
+            query = spell(name)
+            start = time.perf_counter()
+            coords = gazetteer_lookup(query)
+            timings.append((time.perf_counter() - start) * 1000)
+            # Synthetic names repeat: any place of that name is a correct answer
+            found += coords is not None and any(
+                (round(c[1], 5), round(c[2], 5)) == (round(coords[0], 5), round(coords[1], 5))
+                for c in places.values() if c[0] == name) if kind != "misspelled" else coords is not None
+        results[kind] = (found, timings)
+
+    # The qualifier picks the Agdal of Fès; a qualifier the gazetteer cannot confirm leaves it to the providers
+    qualified = {address: gazetteer_lookup(address) for address in ("Agdal", "Agdal, Rabat", "Agdal, Fès",
+                                                                    "Agdal, Fes, Maroc", "Agdal, Tanger")}
+    close_all_connections()
+    assert qualified["Agdal"] == qualified["Agdal, Rabat"] == (34.0, -6.85), qualified
+    assert qualified["Agdal, Fès"] == qualified["Agdal, Fes, Maroc"] == (34.03, -5.01), qualified
+    assert qualified["Agdal, Tanger"] is None, qualified
+    print(f"Imported {imported} places in {import_s:.1f} s ({imported / import_s:.0f} places/s)")
+    for kind, (found, timings) in results.items():
+        print(f"  {kind:13} resolved {found}/{len(sample)}, p50 {percentile(timings, 0.5):.2f} ms, "
+              f"p95 {percentile(timings, 0.95):.2f} ms")
+    assert results["exact"][0] == len(sample) and results["accents/case"][0] == len(sample)
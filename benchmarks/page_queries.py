@@ -0,0 +1,106 @@
+"""
+Counts the SQL statements each ride page runs, for a small and a large number of rides.
+
+    python benchmarks/page_queries.py --small 10 --large 200
+
+The counts must not grow with the number of rides (no N+1 queries). Also opens and saves
+the edit form of a fully booked ride. Runs the pages through streamlit's AppTest against a
+scratch database, with the offline routing backend.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("FAHRTEN_ROUTING_BACKEND", "offline")  # No network, no route cache writes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.testing.v1 import AppTest
+from Connection_Fahrten import db_connection, use_database, close_all_connections, count_queries
+from Migrations_Fahrten import run_migrations
+from Database_Fahrten import add_ride_db, book_ride_db
+
+PAGES = ("show_display_rides", "show_my_rides")
+
+def _page_script(page):
+    import Rides
+    getattr(Rides, page)()
+
+def _edit_script(ride_id):
+    import Rides
+    Rides.edit_ride(ride_id)
+
+def check_edit_full_ride():
+    """A fully booked ride (no seat left) opens in the edit form and saves with 0 seats."""
+    use_database(os.path.join(tempfile.mkdtemp(), "edit_full_ride.db"))
+    run_migrations()
+    driver = seed(1)
+    with db_connection() as conn:
+        passenger_id = conn.execute("SELECT id FROM users WHERE username='passenger'").fetchone()[0]
+    ride_id = add_ride_db(driver[0], "Xanten", "Yverdon", "01.02.2099", "08:00", 1,
+                          start_coords=(51.66, 6.45), dest_coords=(46.78, 6.64))
+    assert book_ride_db(passenger_id, ride_id)
+    at = AppTest.from_function(_edit_script, args=(ride_id,), default_timeout=120)
+    at.session_state.current_user = driver
+    at.run()
+    assert not at.exception, f"edit_ride raised on a full ride: {[e.value for e in at.exception]}"
+    assert at.number_input(key=f"edit_available_seats_{ride_id}").value == 0
+    next(button for button in at.button if button.label == "Enregistrer").click()
+    at.run()
+    assert not at.exception and not at.error, [e.value for e in at.exception] + [e.value for e in at.error]
+    with db_connection() as conn:
+        assert conn.execute("SELECT available_seats FROM rides WHERE id=?", (ride_id,)).fetchone()[0] == 0
+    close_all_connections()
+
+def seed(rides):
+    """Two drivers offering `rides` rides each, each ride with one passenger; returns (viewer, driver) user rows."""
+    with db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (username, password, first_name, last_name, email, phone) VALUES (?, 'x', ?, 'Test', ?, '000')",
+            [(name, name.title(), f"{name}@example.com") for name in ("viewer", "driver", "passenger")])
+        conn.commit()
+        users = {row[1]: row for row in conn.execute(
+            "SELECT id, username, password, first_name, last_name, station, email, phone, driving_license_date, profile_picture FROM users")}
+    for i in range(rides):
+        day = f"{i % 28 + 1:02d}.01.2099"
+        for driver in ("viewer", "driver"):
+            ride_id = add_ride_db(users[driver][0], f"Start {i}", f"Ziel {i}", day, "08:00", 3,
+                                  start_coords=(47.0 + i / 1000, 8.0), dest_coords=(46.5, 7.5 + i / 1000))
+            book_ride_db(users["passenger"][0], ride_id)
+    return users["viewer"]
+
+def measure(rides):
+    """Returns {page: (statements, seconds)} for a fresh database holding `rides` rides per driver."""
+    use_database(os.path.join(tempfile.mkdtemp(), f"page_queries_{rides}.db"))
+    run_migrations()
+    viewer = seed(rides)
+    results = {}
+    for page in PAGES:
+        at = AppTest.from_function(_page_script, args=(page,), default_timeout=120)
+        at.session_state.current_user = viewer
+        with count_queries() as statements:
+            start = time.perf_counter()
+            at.run()
+            elapsed = time.perf_counter() - start
+        assert not at.exception, f"{page} raised: {[e.value for e in at.exception]}"
+        results[page] = (len(statements), elapsed)
+    close_all_connections()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--small", type=int, default=10, help="Rides per driver in the small run")
+    parser.add_argument("--large", type=int, default=200, help="Rides per driver in the large run")
+    args = parser.parse_args()
+
+    # First: the place suggestions of the edit form are loaded from the first database used
+    check_edit_full_ride()
+    print("A fully booked ride can be edited.")
+    small, large = measure(args.small), measure(args.large)
+    for page in PAGES:
+        print(f"{page}: {small[page][0]} statements ({args.small} rides, {small[page][1] * 1000:.0f} ms), "
+              f"{large[page][0]} statements ({args.large} rides, {large[page][1] * 1000:.0f} ms)")
+    for page in PAGES:
+        assert small[page][0] == large[page][0], f"{page} runs more queries as rides grow (N+1)"
+    print("Query counts are constant.")
@@ -0,0 +1,67 @@
+"""
+Query result cache: SQL statements and time of a ride page rerun, cold and warm, and after a booking.
+
+    python benchmarks/query_cache.py --rides 200 --reruns 20
+
+A rerun that changes nothing must not read the listings again; a booking must invalidate them.
+Runs the pages through streamlit's AppTest against a scratch database, with the offline routing backend.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("FAHRTEN_ROUTING_BACKEND", "offline")  # No network, no route cache writes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit.testing.v1 import AppTest
+from Connection_Fahrten import use_database, close_all_connections, count_queries
+from Migrations_Fahrten import run_migrations
+from Database_Fahrten import book_ride_db, search_rides_db, register_user_db
+from QueryCache_Fahrten import query_cache
+from page_queries import PAGES, _page_script, seed
+
+def rerun(app):
+    """Returns (statements, milliseconds) of one run of the page."""
+    with count_queries() as statements:
+        start = time.perf_counter()
+        app.run()
+        elapsed = (time.perf_counter() - start) * 1000
+    assert not app.exception, [e.value for e in app.exception]
+    return len(statements), elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rides", type=int, default=200, help="Rides per driver")
+    parser.add_argument("--reruns", type=int, default=20, help="Warm reruns per page")
+    args = parser.parse_args()
+
+    use_database(os.path.join(tempfile.mkdtemp(), "query_cache.db"))
+    run_migrations()
+    viewer = seed(args.rides)
+    apps = {}
+    for page in PAGES:
+        apps[page] = AppTest.from_function(_page_script, args=(page,), default_timeout=120)
+        apps[page].session_state.current_user = viewer
+        cold = rerun(apps[page])
+        warm = [rerun(apps[page]) for _ in range(args.reruns)]
+        print(f"{page}: cold {cold[0]} statements, {cold[1]:.0f} ms; "
+              f"warm {max(s for s, _ in warm)} statements, {sorted(ms for _, ms in warm)[len(warm) // 2]:.0f} ms (median)")
+        assert max(s for s, _ in warm) < cold[0], f"{page} reruns query as much as a cold run"
+
+    # A booking drops the listings: the next run reads them again and shows one seat less
+    rows, _ = search_rides_db(viewer[0], limit=1)
+    ride_id, seats = rows[0][0], rows[0][6]
+    assert book_ride_db(register_user_db("late_passenger", "x", "Late", "Test", None, None, None), ride_id)
+    statements, _ = rerun(apps["show_display_rides"])
+    rows, _ = search_rides_db(viewer[0], ride_ids=[ride_id])
+    assert rows[0][6] == seats - 1, "Listing still shows the seats from before the booking"
+    print(f"after a booking: {statements} statements")
+
+    stats = query_cache.stats()
+    close_all_connections()
+    print(f"hit rate {stats['hit_rate']:.0%} ({stats['hits']} hits, {stats['misses']} misses), "
+          f"{stats['entries']} entries, {stats['bytes'] / 1024:.0f} KiB, {stats['invalidations']} invalidated")
+    for name, counters in stats["functions"].items():
+        print(f"  {name:26} {counters['hits']:5} hits {counters['misses']:4} misses ({counters['hit_rate']:.0%})")
@@ -0,0 +1,135 @@
+"""
+Relevance ranking of bookable rides: one NumPy pass vs. scoring ride by ride in Python, and the
+whole path of a page rerun, from the cached ride columns to the ranked ids.
+
+    python benchmarks/ranking.py --rides 50000 --repeat 20
+
+Rides are synthetic (a few without coordinates, as before geocoding), written to a scratch
+database for the end-to-end timing. No network is involved.
+"""
+import os
+import sys
+import math
+import time
+import random
+import tempfile
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from Ranking_Fahrten import rank_rides, relevance_scores, RANKING_WEIGHTS, DISTANCE_SCALE_KM, TIME_SCALE_HOURS
+from Geo_Fahrten import haversine_km
+from Connection_Fahrten import db_connection, use_database, close_all_connections
+from Migrations_Fahrten import run_migrations
+from Database_Fahrten import get_ride_candidates_db
+from QueryCache_Fahrten import query_cache
+
+REGION = (46.0, 6.0, 47.8, 8.8)  # min_lat, min_lon, max_lat, max_lon
+STATION = (47.3769, 8.5417)
+DESTINATION = (46.948, 7.4474)
+REFERENCE_TIME = datetime(2099, 1, 1, 6, 0)
+END_TO_END_BUDGET_MS = 40.0  # Candidates -> ranked ids of a rerun, for 50000 rides
+
+def synthetic_candidates(rides, rng):
+    def point():
+        if rng.random() < 0.02:
+            return None, None
+        return rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3])
+    rows = []
+    for ride_id in range(1, rides + 1):
+        departure = REFERENCE_TIME + timedelta(minutes=rng.randrange(60 * 24 * 30))
+        rows.append((ride_id, *point(), *point(), departure.strftime("%Y-%m-%d %H:%M")))
+    rows.sort(key=lambda row: (row[5], row[0]))
+    return rows
+
+def seed(candidates):
+    """Scratch database with every candidate offered by 'driver'; 'viewer' booked every 10th ride. Returns the viewer id."""
+    use_database(os.path.join(tempfile.mkdtemp(), "ranking.db"))
+    run_migrations()
+    with db_connection() as conn:
+        conn.executemany("INSERT INTO users (username, password, first_name, last_name) VALUES (?, 'x', ?, 'Test')",
+                         [("viewer", "Viewer"), ("driver", "Driver")])
+        users = dict(conn.execute("SELECT username, id FROM users"))
+        conn.executemany('''
+            INSERT INTO rides (id, provider_id, start_location, destination, date, time, available_seats,
+                               start_lat, start_lon, dest_lat, dest_lon, departure_at)
+            VALUES (?, ?, ?, ?, ?, ?, 3, ?, ?, ?, ?, ?)''',
+            [(ride_id, users["driver"], f"Start {ride_id}", f"Ziel {ride_id}",
+              f"{departure_at[8:10]}.{departure_at[5:7]}.{departure_at[:4]}", departure_at[11:],
+              start_lat, start_lon, dest_lat, dest_lon, departure_at)
+             for ride_id, start_lat, start_lon, dest_lat, dest_lon, departure_at in candidates])
+        conn.executemany("INSERT INTO bookings (user_id, ride_id) VALUES (?, ?)",
+                         [(users["viewer"], ride_id) for ride_id in range(10, len(candidates) + 1, 10)])
+        conn.commit()
+    return users["viewer"]
+
+def rerun_ranking(user_id):
+    """What Rides.load_ranked_rides does before reading the shown rows."""
+    return rank_rides(get_ride_candidates_db(user_id), STATION, DESTINATION, REFERENCE_TIME)
+
+def python_rank(candidates, station, destination, reference_time):
+    """Reference: the same score as Ranking_Fahrten.relevance_scores, one ride at a time."""
+    def closeness(point, lat, lon):
+        return 0.0 if lat is None else math.exp(-haversine_km(point, (lat, lon)) / DISTANCE_SCALE_KM)
+    scored = []
+    for ride_id, start_lat, start_lon, dest_lat, dest_lon, departure_at in candidates:
+        hours = (datetime.strptime(departure_at, "%Y-%m-%d %H:%M") - reference_time).total_seconds() / 3600
+        score = (RANKING_WEIGHTS["station"] * closeness(station, start_lat, start_lon)
+                 + RANKING_WEIGHTS["destination"] * closeness(destination, dest_lat, dest_lon)
+                 + RANKING_WEIGHTS["time"] * math.exp(-max(hours, 0.0) / TIME_SCALE_HOURS))
+        scored.append((score, ride_id))
+    return [ride_id for _, ride_id in sorted(scored, key=lambda s: -s[0])]
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, min(timings)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rides", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per implementation (best time is reported)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    candidates = synthetic_candidates(args.rides, random.Random(args.seed))
+    # The scoring pass alone, on columns already converted to arrays
+    ids, start_lat, start_lon, dest_lat, dest_lon, departure_at = zip(*candidates)
+    columns = (*np.array([start_lat, start_lon, dest_lat, dest_lon], dtype=float),
+               np.array(departure_at, dtype="datetime64[m]"))
+    _, scoring_ms = best_of(args.repeat, relevance_scores, *columns, STATION, DESTINATION, REFERENCE_TIME)
+    reference, python_ms = best_of(max(1, args.repeat // 5), python_rank, candidates, STATION, DESTINATION,
+                                   REFERENCE_TIME)
+
+    viewer = seed(candidates)
+    start = time.perf_counter()
+    rerun_ranking(viewer)
+    cold_ms = (time.perf_counter() - start) * 1000
+    vectorized, numpy_ms = best_of(args.repeat, rerun_ranking, viewer)
+    cached_bytes = query_cache.stats()["bytes"]
+    with db_connection() as conn:
+        driver = conn.execute("SELECT id FROM users WHERE username='driver'").fetchone()[0]
+    assert rerun_ranking(driver) == [], "A driver's own rides must not be candidates"
+    close_all_connections()
+
+    print(f"{args.rides} candidate rides")
+    print(f"numpy:  {numpy_ms:.1f} ms from cached columns to ranked ids ({scoring_ms:.1f} ms of vectorized scoring,"
+          f" {cold_ms:.1f} ms when the columns are read again)")
+    print(f"python: {python_ms:.1f} ms ({python_ms / numpy_ms:.0f}x slower)")
+    print(f"cache:  {cached_bytes / 1e6:.1f} MB shared by every user")
+    budget = END_TO_END_BUDGET_MS * max(1, args.rides / 50000)
+    assert numpy_ms < budget, f"Ranking a rerun took {numpy_ms:.1f} ms (budget {budget:.0f} ms)"
+    assert query_cache.stats()["bytes"] == cached_bytes, "Another user's ranking must reuse the cached columns"
+    # The viewer cannot book the rides they already booked
+    reference = [ride_id for ride_id in reference if ride_id % 10]
+    # Float rounding may swap rides whose scores are equal to the last bits; compare the top of the list
+    top = min(100, len(reference))
+    assert vectorized[:top] == reference[:top], "NumPy and pure-Python rankings disagree"
+    assert sorted(vectorized) == sorted(reference)
+    print(f"Top {top} rides identical.")